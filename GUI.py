@@ -2,6 +2,8 @@ import tkinter as tk
 from tkinter import ttk
 import app
 
+app.ensure_schema(app.db.DB_PATH)
+
 # window 
 window = tk.Tk()
 window.title("Pairfect")
@@ -1,12 +1,27 @@
 ###### packages and dependencies ######
-import sqlite3
-
-import numpy as np
-import pandas as pd
+import sys
+import threading
+import time
+
+import db
+import swipelog
+import tracing
+from credentials import NegativeCache, dummy_hash, hash_password, needs_rehash, verify_password
+from schema import ensure_schema
+from vocab import (MAX_AGE, VALID_AGES, VALID_CITIES, VALID_GENDER_PREFERENCES, VALID_GENDERS, VALID_INTERESTS,
+                   VALID_MBTI)
 
 ####################################################################################################
 ###### USER ######
+# Value of a relationship slot not read from the database yet (see fetch_user)
+_UNLOADED = object()
+
 class User:
+    # No per-instance __dict__; the three relationship sets are only allocated when first used,
+    # so users loaded as candidates or for listings carry none of them
+    __slots__ = ('user_id', 'name', 'password', 'MBTI', 'age', 'gender', 'location', 'interests',
+                 '_liked_users', '_disliked_users', '_matches')
+
     def __init__(self, user_id, name, password, MBTI, age, gender, location, interests,
                  liked_users=None, disliked_users=None, matches=None):
         self.user_id = user_id
@@ -17,21 +32,53 @@ class User:
         self.gender = gender
         self.location = location
         self.interests = interests
-        self.liked_users = liked_users if liked_users is not None else []
-        self.disliked_users = disliked_users if disliked_users is not None else []
-        self.matches = matches if matches is not None else []
+        # Sets of user ids, membership checks do not depend on the history size
+        self.liked_users = liked_users
+        self.disliked_users = disliked_users
+        self.matches = matches
+
+    def _relationship(slot):
+        def get(self):
+            ids = getattr(self, slot)
+            if ids is _UNLOADED:
+                self.load_relationships()
+                ids = getattr(self, slot)
+            if ids is None:
+                ids = set()
+                setattr(self, slot, ids)
+            return ids
+        def set_(self, ids):
+            # Frozensets are kept as they are, for read-only copies (see snapshot)
+            setattr(self, slot, ids if ids is None or ids is _UNLOADED or isinstance(ids, frozenset) else set(ids))
+        return property(get, set_)
+
+    liked_users = _relationship('_liked_users')
+    disliked_users = _relationship('_disliked_users')
+    matches = _relationship('_matches')
+    del _relationship
+
+    def load_relationships(self):
+        """Read the sets left unloaded by fetch_user from the swipes and matches tables."""
+        with db.connection() as conn:
+            relationships = db.fetch_relationships(conn, self.user_id)
+        for slot, ids in zip(('_liked_users', '_disliked_users', '_matches'), relationships):
+            if getattr(self, slot) is _UNLOADED:
+                setattr(self, slot, ids)
+
+    def snapshot(self):
+        """Copy with frozen relationship sets, for another thread to read while this user swipes."""
+        return User(self.user_id, self.name, self.password, self.MBTI, self.age, self.gender, self.location,
+                    list(self.interests), frozenset(self.liked_users), frozenset(self.disliked_users),
+                    frozenset(self.matches))
         
 
+    # Whether a like completes a match is decided by db.record_swipe, from the reverse like
+    # stored in swipes; the caller then adds the match to both users
     def like(self, other_user):
-        if other_user.user_id not in self.liked_users:
-            self.liked_users.append(other_user.user_id)
-        if self.user_id in other_user.liked_users and other_user.user_id not in self.matches:
-            self.matches.append(other_user.user_id)
-            other_user.matches.append(self.user_id)
+        self.liked_users.add(other_user.user_id)
 
     def dislike(self, other_user):
-        if other_user.user_id not in self.disliked_users:
-            self.disliked_users.append(other_user.user_id)
+        self.disliked_users.add(other_user.user_id)
 
     # adding data field name for easy reading
     def __repr__(self):
@@ -42,7 +89,8 @@ class User:
 
     ###### Data formatting ######
     def object_to_db(self):
-        """Convert the user data to a format suitable for the database."""
+        """Convert the user profile to a format suitable for the database.
+        Likes, dislikes and matches are stored in the swipes and matches tables."""
         return (
             self.user_id,
             self.name,
@@ -51,16 +99,13 @@ class User:
             self.age,
             self.gender,
             self.location,
-            ','.join(self.interests),
-            ','.join(map(str, self.liked_users)),
-            ','.join(map(str, self.disliked_users)),
-            ','.join(map(str, self.matches))
+            ','.join(self.interests)
         )
 
     @staticmethod
-    def db_to_object(data):
-        """Create a User object from a database record."""
-        user_id, name, password, MBTI, age, gender, location, interests, liked_users, disliked_users, matches = data
+    def db_to_object(data, liked_users=None, disliked_users=None, matches=None):
+        """Create a User object from a users record (db.USER_COLUMNS) and its relationship sets."""
+        user_id, name, password, MBTI, age, gender, location, interests = data[:8]
         
         return User(
             user_id,
@@ -71,86 +116,112 @@ class User:
             gender,
             location,
             interests.split(',') if interests else [],
-            list(map(int, liked_users.split(','))) if liked_users else [],
-            list(map(int, disliked_users.split(','))) if disliked_users else [],
-            list(map(int, matches.split(','))) if matches else []
+            liked_users,
+            disliked_users,
+            matches
         )
+
+    @staticmethod
+    def db_rows_to_users(rows):
+        """Create User objects from many users records (db.USER_COLUMNS) without relationships.
+
+        SQLite returns a new string object for every value, so the MBTI, gender, location
+        and interest strings repeated across rows are shared through one dict instead.
+        """
+        shared = {}
+        share = lambda value: shared.setdefault(value, value)
+        users = []
+        for user_id, name, password, MBTI, age, gender, location, interests in rows:
+            users.append(User(
+                user_id,
+                name,
+                password,
+                share(MBTI),
+                age,
+                share(gender),
+                share(location),
+                [share(interest) for interest in interests.split(',')] if interests else [],
+            ))
+        return users
 ####################################################################################################
 
 
 ####################################################################################################
 ###### Database Manipulation ######
+# All SQL lives in db.py; connections come from its pool (db.DB_PATH, 'users.db' by default)
 def insert_user(user):
     try:
-        conn = sqlite3.connect('users.db')    
-        cursor = conn.cursor()    
-        cursor.execute('''
-            INSERT INTO users (name, password, MBTI, age, gender, location, interests, liked_users, disliked_users, matches)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', user.object_to_db()[1:])
+        with db.transaction() as conn:
+            db.insert_user(conn, user.object_to_db()[1:])
     except Exception as e:
-        conn.close()
         print('Exception: {}'.format(e))
         raise Exception(e)
-    else:
-        conn.commit()
-        conn.close()
+    failed_logins.invalidate(user.name)
 
 def update_user(user):
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE users
-            SET name = ?, password = ?, MBTI = ?, age = ?, gender = ?, location = ?, interests = ?, liked_users = ?, disliked_users = ?, matches = ?
-            WHERE user_id = ?
-        ''', (*user.object_to_db()[1:], user.user_id))
+        with db.transaction() as conn:
+            db.update_user(conn, user.user_id, user.object_to_db()[1:])
     except Exception as e:
-        conn.close()
         print('Exception: {}'.format(e))
         raise Exception(e)
-    else:
-        conn.commit()
-        conn.close() 
+    failed_logins.invalidate(user.name)
+
+# Write-behind swipe log, off unless enable_swipe_log() is called. With it, record_swipe returns
+# once the swipe is durable in the log; the match it may make is found when the log is applied,
+# and reported through tail_match_events.
+swipe_log = None
+
+def enable_swipe_log(path, window_ms=swipelog.WINDOW_MS):
+    global swipe_log
+    count_matches = lambda records, matched: tracing.count('matches', len(matched))
+    swipe_log = swipelog.SwipeLog(path, db.DB_PATH, window_ms, on_apply=count_matches)
+    return swipe_log
+
+# Store one like/dislike of src about dst. Returns True if the like created a new match,
+# None with the swipe log on.
+def record_swipe(src_id, dst_id, kind):
+    try:
+        if swipe_log is not None:
+            swipe_log.append(src_id, dst_id, kind)
+            matched = None
+        else:
+            with db.transaction() as conn:
+                matched = db.record_swipe(conn, src_id, dst_id, kind, time.time())
+    except Exception as e:
+        print('Exception: {}'.format(e))
+        raise Exception(e)
+    on_swipe(src_id, dst_id)
+    tracing.count('swipes')
+    if matched is not None:
+        tracing.count('matches', int(matched))
+    return matched
+
+def tail_match_events(after_seq=None, poll_interval=1.0):
+    """Yield (seq, user_id, other_id, ts) for every match made after after_seq, waiting for new ones.
+
+    With after_seq None, only matches made from now on are yielded. A consumer that stores the
+    seq of the last event it handled resumes from it without missing or repeating a match.
+    """
+    with db.connection() as conn:
+        if after_seq is None:
+            after_seq = db.last_match_event(conn)
+    while True:
+        with db.connection() as conn:
+            events = db.fetch_match_events(conn, after_seq)
+        yield from events
+        if events:
+            after_seq = events[-1][0]
+        if len(events) < db.PAGE_SIZE:
+            time.sleep(poll_interval)
 
 def delete_user(user_id):
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-
-    # First, update other users' liked_users, disliked_users, and matches lists to remove this user
-    cursor.execute('SELECT * FROM users')
-    all_users = cursor.fetchall()
-
-    for user_data in all_users:
-        (current_user_id, name, password, MBTI, age, gender, location, interests, liked_users, disliked_users, matches) = user_data
-
-        liked_users_list = list(map(int, liked_users.split(','))) if liked_users else []
-        disliked_users_list = list(map(int, disliked_users.split(','))) if disliked_users else []
-        matches_list = list(map(int, matches.split(','))) if matches else []
-
-        if user_id in liked_users_list:
-            liked_users_list.remove(user_id)
-        if user_id in disliked_users_list:
-            disliked_users_list.remove(user_id)
-        if user_id in matches_list:
-            matches_list.remove(user_id)
-
-        # Update the current user with the modified lists
-        liked_users = ','.join(map(str, liked_users_list))
-        disliked_users = ','.join(map(str, disliked_users_list))
-        matches = ','.join(map(str, matches_list))
-
-        cursor.execute('''
-            UPDATE users
-            SET liked_users = ?, disliked_users = ?, matches = ?
-            WHERE user_id = ?
-        ''', (liked_users, disliked_users, matches, current_user_id))
-
-    # Now delete the user from the database
-    cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
-
-    conn.commit()
-    conn.close()
+    try:
+        with db.transaction() as conn:
+            db.delete_user(conn, user_id)
+    except Exception as e:
+        print('Exception: {}'.format(e))
+        raise Exception(e)
 
     print("User deleted successfully! Logged out!")
 
@@ -159,11 +230,11 @@ def delete_user(user_id):
 def create_user():
     # user_id is auto-generated by the database
     name = input("Enter name: ")
-    password = input("Enter password: ")
+    password = hash_password(input("Enter password: "))
     
     # Take user input and check database constraints
     MBTI = input("Enter MBTI: ")
-    while MBTI not in ("ISTJ", "ISFJ", "INFJ", "INTJ", "ISTP", "ISFP", "INFP", "INTP", "ESTP", "ESFP", "ENFP", "ENTP", "ESTJ", "ESFJ", "ENFJ", "ENTJ"):
+    while MBTI not in VALID_MBTI:
         MBTI = input("Please enter a valid MBTI: ") 
 
     age = input("Enter age: ")
@@ -173,10 +244,12 @@ def create_user():
         except:
             age = input("Please enter an integer: ") 
         else:
-            break
+            if age in VALID_AGES:
+                break
+            age = input("Please enter an age from 1 to {}: ".format(MAX_AGE))
 
     gender = input("Enter gender (Female/Male): ")
-    while gender not in ("Female", "Male"):
+    while gender not in VALID_GENDERS:
         gender = input("Please enter a valid gender: ")
     
     location = input('''Enter a city from the following list: 
@@ -188,14 +261,7 @@ def create_user():
                      Pickering, Richmond Hill, Sarnia,Sault Ste. Marie,
                      St. Catharines, Thunder Bay, Toronto, Vaughan,
                      Waterloo, Welland, Windsor\n''')
-    while location not in ("Barrie", "Belleville", "Brampton", "Brantford", 
-                           "Burlington", "Cambridge", "Greater Sudbury", "Guelph", 
-                           "Hamilton", "Kitchener", "London", "Markham", "Mississauga", 
-                           "Niagara Falls", "Norfolk County", "North Bay", "Oshawa", 
-                           "Ottawa", "Peterborough", "Pickering", "Richmond Hill", 
-                           "Sarnia", "Sault Ste. Marie", "St. Catharines", 
-                           "Thunder Bay", "Toronto", "Vaughan", "Waterloo", "Welland", 
-                           "Windsor"):
+    while location not in VALID_CITIES:
         location = input("Please enter a valid city: ")
 
     print('''Enter interests one by one. Press enter after each. Enter END blank to stop adding.
@@ -206,9 +272,7 @@ def create_user():
     interest = input()
     interests = []
     while interest != "END":
-        if interest in ("Collecting", "Clothing", "Cooking", "Gardening", "Models", "Outdoors", 
-                        "Travelling", "Fitness", "Games", "Sports", "Dancing", "Music", "Theater", 
-                        "Visual", "Literary"):
+        if interest in VALID_INTERESTS:
             interests.append(interest)
             interest = input("Add another interest: ")
         else:
@@ -227,60 +291,94 @@ def create_user():
 
 ###### Database Query ######
 def fetch_user(user_id):
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    data = cursor.fetchone()
-    conn.close()    
+    # The relationships are only read when one of the sets is first used, most fetched users
+    # (swipe targets, viewed profiles) never need them
+    with db.connection() as conn:
+        data = db.fetch_user(conn, user_id)
 
     if data:
-        user = User.db_to_object(data)
+        user = User.db_to_object(data, _UNLOADED, _UNLOADED, _UNLOADED)
         return user
     else:
         print("No user found with the given user_id.")
         return None
 
+def user_exists(user_id):
+    with db.connection() as conn:
+        return db.user_exists(conn, user_id)
+
 # Display one user profile based on user id
 def view_one_profile(user_id):
     profile = fetch_user(user_id)
     print(repr(profile))
 
 # 
+def iter_profiles(fetch_page, page_size=db.PAGE_SIZE):
+    """Yield the users returned by fetch_page(conn, after_id, limit), one page at a time.
+
+    Only one page is held in memory and the connection is returned to the pool between
+    pages, so a slow consumer does not keep a read transaction open.
+    """
+    after_id = 0
+    while True:
+        with db.connection() as conn:
+            page = fetch_page(conn, after_id, page_size)
+        yield from User.db_rows_to_users(page)
+        if len(page) < page_size:
+            return
+        after_id = page[-1][0]
+
 def view_all_profiles(user, except_currnet_user=None):
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users')
-    profiles = cursor.fetchall()
-    conn.commit()
-    conn.close()
-    
-    if except_currnet_user:
-        for profile in profiles:
-            other = User.db_to_object(profile)
-            if other.user_id != user.user_id:
-                print(repr(other))
-    else: 
-        for profile in profiles:
-            print(repr(other))
+    for other in iter_profiles(db.fetch_users_page):
+        if except_currnet_user and other.user_id == user.user_id:
+            continue
+        print(repr(other))
 ####################################################################################################
 
 
 ####################################################################################################
 ###### Authorization ######
+# Failed attempts seen recently; repeating one is rejected without running the KDF again
+failed_logins = NegativeCache()
+
 def authenticate(username, password):
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users where name = ?', (username,))
-    profile = cursor.fetchone()
-    conn.close()
-    
-    user = User.db_to_object(profile)
+    """Return the User if the password matches, else None.
+
+    Only (user_id, password hash) is read until the password is verified; the profile and
+    relationships are loaded after a successful check. Legacy plaintext passwords are
+    replaced by a hash at their first successful login.
+
+    The credentials are always read, a seek on the name index: failed_logins only skips the
+    KDF of a name still missing, or of a password that already failed against the same hash.
+    Accounts created and passwords changed by other processes are seen at once.
+    """
+    with db.connection() as conn:
+        credentials = db.fetch_credentials(conn, username)
+    if credentials is None:
+        if failed_logins.unknown(username):
+            tracing.count('logins.rejected_cached')
+            return None
+        verify_password(password, dummy_hash())
+        failed_logins.add(username)
+        tracing.count('logins.failed')
+        return None
 
-    if user.password == password:
-        return user
-    else:
+    user_id, stored = credentials
+    if failed_logins.rejects(username, password, stored):
+        tracing.count('logins.rejected_cached')
+        return None
+    if not verify_password(password, stored):
+        failed_logins.add(username, password, stored)
+        tracing.count('logins.failed')
         return None
 
+    if needs_rehash(stored):
+        # Hashed before taking the write lock, which is held for the UPDATE only
+        rehashed = hash_password(password)
+        with db.transaction() as conn:
+            db.update_password(conn, user_id, rehashed)
+    return fetch_user(user_id)
+
 def login():
     username = input("Enter your name: ")
     password = input("Enter your password: ")
@@ -305,106 +403,134 @@ def login():
 ####################################################################################################
 ###### Matching Algorithm ######
 
-# Load all users except for the current user and the ones he/she (dis)liked
-def fetch_valid_users(user):
-    exclusion = [user.user_id]
-    exclusion.extend(user.disliked_users)
-    exclusion.extend(user.liked_users)
-
-    conn = sqlite3.connect('users.db')
-    placeholders= ', '.join("?"*len(exclusion))
-    query = 'SELECT * FROM users where user_id not in ({0})'.format(placeholders)
-    df = pd.read_sql_query(query, conn, params=tuple(exclusion))
-
-    # Convert each comma-separated string in the 'interests' column to a list of interests
-    df['interests_list'] = df['interests'].apply(
-    lambda x: x.split(',') if x else [])
-    conn.commit()
-    conn.close()
-    return df
-
-#Compute Compatibility Scores and return top 5
-def compute_compatibility_scores(current_user, gender_preference):
-    potential_matches = fetch_valid_users(current_user).copy()
-    if potential_matches.empty:
-        print("Sorry! Currently we do not have more potential matches for you.")
-        return potential_matches
-
-    # Caculate gender compatibility score using a boolean mask and convert to float
-    if gender_preference == "Both":
-        potential_matches['gender_score'] = 1.0
-    else:
-        potential_matches['gender_score'] = (potential_matches['gender'] == gender_preference).astype(float)
-
-    # Calculate location compatibility score using a boolean mask and convert to float
-    potential_matches['location_score'] = (potential_matches['location'] == current_user.location).astype(float)
-
-    # Calculate age difference score using NumPy's vectorized operations
-    potential_matches['age_diff_score'] = 1 / (1 + np.abs(potential_matches['age'] - current_user.age))
-
-    # retrieve current user's MBTI for following comparison
-    mbti1 = current_user.MBTI
-    # Caculate gender compatibility score
-    def calculate_mbti_scores(mbti2):
-        # Compare each letter of MBTI
-        # Opposite E/I scores 2; for the rest, same personality scores 1 point
-        mbti_score = 0.0
-        if mbti1[0] != mbti2[0]:
-            mbti_score += 2.0
-        if mbti1[1] == mbti2[1]:
-            mbti_score += 1.0
-        if mbti1[2] == mbti2[2]:
-            mbti_score += 1.0
-        if mbti1[3] == mbti2[3]:
-            mbti_score += 1.0
-
-        return mbti_score / 5.0
-
-    potential_matches['MBTI_score'] = potential_matches['MBTI'].apply(calculate_mbti_scores)
-    
-    # Convert interests lists into a set for the logged-in user for faster comparison
-    current_interests_set = set(current_user.interests)
-
-    # Optimize shared interests score calculation using list comprehension and apply
-    def calculate_jaccard_similarity_vectorized(interests):
-        # Convert list to set for potential matches
-        interests_set = set(interests)
-        # Calculate intersection and union sizes directly
-        intersection_size = len(current_interests_set & interests_set)
-        union_size = len(current_interests_set | interests_set)
-        # Return the Jaccard similarity score
-        return intersection_size / union_size if union_size > 0 else 0
-
-    # Apply the vectorized Jaccard similarity calculation to all potential matches
-    potential_matches['interests_score'] = potential_matches['interests'].apply(calculate_jaccard_similarity_vectorized)
-
-    # Combine the individual scores into a final compatibility score using NumPy's vectorized operations
-    potential_matches['compatibility_score'] = (
-        0.4 * potential_matches['gender_score'] +
-        0.15 * potential_matches['MBTI_score'] +
-        0.1 * potential_matches['age_diff_score'] +
-        0.2 * potential_matches['location_score'] +
-        0.15 * potential_matches['interests_score']
-    )
-
-    # Sort by the compatibility score in descending order
-    potential_matches = potential_matches.sort_values(by='compatibility_score', ascending=False)
-
-    return potential_matches.head(5)
-
-def mark_user(user, other_user):
+# The functions computing recommendations live in matching.py, which imports NumPy and pandas.
+# It is loaded by the first matching call, so signing up, logging in and viewing profiles
+# never pay for the scientific stack. Its functions are also reachable as attributes of app.
+MATCHING_NAMES = frozenset(('fetch_valid_users', 'get_candidate_store', 'recommendation_cache',
+                            'fetch_users_frame', 'compute_compatibility_scores'))
+
+def matching():
+    import matching
+    return matching
+
+def __getattr__(name):
+    if name in MATCHING_NAMES:
+        return getattr(matching(), name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def on_swipe(src_id, dst_id):
+    """Drop the swiped user from cached recommendations; there are none before matching is loaded."""
+    module = sys.modules.get('matching')
+    if module is not None:
+        module.recommendation_cache.on_swipe(src_id, dst_id)
+
+class SwipeSession:
+    """Buffer the likes/dislikes of one user and write them to the database in batches.
+
+    Pending decisions are flushed in a single transaction once max_pending are buffered,
+    max_delay_ms after the oldest one, or when the session is closed. Mutual matches are
+    detected at flush time inside that transaction, which holds the write lock, so two
+    sessions liking each other concurrently still produce exactly one match. With the swipe
+    log on, a flush appends the decisions to the log instead, and their matches are found
+    when it is applied, as for record_swipe.
+    """
+    def __init__(self, user, max_pending=20, max_delay_ms=2000):
+        self.user = user
+        self.max_pending = max_pending
+        self.max_delay_ms = max_delay_ms
+        self.pending = []
+        self.timer = None
+        self.lock = threading.Lock()
+
+    # Build candidate users straight from the rows of compute_compatibility_scores, no extra queries
+    @staticmethod
+    def candidates_from_frame(potential_matches):
+        columns = ['user_id', 'name', 'password', 'MBTI', 'age', 'gender', 'location', 'interests']
+        for row in potential_matches[columns].itertuples(index=False):
+            yield User.db_to_object((int(row.user_id), *row[1:]))
+
+    def like(self, other_user):
+        self.user.like(other_user)
+        self.add(other_user, 'like')
+
+    def dislike(self, other_user):
+        self.user.dislike(other_user)
+        self.add(other_user, 'dislike')
+
+    def add(self, other_user, kind):
+        with self.lock:
+            self.pending.append((other_user, kind))
+            full = len(self.pending) >= self.max_pending
+            if not full and self.timer is None:
+                self.timer = threading.Timer(self.max_delay_ms / 1000, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write the pending decisions in one transaction. Returns the users newly matched.
+
+        With the swipe log on they are only logged, and none is returned.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            pending, self.pending = self.pending, []
+            if not pending:
+                return []
+
+            matched = []
+            try:
+                now = time.time()
+                if swipe_log is not None:
+                    with tracing.span('swipes.flush'):
+                        swipe_log.extend([(self.user.user_id, other_user.user_id, kind)
+                                          for other_user, kind in pending], now)
+                else:
+                    with tracing.span('swipes.flush'), db.transaction() as conn:
+                        for other_user, kind in pending:
+                            if db.record_swipe(conn, self.user.user_id, other_user.user_id, kind, now):
+                                matched.append(other_user)
+            except Exception as e:
+                # Keep the decisions so the next flush retries them
+                self.pending = pending + self.pending
+                print('Exception: {}'.format(e))
+                raise Exception(e)
+
+        for other_user, kind in pending:
+            on_swipe(self.user.user_id, other_user.user_id)
+        for other_user in matched:
+            self.user.matches.add(other_user.user_id)
+            other_user.matches.add(self.user.user_id)
+        tracing.count('swipes', len(pending))
+        tracing.count('matches', len(matched))
+        return matched
+
+    def close(self):
+        return self.flush()
+
+def mark_user(user, other_user, session=None):
     while True:
         print("\nPlease mark the user. Type STOP to quit at any time")
         choice = input("1 for Like \n2 for Dislike\nYour choice: ")
         if choice == '1':
+            if session is not None:
+                session.like(other_user)
+                break
+            matched = record_swipe(user.user_id, other_user.user_id, 'like')
             user.like(other_user)
-            update_user(user)
-            update_user(other_user)
+            if matched:
+                user.matches.add(other_user.user_id)
+                other_user.matches.add(user.user_id)
             break
         elif choice == '2':
+            if session is not None:
+                session.dislike(other_user)
+                break
+            record_swipe(user.user_id, other_user.user_id, 'dislike')
             user.dislike(other_user)
-            update_user(user)
-            update_user(other_user)
             break
         elif choice == "STOP":
             print("Stop matching")
@@ -414,21 +540,23 @@ def mark_user(user, other_user):
 
 def start_matching(user):
     gender_preference = input("Please specify your preference for this matching (Female/Male/Both): ")
-    while gender_preference not in ("Female", "Male", "Both"):
+    while gender_preference not in VALID_GENDER_PREFERENCES:
         gender_preference = input("Please enter a valid gender: ")
 
-    potential_matches = compute_compatibility_scores(user, gender_preference)
+    potential_matches = matching().compute_compatibility_scores(user, gender_preference)
     size = len(potential_matches)
     if size == 0:
         return None
     
     potential_matches = potential_matches.reset_index(drop=True)    
-    for i in range(size):
-        other_user_id = potential_matches.loc[i,"user_id"]
-        other_user = fetch_user(int(other_user_id))
-        print(f"\nSee your Potential Match No.{i+1}")
-        print(potential_matches.loc[i, ["name","MBTI", "age", "gender", "location", "interests"]])
-        mark_user(user, other_user)    
+    session = SwipeSession(user)
+    try:
+        for i, other_user in enumerate(SwipeSession.candidates_from_frame(potential_matches)):
+            print(f"\nSee your Potential Match No.{i+1}")
+            print(potential_matches.loc[i, ["name","MBTI", "age", "gender", "location", "interests"]])
+            mark_user(user, other_user, session)
+    finally:
+        session.close()
 
 ####################################################################################################
 
@@ -437,14 +565,13 @@ def start_matching(user):
 def update_profile(user):
     print(f"Your name is {user.name}. This cannot be modified.\n")
     
-    new_password = input(f"Enter your new password. Leave blank to keep '{user.password}'.\nNew password: ")
+    new_password = input("Enter your new password. Leave blank to keep the current one.\nNew password: ")
     if new_password:
-        user.password = new_password
+        user.password = hash_password(new_password)
     
     new_MBTI = input(f"Enter your new MBTI. Leave blank to keep '{user.MBTI}'.\nNew MBTI: ")
     if new_MBTI:
-        while new_MBTI not in ("ISTJ", "ISFJ", "INFJ", "INTJ", "ISTP", "ISFP", "INFP", "INTP", "ESTP", 
-                           "ESFP", "ENFP", "ENTP", "ESTJ", "ESFJ", "ENFJ", "ENTJ"):
+        while new_MBTI not in VALID_MBTI:
             new_MBTI = input("Please enter a valid MBTI: ") 
         
         user.MBTI = new_MBTI
@@ -453,15 +580,18 @@ def update_profile(user):
     if new_age:
         while True: 
             try:
-                user.age = int(new_age)
+                new_age = int(new_age)
             except:
                 new_age = input("Please enter a valid integer: ") 
             else:
-                break
+                if new_age in VALID_AGES:
+                    user.age = new_age
+                    break
+                new_age = input("Please enter an age from 1 to {}: ".format(MAX_AGE))
 
     new_gender = input(f"Enter new gender(Female/Male). Leave blank to keep '{user.gender}'.\nNew Gender: ")
     if new_gender:
-        while new_gender not in ("Female", "Male"):
+        while new_gender not in VALID_GENDERS:
             new_gender = input("Please enter a valid gender: ")
         
         user.gender = new_gender
@@ -477,14 +607,7 @@ def update_profile(user):
                         f"\n  St. Catharines, Thunder Bay, Toronto, Vaughan,"
                         f"\n  Waterloo, Welland, Windsor\nNew location: ")
     if new_location:
-        while new_location not in ("Barrie", "Belleville", "Brampton", "Brantford", 
-                           "Burlington", "Cambridge", "Greater Sudbury", "Guelph", 
-                           "Hamilton", "Kitchener", "London", "Markham", "Mississauga", 
-                           "Niagara Falls", "Norfolk County", "North Bay", "Oshawa", 
-                           "Ottawa", "Peterborough", "Pickering", "Richmond Hill", 
-                           "Sarnia", "Sault Ste. Marie", "St. Catharines", 
-                           "Thunder Bay", "Toronto", "Vaughan", "Waterloo", "Welland", 
-                           "Windsor"):
+        while new_location not in VALID_CITIES:
             new_location = input("Please enter a valid city: ")
         
         user.location = new_location
@@ -500,9 +623,7 @@ def update_profile(user):
     if interest:
         new_interests = []
         while interest != "END":
-            if interest in ("Collecting", "Clothing", "Cooking", "Gardening", "Models", "Outdoors", 
-                            "Travelling", "Fitness", "Games", "Sports", "Dancing", "Music", "Theater", 
-                            "Visual", "Literary"):
+            if interest in VALID_INTERESTS:
                 new_interests.append(interest)
                 interest = input("Add another interest: ")        
             else:
@@ -523,14 +644,18 @@ def view_profile_list(user, users_list):
         list_to_view = user.matches
 
     if list_to_view: 
-        for profile in list_to_view:
-            print(fetch_user(profile))
+        # One joined query per page instead of one fetch_user per id
+        fetch_page = lambda conn, after_id, limit: db.fetch_related_users_page(
+            conn, user.user_id, users_list, after_id, limit)
+        for profile in iter_profiles(fetch_page):
+            print(profile)
     else:
         print("None!")
             
 
 ###### main app ######
 def app():
+    ensure_schema(db.DB_PATH)
     while True:
         print("\nWelcome to Pairfect!")
         print("1. Sign up")
@@ -0,0 +1,226 @@
+"""Nightly precompute of the top-k recommendations of every user.
+
+    python batch.py [--db users.db] [--workers 8] [--k 100] [--preferences Female Male Both]
+
+The candidate columns are copied once into shared memory and every worker process maps
+them, so nothing but block boundaries and results cross the process boundary. Each worker
+scores a block of users against all candidates as (block x chunk) matrices and keeps a
+running top-k per user. The parent writes the results to the recommendations table.
+"""
+###### packages and dependencies ######
+import argparse
+import os
+import sqlite3
+import time
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+import db
+import scoring
+from candidates import COLUMNS, CandidateStore
+from scoring import Query
+
+####################################################################################################
+###### Shared candidate columns ######
+class SharedCandidates:
+    """Alive rows of a CandidateStore, sorted by user_id, in one shared memory block per column."""
+    def __init__(self, blocks, arrays):
+        self.blocks = blocks
+        self.arrays = arrays
+
+    @classmethod
+    def create(cls, store):
+        rows = np.flatnonzero(store.alive)
+        rows = rows[np.argsort(store.user_id[rows], kind='stable')]
+        blocks, arrays = {}, {}
+        for name, dtype in COLUMNS:
+            values = store.column(name)[rows]
+            block = SharedMemory(create=True, size=max(values.nbytes, 1))
+            array = np.ndarray(values.shape, dtype=dtype, buffer=block.buf)
+            array[:] = values
+            blocks[name], arrays[name] = block, array
+        return cls(blocks, arrays)
+
+    def spec(self):
+        """What a worker needs to attach: {name: (shared memory name, length)}."""
+        return {name: (self.blocks[name].name, len(self.arrays[name])) for name, _ in COLUMNS}
+
+    @classmethod
+    def attach(cls, spec):
+        blocks, arrays = {}, {}
+        for name, dtype in COLUMNS:
+            block_name, length = spec[name]
+            block = SharedMemory(name=block_name)
+            blocks[name] = block
+            arrays[name] = np.ndarray((length,), dtype=dtype, buffer=block.buf)
+        return cls(blocks, arrays)
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+####################################################################################################
+
+
+####################################################################################################
+###### Block scoring ######
+def select_top_k(rows, scores, slots, k):
+    """Keep the k best (score desc, slot asc) entries of every row. Inputs are parallel arrays."""
+    order = np.lexsort((slots, -scores, rows))
+    rows, scores, slots = rows[order], scores[order], slots[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+    keep = rank < k
+    return rows[keep], scores[keep], slots[keep]
+
+
+def score_block(candidates, user_slots, gender_code, excluded, k, chunk_size, pipeline, words):
+    """Top-k (rows, scores, slots) of a block of users against every candidate.
+
+    user_slots are the users' own rows in candidates, excluded is a (block row, slot) pair of
+    arrays, words the interests vocabulary of the store. The pipeline scores a (users, 1) query against (1, chunk) candidate columns at once,
+    with the same arithmetic as CandidateStore.score.
+    """
+    query = Query(gender_code, candidates['location'][user_slots][:, None],
+                  candidates['age'][user_slots].astype(np.int64)[:, None],
+                  candidates['mbti'][user_slots][:, None], candidates['interest_mask'][user_slots][:, None],
+                  pipeline, words)
+
+    # The users themselves are excluded as well
+    excluded_rows = np.concatenate([np.arange(len(user_slots)), excluded[0]])
+    excluded_slots = np.concatenate([user_slots, excluded[1]])
+
+    best = (np.empty(0, dtype=np.intp), np.empty(0), np.empty(0, dtype=np.intp))
+    total = len(candidates['user_id'])
+    for start in range(0, total, chunk_size):
+        end = min(start + chunk_size, total)
+        batch = {name: candidates[name][None, start:end] for name, _ in COLUMNS}
+        scores = pipeline.score(batch, query, parts=False)['compatibility_score']
+        scores = np.broadcast_to(scores, (len(user_slots), end - start)).copy()
+        inside = (excluded_slots >= start) & (excluded_slots < end)
+        scores[excluded_rows[inside], excluded_slots[inside] - start] = -np.inf
+
+        # Everything tied with each row's k-th score is kept, select_top_k breaks the ties
+        width = end - start
+        if width > k:
+            kth = np.partition(scores, width - k, axis=1)[:, width - k]
+            rows, columns = np.nonzero((scores >= kth[:, None]) & np.isfinite(scores))
+        else:
+            rows, columns = np.nonzero(np.isfinite(scores))
+        best = select_top_k(np.concatenate([best[0], rows]),
+                            np.concatenate([best[1], scores[rows, columns]]),
+                            np.concatenate([best[2], columns + start]), k)
+    return best
+
+
+###### Worker process ######
+_worker = {}
+
+def init_worker(spec, db_path, experiments, words):
+    _worker['candidates'] = SharedCandidates.attach(spec)
+    _worker['db_path'] = db_path
+    _worker['words'] = words
+    scoring.configure(experiments)
+
+def fetch_exclusions(db_path, user_ids, candidate_ids):
+    """Swipes of the users in user_ids (sorted, contiguous block) as (block row, slot) arrays."""
+    conn = sqlite3.connect('file:{}?mode=ro'.format(db_path), uri=True)
+    try:
+        pairs = conn.execute('SELECT src, dst FROM swipes WHERE src BETWEEN ? AND ?',
+                             (int(user_ids[0]), int(user_ids[-1]))).fetchall()
+    finally:
+        conn.close()
+    pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    rows = np.searchsorted(user_ids, pairs[:, 0])
+    slots = np.searchsorted(candidate_ids, pairs[:, 1])
+    found = ((rows < len(user_ids)) & (slots < len(candidate_ids)))
+    found[found] &= (user_ids[rows[found]] == pairs[found, 0]) & (candidate_ids[slots[found]] == pairs[found, 1])
+    return rows[found], slots[found]
+
+def run_block(task):
+    start, end, preferences, k, chunk_size = task
+    candidates = _worker['candidates'].arrays
+    user_slots = np.arange(start, end)
+    user_ids = candidates['user_id'][start:end]
+    excluded = fetch_exclusions(_worker['db_path'], user_ids, candidates['user_id'])
+
+    # Users of the same experiment are scored together
+    experiments = {}
+    for row, user_id in enumerate(user_ids.tolist()):
+        experiments.setdefault(scoring.pipeline_for(user_id), []).append(row)
+
+    results = []
+    for pipeline, members in experiments.items():
+        members = np.array(members, dtype=np.intp)
+        position = np.full(len(user_ids), -1, dtype=np.intp)
+        position[members] = np.arange(len(members))
+        keep = position[excluded[0]] >= 0
+        member_excluded = (position[excluded[0][keep]], excluded[1][keep])
+        for name, gender_code in preferences:
+            rows, scores, slots = score_block(candidates, user_slots[members], gender_code,
+                                              member_excluded, k, chunk_size, pipeline, _worker['words'])
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+            results.append((name, user_ids[members[rows]], rank, candidates['user_id'][slots], scores))
+    return end - start, results
+####################################################################################################
+
+
+####################################################################################################
+###### Driver ######
+def write_results(conn, results):
+    for name, user_ids, ranks, candidate_ids, scores in results:
+        conn.executemany('''
+            INSERT OR REPLACE INTO recommendations (user_id, gender_preference, rank, candidate_id, score)
+            VALUES (?, ?, ?, ?, ?)
+        ''', zip(user_ids.tolist(), [name] * len(user_ids), ranks.tolist(), candidate_ids.tolist(),
+                 scores.tolist()))
+
+
+def precompute(db_path=None, workers=None, k=100, preferences=("Female", "Male", "Both"),
+               block_size=256, chunk_size=16384, limit=None):
+    """Score every user (or the first `limit`) and store their top-k. Returns the number of users."""
+    db_path = db_path or db.DB_PATH
+    store = CandidateStore.from_db(db_path)
+    shared = SharedCandidates.create(store)
+    coded = [(name, None if name == "Both" else store.genders.get(name)) for name in preferences]
+    total = len(shared.arrays['user_id']) if limit is None else min(limit, len(shared.arrays['user_id']))
+    tasks = [(start, min(start + block_size, total), coded, k, chunk_size)
+             for start in range(0, total, block_size)]
+
+    with db.transaction(db_path) as conn:
+        conn.executemany('DELETE FROM recommendations WHERE gender_preference = ?',
+                         [(name,) for name in preferences])
+    done = 0
+    try:
+        with Pool(workers or os.cpu_count(), initializer=init_worker,
+                  initargs=(shared.spec(), os.path.abspath(db_path), scoring.config(),
+                            store.interests.values)) as pool:
+            for users, results in pool.imap_unordered(run_block, tasks):
+                with db.transaction(db_path) as conn:
+                    write_results(conn, results)
+                done += users
+    finally:
+        shared.close(unlink=True)
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=db.DB_PATH)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--k', type=int, default=100)
+    parser.add_argument('--preferences', nargs='+', default=["Female", "Male", "Both"])
+    parser.add_argument('--block-size', type=int, default=256)
+    parser.add_argument('--chunk-size', type=int, default=16384)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    users = precompute(args.db, args.workers, args.k, args.preferences, args.block_size, args.chunk_size)
+    print('Precomputed {} users in {:.1f}s'.format(users, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Approximate top-k: latency and recall@k against the exact scorer, per budget.
+
+    python benchmarks/bench_approximate.py --users 2000000 --queries 200 --budgets 500 2000 8000
+
+Builds an in-memory candidate store of --users random users (no database) and scores
+--queries of them against it: exactly (partitioned branch and bound, and a full scan), then
+approximately with each budget. recall@k is the fraction of the approximate top-k scoring at
+least the exact k-th score, so a tie swapped for another equally scored candidate still counts.
+"""
+###### packages and dependencies ######
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from synthetic import CITIES, GENDERS, INTERESTS, MBTI_TYPES
+
+from candidates import CandidateStore, encode_mbti
+
+####################################################################################################
+MBTI_BY_CODE = {encode_mbti(MBTI): MBTI for MBTI in MBTI_TYPES}
+
+
+def random_store(n, seed=0):
+    """A CandidateStore of n random users, filled column by column."""
+    rng = np.random.default_rng(seed)
+    store = CandidateStore()
+    counts = rng.integers(1, 6, n)
+    chosen = np.argsort(rng.random((n, len(INTERESTS))), axis=1) < counts[:, None]
+    masks = (chosen.astype(np.uint64) << np.arange(len(INTERESTS), dtype=np.uint64)).sum(axis=1, dtype=np.uint64)
+    store.size = n
+    store.buffers = {
+        'user_id': np.arange(1, n + 1, dtype=np.int64),
+        'age': rng.integers(18, 61, n).astype(np.int16),
+        'gender': rng.integers(0, len(GENDERS), n).astype(np.int8),
+        'location': rng.integers(0, len(CITIES), n).astype(np.int16),
+        'mbti': rng.integers(0, len(MBTI_TYPES), n).astype(np.uint8),
+        'interest_mask': masks,
+    }
+    store.alive_buffer = np.ones(n, dtype=bool)
+    store.index_slots()
+    return store
+
+
+def probes(store, count, seed=1):
+    """Users (as the fields top_matches reads) taken from random rows of the store."""
+    rng = np.random.default_rng(seed)
+    users = []
+    for slot in rng.choice(store.size, count, replace=False):
+        mask = int(store.interest_mask[slot])
+        users.append(SimpleNamespace(
+            user_id=int(store.user_id[slot]), age=int(store.age[slot]),
+            location=store.locations.values[store.location[slot]],
+            MBTI=MBTI_BY_CODE[int(store.mbti[slot])],
+            interests=[interest for bit, interest in enumerate(store.interests.values) if mask >> bit & 1],
+            liked_users=frozenset(), disliked_users=frozenset(),
+            preference=('Female', 'Male', 'Both')[slot % 3]))
+    return users
+
+
+def run(store, users, k, **options):
+    timings, results, scored = [], [], []
+    for user in users:
+        start = time.perf_counter()
+        user_ids, scores = store.top_matches(user, user.preference, k=k, **options)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append(scores['compatibility_score'])
+        scored.append(store.last_rows_scored)
+    return timings, results, scored
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--budgets', type=int, nargs='+', default=[250, 500, 1000, 2000, 4000, 8000, 16000])
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = random_store(args.users)
+    users = probes(store, args.queries)
+    print('store of {} users built in {:.1f}s'.format(args.users, time.perf_counter() - start))
+    start = time.perf_counter()
+    store.partition_index()
+    store.sketch_index()
+    print('indexes built in {:.1f}s, {} buckets'.format(time.perf_counter() - start, len(store.sketches)))
+
+    print('{:>22} {:>10} {:>10} {:>12} {:>10}'.format('mode', 'p50 ms', 'p95 ms', 'rows scored', 'recall@{}'.format(args.k)))
+    exact = None
+    modes = [('full scan', {'partitioned': False, 'budget': 0}), ('partitioned, exact', {'partitioned': True, 'budget': 0})]
+    modes += [('budget {}'.format(budget), {'budget': budget}) for budget in args.budgets]
+    for label, options in modes:
+        timings, results, scored = run(store, users, args.k, **options)
+        if exact is None:
+            exact = results
+        recall = np.mean([np.mean(result >= reference[-1]) if len(reference) else 1.0
+                          for result, reference in zip(results, exact)])
+        print('{:>22} {:>10.2f} {:>10.2f} {:>12.0f} {:>10.3f}'.format(
+            label, np.median(timings), np.percentile(timings, 95), np.median(scored), recall))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Throughput of the nightly precompute (batch.py) for an increasing number of worker processes.
+
+    python benchmarks/bench_batch.py --users 100000 --queries 5000 --workers 1 2 4 8
+
+Scores the first --queries users against all --users candidates, for the three gender
+preferences, and reports users/s and the speedup over one worker.
+"""
+###### packages and dependencies ######
+import argparse
+import os
+import tempfile
+import time
+
+from synthetic import populate, populate_swipes
+
+import batch
+import db
+
+####################################################################################################
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--swipes', type=int, default=20, help='swipes per user')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count()} & set(range(1, os.cpu_count() + 1))))
+    parser.add_argument('--k', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'batch.db')
+        populate(db_path, args.users)
+        populate_swipes(db_path, args.swipes)
+
+        print('{} candidates, {} users, {} core(s)'.format(args.users, args.queries, os.cpu_count()))
+        print('{:>8} {:>10} {:>10} {:>8}'.format('workers', 'time', 'users/s', 'speedup'))
+        baseline = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            users = batch.precompute(db_path, workers, args.k, limit=args.queries)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print('{:>8} {:>9.1f}s {:>10.0f} {:>7.2f}x'.format(workers, elapsed, users / elapsed,
+                                                             baseline / elapsed))
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
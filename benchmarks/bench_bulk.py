@@ -0,0 +1,72 @@
+"""Bulk import and export throughput, against inserting users one transaction at a time.
+
+    python benchmarks/bench_bulk.py --users 200000 [--chunk-size 50000]
+
+Writes --users random profiles to a CSV file (plus a few invalid rows), imports them into
+an empty database with bulk.import_users, exports them back to CSV, and reports users/s.
+The per-row path (app.insert_user, one transaction per user) is timed on a sample.
+"""
+###### packages and dependencies ######
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+from synthetic import random_profile
+
+import app
+import bulk
+import db
+
+####################################################################################################
+def write_csv(path, n):
+    rng = random.Random(0)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(bulk.REQUIRED_FIELDS)
+        for i in range(n):
+            writer.writerow(random_profile(rng, i)[:7])
+        writer.writerow(('user0', 'again', 'ENFP', 30, 'Male', 'Toronto', 'Music'))
+        writer.writerow(('bad_city', 'password', 'ENFP', 30, 'Male', 'Atlantis', 'Music'))
+        writer.writerow(('bad_age', 'password', 'ENFP', 'thirty', 'Male', 'Toronto', 'Music'))
+
+
+def per_row(db_path, n):
+    db.configure(db_path)
+    rng = random.Random(1)
+    profiles = [random_profile(rng, 'row{}'.format(i)) for i in range(n)]
+    users = [app.User(None, *profile[:6], profile[6].split(',')) for profile in profiles]
+    start = time.perf_counter()
+    for user in users:
+        app.insert_user(user)
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE)
+    parser.add_argument('--per-row', type=int, default=2000, help='users inserted one at a time')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'users.csv')
+        exported = os.path.join(directory, 'export.csv')
+        db_path = os.path.join(directory, 'bulk.db')
+        write_csv(source, args.users)
+
+        stats = bulk.import_users(source, db_path, args.chunk_size, os.path.join(directory, 'rejects.csv'))
+        print('import  {:>10} users {:>8} rejected {:>12.0f} users/s'.format(
+            stats['inserted'], stats['rejected'], stats['inserted'] / stats['seconds']))
+        stats = bulk.export_users(exported, db_path, args.chunk_size)
+        print('export  {:>10} users {:>8} {:>12.0f} users/s'.format(
+            stats['exported'], '', stats['exported'] / stats['seconds']))
+        print('per row {:>10} users {:>8} {:>12.0f} users/s'.format(
+            args.per_row, '', per_row(db_path, args.per_row)))
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Operations per second of the pooled data access layer against one connection per call.
+
+    python benchmarks/bench_db.py --users 10000 --ops 2000
+"""
+###### packages and dependencies ######
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from synthetic import populate
+
+import db
+
+####################################################################################################
+###### One connection per call, as app.py used to do ######
+def fetch_user_per_call(db_path, user_id):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('SELECT ' + db.USER_COLUMNS + ' FROM users WHERE user_id = ?', (user_id,))
+    data = cursor.fetchone()
+    db.fetch_relationships(conn, user_id)
+    conn.close()
+    return data
+
+def record_swipe_per_call(db_path, src_id, dst_id):
+    conn = sqlite3.connect(db_path)
+    db.record_swipe(conn, src_id, dst_id, 'like', time.time())
+    conn.commit()
+    conn.close()
+
+
+###### Pooled ######
+def fetch_user_pooled(db_path, user_id):
+    with db.transaction(db_path, immediate=False) as conn:
+        data = db.fetch_user(conn, user_id)
+        db.fetch_relationships(conn, user_id)
+    return data
+
+def record_swipe_pooled(db_path, src_id, dst_id):
+    with db.transaction(db_path) as conn:
+        db.record_swipe(conn, src_id, dst_id, 'like', time.time())
+####################################################################################################
+
+
+def ops_per_second(function, db_path, arguments):
+    start = time.perf_counter()
+    for args in arguments:
+        function(db_path, *args)
+    return len(arguments) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--ops', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    reads = [(rng.randint(1, args.users),) for _ in range(args.ops)]
+    writes = [tuple(rng.sample(range(1, args.users + 1), 2)) for _ in range(args.ops)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        before = os.path.join(directory, 'before.db')
+        after = os.path.join(directory, 'after.db')
+        populate(before, args.users)
+        shutil.copy(before, after)
+
+        print('{:<14} {:>14} {:>14} {:>8}'.format('operation', 'before ops/s', 'after ops/s', 'speedup'))
+        for name, old, new, arguments in (
+                ('fetch_user', fetch_user_per_call, fetch_user_pooled, reads),
+                ('record_swipe', record_swipe_per_call, record_swipe_pooled, writes)):
+            old_rate = ops_per_second(old, before, arguments)
+            new_rate = ops_per_second(new, after, arguments)
+            print('{:<14} {:>14.0f} {:>14.0f} {:>7.1f}x'.format(name, old_rate, new_rate, new_rate / old_rate))
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
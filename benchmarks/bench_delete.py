@@ -0,0 +1,70 @@
+"""Latency of delete_user for users of a given degree, for growing tables.
+
+    python benchmarks/bench_delete.py --sizes 10000 100000 --per-user 10 --degrees 10 1000
+"""
+###### packages and dependencies ######
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from synthetic import populate, populate_swipes
+
+import app
+import db
+
+####################################################################################################
+def give_degree(db_path, user_id, degree, n, rng):
+    """Make user_id swipe on, and be liked by, degree // 2 users each."""
+    others = rng.sample(range(1, n + 1), degree)
+    conn = sqlite3.connect(db_path)
+    conn.executemany("INSERT OR REPLACE INTO swipes (src, dst, kind, ts) VALUES (?, ?, 'like', 0)",
+                     [(user_id, other) for other in others[:degree // 2] if other != user_id])
+    conn.executemany("INSERT OR REPLACE INTO swipes (src, dst, kind, ts) VALUES (?, ?, 'like', 0)",
+                     [(other, user_id) for other in others[degree // 2:] if other != user_id])
+    conn.commit()
+    conn.close()
+
+
+def bench(n, per_user, degree, deletes):
+    db.close_all()
+    populate('users.db', n)
+    populate_swipes('users.db', per_user)
+    rng = random.Random(degree)
+    victims = rng.sample(range(1, n + 1), deletes)
+    timings = []
+    for user_id in victims:
+        if degree > per_user:
+            give_degree('users.db', user_id, degree, n, rng)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            app.delete_user(user_id)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--per-user', type=int, default=10, help='background swipes per user')
+    parser.add_argument('--degrees', type=int, nargs='+', default=[10, 1000])
+    parser.add_argument('--deletes', type=int, default=20)
+    args = parser.parse_args()
+
+    print('{:>10} {:>8} {:>18}'.format('users', 'degree', 'delete (median)'))
+    with tempfile.TemporaryDirectory() as directory:
+        # app works on users.db in the current directory
+        os.chdir(directory)
+        for n in args.sizes:
+            for degree in args.degrees:
+                latency = bench(n, args.per_user, degree, args.deletes)
+                print('{:>10} {:>8} {:>16.2f}ms'.format(n, degree, latency * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Exclusion of swiped users for a heavy swiper, past SQLite's bound-parameter limit.
+
+    python benchmarks/bench_exclusion.py --users 150000 --swipes 120000
+
+The default is past the 32766 parameters of some older SQLite builds; builds since 3.32
+accept 250000, use --swipes 260000 --users 300000 to go past that (tests/test_exclusion.py
+checks the same with the limit lowered to 999). Checks that fetch_valid_users and
+compute_compatibility_scores never return a swiped user and times them for a user without
+swipes and for the heavy swiper. The old `NOT IN (?, ?, ...)` query is run too, to show
+where it fails.
+"""
+###### packages and dependencies ######
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from synthetic import populate
+
+import app
+import db
+
+####################################################################################################
+def old_fetch_valid_users(user):
+    exclusion = [user.user_id, *user.disliked_users, *user.liked_users]
+    placeholders = ', '.join("?" * len(exclusion))
+    with db.connection() as conn:
+        return conn.execute('SELECT * FROM users where user_id not in ({0})'.format(placeholders),
+                            tuple(exclusion)).fetchall()
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=150000)
+    parser.add_argument('--swipes', type=int, default=120000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'users.db')
+        populate(db_path, args.users)
+        db.configure(db_path)
+
+        heavy_id = 1
+        rng = random.Random(0)
+        swiped = rng.sample(range(2, args.users + 1), args.swipes)
+        with db.transaction() as conn:
+            conn.executemany("INSERT INTO swipes (src, dst, kind, ts) VALUES (?, ?, ?, 0)",
+                             [(heavy_id, other, 'like' if i % 2 else 'dislike') for i, other in enumerate(swiped)])
+        heavy = app.fetch_user(heavy_id)
+        light = app.fetch_user(2)
+        print('heavy swiper: {} likes, {} dislikes'.format(len(heavy.liked_users), len(heavy.disliked_users)))
+
+        with db.connection() as conn:
+            if hasattr(conn, 'getlimit'):
+                print('SQLite bound-parameter limit: {}'.format(conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)))
+        try:
+            old_fetch_valid_users(heavy)
+            print('old NOT IN query: ok')
+        except sqlite3.OperationalError as e:
+            print('old NOT IN query: {}'.format(e))
+
+        swiped = set(swiped)
+        app.get_candidate_store()
+        print('{:<32} {:>12} {:>12}'.format('', 'no swipes', 'heavy'))
+        for name, function, extra in (('fetch_valid_users', app.fetch_valid_users, ()),
+                                      ('compute_compatibility_scores', app.compute_compatibility_scores, ("Both",))):
+            timings = []
+            for user in (light, heavy):
+                app.recommendation_cache.invalidate_user(user.user_id)
+                frame, elapsed = timed(function, user, *extra)
+                timings.append(elapsed)
+                returned = set(frame['user_id'].tolist())
+                assert user.user_id not in returned
+                if user is heavy:
+                    assert not returned & swiped, 'a swiped user was returned'
+                    if function is app.fetch_valid_users:
+                        assert len(returned) == args.users - 1 - args.swipes
+            print('{:<32} {:>10.1f}ms {:>10.1f}ms'.format(name, *timings))
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""MBTI and interests scoring kernels: the original per-row functions, bit arithmetic, lookup tables.
+
+    python benchmarks/bench_kernels.py --rows 100000
+
+Times each kernel over --rows candidates. tests/test_kernels.py checks that the lookup
+tables give exactly the scores of the original functions.
+"""
+###### packages and dependencies ######
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+from synthetic import INTERESTS, MBTI_TYPES
+
+from candidates import CandidateStore, encode_mbti
+from scoring import MBTI_TABLE, jaccard, popcount
+
+####################################################################################################
+###### Original functions (compute_compatibility_scores before the candidate store) ######
+def calculate_mbti_score(mbti1, mbti2):
+    mbti_score = 0.0
+    if mbti1[0] != mbti2[0]:
+        mbti_score += 2.0
+    if mbti1[1] == mbti2[1]:
+        mbti_score += 1.0
+    if mbti1[2] == mbti2[2]:
+        mbti_score += 1.0
+    if mbti1[3] == mbti2[3]:
+        mbti_score += 1.0
+    return mbti_score / 5.0
+
+
+def calculate_jaccard_similarity(interests1, interests2):
+    interests1, interests2 = set(interests1), set(interests2)
+    union_size = len(interests1 | interests2)
+    return len(interests1 & interests2) / union_size if union_size > 0 else 0
+
+
+###### Bit arithmetic kernels (before the lookup tables) ######
+def mbti_arithmetic(codes, code):
+    differences = codes ^ np.uint8(code)
+    return (2.0 * (differences >> 3) + 3.0 - popcount(differences & np.uint8(0b0111))) / 5.0
+
+
+def jaccard_arithmetic(masks, mask):
+    intersection = popcount(masks & mask).astype(float)
+    union = popcount(masks | mask).astype(float)
+    return np.divide(intersection, union, out=np.zeros_like(union), where=union > 0)
+
+
+###### Lookup tables ######
+def mbti_table(codes, code):
+    return MBTI_TABLE[code, codes]
+
+
+jaccard_table = jaccard
+####################################################################################################
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    store = CandidateStore()
+    types = rng.choice(MBTI_TYPES, args.rows)
+    interests = [list(rng.choice(INTERESTS, rng.integers(1, 6), replace=False)) for _ in range(args.rows)]
+    codes = np.array([encode_mbti(MBTI) for MBTI in types], dtype=np.uint8)
+    masks = np.array([store.interest_mask_for(row) for row in interests], dtype=np.uint64)
+    frame = pd.DataFrame({'MBTI': types, 'interests_list': interests})
+    user_mbti, user_interests = 'ENFP', ['Music', 'Travelling', 'Cooking']
+    code, mask = encode_mbti(user_mbti), np.uint64(store.interest_mask_for(user_interests))
+
+    kernels = (
+        ('MBTI, original .apply', lambda: frame['MBTI'].apply(lambda other: calculate_mbti_score(user_mbti, other)), 1),
+        ('MBTI, bit arithmetic', lambda: mbti_arithmetic(codes, code), 20),
+        ('MBTI, 16x16 table', lambda: mbti_table(codes, code), 20),
+        ('interests, original .apply', lambda: frame['interests_list'].apply(
+            lambda other: calculate_jaccard_similarity(user_interests, other)), 1),
+        ('interests, bitmask + divide', lambda: jaccard_arithmetic(masks, mask), 20),
+        ('interests, bitmask + table', lambda: jaccard_table(masks, mask), 20),
+    )
+    print('{:>30} {:>12}'.format('{} rows'.format(args.rows), 'ms'))
+    for label, kernel, number in kernels:
+        elapsed = min(timeit.repeat(kernel, number=number, repeat=3)) / number
+        print('{:>30} {:>12.3f}'.format(label, elapsed * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Login throughput under a flood of failed attempts, with and without the negative cache.
+
+    python benchmarks/bench_login.py --users 50000 --attempts 2000 --distinct 200
+
+A credential-stuffing list of --distinct (name, password) pairs, half of them for unknown
+names and half wrong passwords of real accounts, is replayed until --attempts logins have
+been made. The previous authenticate (full profile and relationships, plaintext compare)
+is timed too, along with successful logins of hashed accounts.
+"""
+###### packages and dependencies ######
+import argparse
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from synthetic import populate, populate_swipes
+
+import app
+import db
+from credentials import NegativeCache
+
+####################################################################################################
+def old_authenticate(username, password):
+    with db.transaction(immediate=False) as conn:
+        profile = db.fetch_user_by_name(conn, username)
+        relationships = db.fetch_relationships(conn, profile[0]) if profile else ()
+    if profile is None:
+        return None
+    user = app.User.db_to_object(profile, *relationships)
+    return user if user.password == password else None
+
+
+def run(authenticate, attempts, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(lambda attempt: authenticate(*attempt), attempts))
+    return len(attempts) / (time.perf_counter() - start), sum(result is not None for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--attempts', type=int, default=2000)
+    parser.add_argument('--distinct', type=int, default=200, help='distinct pairs in the stuffing list')
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    stuffing = [('nobody{}'.format(i), 'guess{}'.format(i)) for i in range(args.distinct // 2)]
+    stuffing += [('user{}'.format(rng.randrange(args.users)), 'guess{}'.format(i))
+                 for i in range(args.distinct - len(stuffing))]
+    flood = [rng.choice(stuffing) for _ in range(args.attempts)]
+    valid = [('user{}'.format(i), 'password{}'.format(i)) for i in rng.sample(range(args.users), 100)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'login.db')
+        populate(db_path, args.users)
+        populate_swipes(db_path, 50)
+        db.configure(db_path)
+
+        print('{:>36} {:>12} {:>10}'.format('', 'logins/s', 'accepted'))
+        for label, authenticate, attempts, cache in (
+                ('valid, plaintext (before)', old_authenticate, valid, None),
+                # First logins replace the synthetic plaintext passwords by hashes
+                ('valid, first login, rehash', app.authenticate, valid, NegativeCache()),
+                ('valid, scrypt', app.authenticate, valid, NegativeCache()),
+                ('failed, plaintext (before)', old_authenticate, flood, None),
+                ('failed, scrypt, no negative cache', app.authenticate, flood, NegativeCache(max_names=0)),
+                ('failed, scrypt, negative cache', app.authenticate, flood, NegativeCache())):
+            if cache is not None:
+                app.failed_logins = cache
+            rate, accepted = run(authenticate, attempts, args.threads)
+            print('{:>36} {:>12.0f} {:>10}'.format(label, rate, accepted))
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Like and match latency for ordinary users and for a celebrity with a huge like count.
+
+    python benchmarks/bench_matches.py --users 200000 --fans 100000
+
+The celebrity (user 1) is liked by most of --fans users and likes half of them. Then the
+celebrity likes fans back and fans like the celebrity back, each like completing a match,
+next to likes between ordinary users. app.record_swipe looks the reverse like up by
+primary key in the same transaction; the previous way, which loaded the other user's likes
+and tested membership, is timed too. Match events are checked to appear once per new match.
+"""
+###### packages and dependencies ######
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+from synthetic import populate
+
+import app
+import db
+
+####################################################################################################
+def old_like(src_id, dst_id):
+    """Mutual-match check on the other user's loaded likes, as User.like did."""
+    with db.transaction() as conn:
+        liked_users = db.fetch_relationships(conn, dst_id)[0]
+        db.record_swipe(conn, src_id, dst_id, 'like', time.time())
+        return src_id in liked_users
+
+
+def timed(pairs, like):
+    timings = []
+    for src_id, dst_id in pairs:
+        start = time.perf_counter()
+        like(src_id, dst_id)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--fans', type=int, default=100000)
+    parser.add_argument('--likes', type=int, default=200, help='likes timed per case')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'matches.db')
+        populate(db_path, args.users)
+        rng = random.Random(0)
+        fans = rng.sample(range(2, args.users + 1), args.fans)
+        half, likes = args.fans // 2, args.likes
+        # The celebrity is liked by every fan but the last 2 * likes, and likes the first half
+        # of them plus those last ones: every like timed below completes a match
+        inbound, outbound = fans[:-2 * likes], fans[:half] + fans[-2 * likes:]
+        conn = sqlite3.connect(db_path)
+        conn.executemany("INSERT INTO swipes (src, dst, kind, ts) VALUES (?, 1, 'like', 0)",
+                         ((fan,) for fan in inbound))
+        conn.executemany("INSERT INTO swipes (src, dst, kind, ts) VALUES (1, ?, 'like', 0)",
+                         ((fan,) for fan in outbound))
+        conn.commit()
+        conn.close()
+        db.configure(db_path)
+        with db.connection() as conn:
+            first_event = db.last_match_event(conn)
+
+        new_like = lambda src_id, dst_id: app.record_swipe(src_id, dst_id, 'like')
+        liked_back, late_fans = fans[half:half + 2 * likes], fans[-2 * likes:]
+        others = rng.sample(range(args.users // 2, args.users + 1), 2 * likes)
+        cases = (
+            ('celebrity likes fan back', [(1, fan) for fan in liked_back[:likes]], new_like),
+            ('fan likes celebrity back', [(fan, 1) for fan in late_fans[:likes]], new_like),
+            ('ordinary like', list(zip(others[::2], others[1::2])), new_like),
+            ('celebrity likes fan back, old', [(1, fan) for fan in liked_back[likes:]], old_like),
+            ('fan likes celebrity back, old', [(fan, 1) for fan in late_fans[likes:]], old_like),
+        )
+        print('{:>32} {:>10} {:>10}'.format('{} likes of the celebrity'.format(len(inbound)), 'p50 ms', 'p99 ms'))
+        for label, pairs, like in cases:
+            timings = timed(pairs, like)
+            print('{:>32} {:>10.3f} {:>10.3f}'.format(label, np.median(timings), np.percentile(timings, 99)))
+
+        with db.connection() as conn:
+            events = db.fetch_match_events(conn, first_event, 10 * likes)
+        # Every celebrity case made one match per like; ordinary users had no likes to return
+        assert len(events) == 4 * likes, len(events)
+        assert len({(user_id, other_id) for _, user_id, other_id, _ in events}) == len(events)
+        print('{} match events, one per new match'.format(len(events)))
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Bytes per in-memory User, for the previous dict-backed User and the current __slots__ User.
+
+    python benchmarks/bench_memory.py --users 1000000
+
+Rows are read back from a synthetic database, so every string is a separate object as in
+production. Memory is measured with tracemalloc while the users are alive.
+"""
+###### packages and dependencies ######
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from synthetic import populate
+
+import db
+from app import User
+
+####################################################################################################
+class DictUser:
+    """The User representation before __slots__: a __dict__ and three sets per instance."""
+    def __init__(self, user_id, name, password, MBTI, age, gender, location, interests,
+                 liked_users=None, disliked_users=None, matches=None):
+        self.user_id = user_id
+        self.name = name
+        self.password = password
+        self.MBTI = MBTI
+        self.age = age
+        self.gender = gender
+        self.location = location
+        self.interests = interests
+        self.liked_users = set(liked_users) if liked_users is not None else set()
+        self.disliked_users = set(disliked_users) if disliked_users is not None else set()
+        self.matches = set(matches) if matches is not None else set()
+
+
+def dict_users(rows):
+    return [DictUser(*row[:7], row[7].split(',') if row[7] else []) for row in rows]
+
+
+def measure(build, db_path):
+    tracemalloc.start()
+    with db.connection(db_path) as conn:
+        rows = db.fetch_all_users(conn)
+    start = time.perf_counter()
+    users = build(rows)
+    elapsed = time.perf_counter() - start
+    # Only what the users keep alive is counted, as after loading in production
+    del rows
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(users), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'memory.db')
+        populate(db_path, args.users)
+        print('{:>28} {:>14} {:>10}'.format('{} users'.format(args.users), 'bytes/user', 'build'))
+        for label, build in (('dict + sets (before)', dict_users),
+                             ('__slots__, lazy sets (after)', User.db_rows_to_users)):
+            per_user, elapsed = measure(build, db_path)
+            print('{:>28} {:>14.0f} {:>9.2f}s'.format(label, per_user, elapsed))
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
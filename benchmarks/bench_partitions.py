@@ -0,0 +1,67 @@
+"""Rows scored and latency of partitioned top-k retrieval against a full scan.
+
+    python benchmarks/bench_partitions.py --sizes 10000 100000 1000000 --skew 1.2
+"""
+###### packages and dependencies ######
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from synthetic import city_weights, populate, random_profile
+
+import db
+from app import User
+from candidates import CandidateStore
+
+####################################################################################################
+def queries(n, count, skew):
+    """Random users whose cities follow the same distribution as the population."""
+    rng = random.Random(1)
+    weights = city_weights(skew) if skew else None
+    result = []
+    for _ in range(count):
+        profile = random_profile(rng, 0, weights)
+        user = User(rng.randint(1, n), *profile[:6], profile[6].split(','))
+        result.append((user, rng.choice(("Female", "Male", "Both"))))
+    return result
+
+
+def run(store, workload, k, partitioned):
+    scanned = 0
+    start = time.perf_counter()
+    for user, gender_preference in workload:
+        store.top_matches(user, gender_preference, k, partitioned=partitioned)
+        scanned += store.last_rows_scored
+    return (time.perf_counter() - start) / len(workload), scanned / len(workload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--skew', type=float, default=1.2, help='Zipf exponent of the city distribution')
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    print('{:>10} {:>14} {:>14} {:>12} {:>12}'.format(
+        'users', 'rows (full)', 'rows (part.)', 'full', 'partitioned'))
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.sizes:
+            db_path = os.path.join(directory, 'partitions_{}.db'.format(n))
+            populate(db_path, n, skew=args.skew)
+            store = CandidateStore.from_db(db_path)
+            store.partition_index()
+            workload = queries(n, args.queries, args.skew)
+
+            full_time, full_rows = run(store, workload, args.k, False)
+            part_time, part_rows = run(store, workload, args.k, True)
+            print('{:>10} {:>14.0f} {:>14.0f} {:>10.2f}ms {:>10.2f}ms'.format(
+                n, full_rows, part_rows, full_time * 1000, part_time * 1000))
+            db.close_all()
+            os.remove(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Cost of CandidateStore.refresh() after a fixed number of changes, for growing tables.
+
+    python benchmarks/bench_refresh.py --sizes 10000 100000 1000000 --changes 100 --entries 3000
+
+Also times RecommendationCache.apply_changes with those changes against --entries cached
+lists, as get_candidate_store() runs both before every recommendation.
+"""
+###### packages and dependencies ######
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from synthetic import populate, random_profile
+
+import app
+import db
+from cache import RecommendationCache
+from candidates import CandidateStore
+
+####################################################################################################
+def apply_changes(db_path, n, changes, rng):
+    """Insert, update and delete changes//3 users each, in one transaction."""
+    conn = sqlite3.connect(db_path)
+    third = changes // 3
+    conn.executemany('''
+        INSERT INTO users (name, password, MBTI, age, gender, location, interests, liked_users, disliked_users, matches)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [random_profile(rng, 'new{}'.format(rng.random())) for _ in range(third)])
+    conn.executemany('UPDATE users SET age = age + 1 WHERE user_id = ?',
+                     [(rng.randint(1, n),) for _ in range(third)])
+    conn.executemany('DELETE FROM users WHERE user_id = ?',
+                     [(rng.randint(1, n),) for _ in range(changes - 2 * third)])
+    conn.commit()
+    conn.close()
+
+
+def fill_cache(store, entries, rng):
+    """A cache with one list per sampled user, preferences in turn, as served to them."""
+    cache = RecommendationCache(max_entries=max(entries, 1))
+    alive = store.user_id[store.alive].tolist()
+    for i, user_id in enumerate(rng.sample(alive, min(entries, len(alive)))):
+        cache.page(store, app.fetch_user(user_id), ("Female", "Male", "Both")[i % 3])
+    return cache
+
+
+def bench(n, changes, rounds, entries, directory):
+    db_path = os.path.join(directory, 'refresh_{}.db'.format(n))
+    populate(db_path, n)
+    db.configure(db_path)
+
+    start = time.perf_counter()
+    store = CandidateStore.from_db(db_path)
+    build = time.perf_counter() - start
+
+    rng = random.Random(n)
+    refreshes, invalidations = [], []
+    for _ in range(rounds):
+        # Refilled every round, or the lists dropped by the previous one would be missing
+        cache = fill_cache(store, entries, rng)
+        apply_changes(db_path, n, changes, rng)
+        start = time.perf_counter()
+        changed = store.refresh()
+        refreshes.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        cache.apply_changes(store, changed)
+        invalidations.append(time.perf_counter() - start)
+    refreshes.sort()
+    invalidations.sort()
+    db.close_all()
+    os.remove(db_path)
+    return build, refreshes[len(refreshes) // 2], invalidations[len(invalidations) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--changes', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--entries', type=int, default=1000, help='cached recommendation lists')
+    args = parser.parse_args()
+
+    print('{:>10} {:>14} {:>20} {:>25}'.format('users', 'full build', 'refresh (median)',
+                                               'cache invalidation (median)'))
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.sizes:
+            build, refresh, invalidation = bench(n, args.changes, args.rounds, args.entries, directory)
+            print('{:>10} {:>12.1f}ms {:>18.2f}ms {:>23.2f}ms'.format(n, build * 1000, refresh * 1000,
+                                                                      invalidation * 1000))
+
+
+if __name__ == "__main__":
+    main()
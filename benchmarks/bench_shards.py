@@ -0,0 +1,165 @@
+"""Swipe throughput and recommendations of one database split into 1, 2, 4... shards.
+
+    python benchmarks/bench_shards.py --users 200000 --shards 1 2 4 --workers 4 --swipes 2000
+
+The same synthetic users are split into each number of shards (shards.split). --workers
+processes then record --swipes swipes each at the same time, worker w for the users of
+shard w % shards. A fraction --local of them goes to users of the same city, hence shard,
+the others to anybody. Then pairs of users of different shards like each other from two
+processes at once, and every pair must make exactly one match, stored on both sides.
+Last, recommendations scattered over the shards must equal those of the unsplit database.
+"""
+###### packages and dependencies ######
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from synthetic import populate
+
+import db
+import shards
+from candidates import CandidateStore
+
+####################################################################################################
+def swipe_worker(root, pairs, barrier, synchronous):
+    """Record the (src, dst, kind) swipes; returns (start, end, matches)."""
+    db.PRAGMAS = tuple((name, synchronous if name == 'synchronous' else value) for name, value in db.PRAGMAS)
+    sharded = shards.Shards(root)
+    for path in sharded.paths:
+        db.get_pool(path)
+    barrier.wait()
+    start = time.perf_counter()
+    matched = sum(sharded.record_swipe(src_id, dst_id, kind) for src_id, dst_id, kind in pairs)
+    end = time.perf_counter()
+    db.close_all()
+    return start, end, matched
+
+
+def run_workers(root, work, synchronous='NORMAL'):
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager:
+        barrier = manager.Barrier(len(work))
+        with context.Pool(len(work)) as pool:
+            results = pool.starmap(swipe_worker, [(root, pairs, barrier, synchronous) for pairs in work])
+    elapsed = max(end for _, end, _ in results) - min(start for start, _, _ in results)
+    return elapsed, [matched for _, _, matched in results]
+
+
+def users_by_shard(db_path, sharded):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT user_id, location FROM users').fetchall()
+    conn.close()
+    by_city, by_shard = {}, [[] for _ in range(sharded.count)]
+    for user_id, location in rows:
+        by_city.setdefault(location, []).append(user_id)
+        by_shard[sharded.shard_for_location(location)].append((user_id, location))
+    return by_city, by_shard, [user_id for user_id, _ in rows]
+
+
+def swipe_work(sharded, by_city, by_shard, everyone, workers, swipes, local, seed=0):
+    rng = random.Random(seed)
+    work = []
+    for worker in range(workers):
+        own = by_shard[worker % sharded.count]
+        pairs = []
+        while len(pairs) < swipes:
+            src_id, location = rng.choice(own)
+            dst_id = rng.choice(by_city[location] if rng.random() < local else everyone)
+            if dst_id != src_id:
+                pairs.append((src_id, dst_id, 'like' if rng.random() < 0.5 else 'dislike'))
+        work.append(pairs)
+    return work
+
+
+def check_mutual_likes(root, sharded, by_shard, count, seed=1):
+    """Users of shards 0 and 1 like each other from two processes; every pair must match once."""
+    rng = random.Random(seed)
+    left = rng.sample([user_id for user_id, _ in by_shard[0]], count)
+    right = rng.sample([user_id for user_id, _ in by_shard[1]], count)
+    _, matched = run_workers(root, [[(a, b, 'like') for a, b in zip(left, right)],
+                                    [(b, a, 'like') for a, b in zip(left, right)]])
+    assert sum(matched) == count, matched
+    for a, b in zip(left, right):
+        for user_id, other_id in ((a, b), (b, a)):
+            with db.connection(sharded.paths[sharded.shard_of(user_id)]) as conn:
+                assert conn.execute('SELECT 1 FROM matches WHERE user_id = ? AND other_id = ?',
+                                    (user_id, other_id)).fetchone(), (user_id, other_id)
+    events = 0
+    for path in sharded.paths:
+        with db.connection(path) as conn:
+            events += conn.execute('SELECT COUNT(*) FROM match_events WHERE user_id IN ({})'.format(
+                ','.join(map(str, left + right)))).fetchone()[0]
+    assert events == count, events
+
+
+def check_recommendations(db_path, sharded, count, seed=2):
+    """Scatter-gather top-5 must equal the unsplit store's; returns (single ms, sharded ms) p50."""
+    store = CandidateStore.from_db(db_path)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT user_id, MBTI, age, location, interests FROM users ORDER BY RANDOM() LIMIT ?',
+                        (count,)).fetchall()
+    conn.close()
+    sharded.top_matches(SimpleNamespace(user_id=0, MBTI='ENFP', age=30, location='Toronto', interests=[],
+                                        liked_users=set(), disliked_users=set()), 'Both')
+    single, scattered = [], []
+    for i, (user_id, MBTI, age, location, interests) in enumerate(rows):
+        user = SimpleNamespace(user_id=user_id, MBTI=MBTI, age=age, location=location,
+                               interests=interests.split(',') if interests else [],
+                               liked_users=set(), disliked_users=set())
+        preference = ('Female', 'Male', 'Both')[i % 3]
+        start = time.perf_counter()
+        expected, _ = store.top_matches(user, preference)
+        single.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        found, _ = sharded.top_matches(user, preference)
+        scattered.append(time.perf_counter() - start)
+        assert expected.tolist() == found.tolist(), (user_id, expected, found)
+    return np.median(single) * 1000, np.median(scattered) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--swipes', type=int, default=2000, help='swipes per worker')
+    parser.add_argument('--local', type=float, default=0.8, help='fraction of swipes within the same city')
+    parser.add_argument('--pairs', type=int, default=500, help='cross-shard mutual likes checked')
+    parser.add_argument('--queries', type=int, default=30)
+    parser.add_argument('--synchronous', default='NORMAL',
+                        help='SQLite synchronous mode of the swiping workers; FULL waits for an fsync per commit')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'users.db')
+        populate(db_path, args.users)
+        print('{:>7} {:>10} {:>12} {:>13} {:>15}'.format(
+            'shards', 'split s', 'swipes/s', 'single ms', 'scattered ms'))
+        for count in args.shards:
+            root = os.path.join(directory, 'shards{}'.format(count))
+            start = time.perf_counter()
+            sharded = shards.split(db_path, root, count)
+            split_seconds = time.perf_counter() - start
+            by_city, by_shard, everyone = users_by_shard(db_path, sharded)
+
+            work = swipe_work(sharded, by_city, by_shard, everyone, args.workers, args.swipes, args.local)
+            elapsed, _ = run_workers(root, work, args.synchronous)
+            if count > 1:
+                check_mutual_likes(root, sharded, by_shard, args.pairs)
+            single, scattered = check_recommendations(db_path, sharded, args.queries)
+            print('{:>7} {:>10.2f} {:>12.0f} {:>13.2f} {:>15.2f}'.format(
+                count, split_seconds, args.workers * args.swipes / elapsed, single, scattered))
+            sharded.close()
+            db.close_all()
+        if any(count > 1 for count in args.shards):
+            print('cross-shard mutual likes: {} pairs, one match each'.format(args.pairs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Worker time-to-first-recommendation: reading the users table vs mapping a snapshot.
+
+    python benchmarks/bench_snapshot.py --users 500000 --delta 5000 --workers 4
+
+Writes a snapshot of --users synthetic users, then changes --delta users and adds as many
+new ones, so workers have a delta to apply on top of it. Each worker is a fresh process
+that builds its candidate store (CandidateStore.from_db or snapshot.load) and returns its
+first top-5; the time to do so and the worker's private memory are reported. The
+recommendations of both kinds of worker are checked to be the same.
+"""
+###### packages and dependencies ######
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from synthetic import populate, random_profile
+
+import db
+import snapshot
+from candidates import CandidateStore
+
+####################################################################################################
+class Probe:
+    """Fields of the user recommendations are computed for."""
+    user_id, MBTI, age, location, interests = 1, 'ENFP', 30, 'Toronto', ['Music', 'Cooking']
+    liked_users = disliked_users = frozenset()
+
+
+def private_kib():
+    """Private resident memory of this process, from /proc (None elsewhere)."""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+    return sum(int(fields[name].split()[0]) for name in ('Private_Clean', 'Private_Dirty'))
+
+
+def worker(mode, db_path, snapshot_path):
+    baseline = private_kib()
+    start = time.perf_counter()
+    store = CandidateStore.from_db(db_path) if mode == 'database' else snapshot.load(snapshot_path, db_path)
+    loaded = time.perf_counter()
+    user_ids, _ = store.top_matches(Probe, 'Both')
+    elapsed = time.perf_counter() - start
+    memory = private_kib()
+    db.close_all()
+    return (loaded - start, elapsed, None if memory is None else memory - baseline, user_ids.tolist())
+
+
+def change_users(db_path, n, delta):
+    rng = random.Random(1)
+    conn = sqlite3.connect(db_path)
+    for user_id in rng.sample(range(1, n + 1), delta):
+        conn.execute('UPDATE users SET age = age + 1, location = ? WHERE user_id = ?', ('Toronto', user_id))
+    conn.executemany('''
+        INSERT INTO users (name, password, MBTI, age, gender, location, interests)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (random_profile(rng, 'new{}'.format(i))[:7] for i in range(delta)))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500000)
+    parser.add_argument('--delta', type=int, default=5000, help='users changed and added after the snapshot')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'snapshot.db')
+        snapshot_path = os.path.join(directory, 'candidates.snapshot')
+        populate(db_path, args.users)
+        start = time.perf_counter()
+        snapshot.write(CandidateStore.from_db(db_path), snapshot_path)
+        db.close_all()
+        print('snapshot of {} users written in {:.2f}s, {:.1f} MB'.format(
+            args.users, time.perf_counter() - start, os.path.getsize(snapshot_path) / 2 ** 20))
+        change_users(db_path, args.users, args.delta)
+
+        print('{:>10} {:>10} {:>12} {:>14}'.format('worker', 'load ms', 'first ms', 'private MiB'))
+        context = multiprocessing.get_context('spawn')
+        results = {}
+        for mode in ('database', 'snapshot'):
+            with context.Pool(args.workers) as pool:
+                runs = pool.starmap(worker, [(mode, db_path, snapshot_path)] * args.workers)
+            for load, first, memory, _ in runs:
+                print('{:>10} {:>10.1f} {:>12.1f} {:>14}'.format(
+                    mode, load * 1000, first * 1000, '-' if memory is None else '{:.1f}'.format(memory / 1024)))
+            results[mode] = runs[0][3]
+        assert results['database'] == results['snapshot'], results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Startup cost of each entry point: import time, first call and resident memory.
+
+    python benchmarks/bench_startup.py --users 20000 --repeat 5
+
+Every case runs in a fresh interpreter against a synthetic database: importing app (what
+GUI.py does) or service, then the first sign-up, login, profile view or matching call.
+Reported are the median times, the peak resident memory of the process, and whether
+NumPy and pandas were loaded, which only the matching call should need.
+"""
+###### packages and dependencies ######
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+from synthetic import populate
+
+####################################################################################################
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (label, module imported, first call made after the import)
+CASES = (
+    ('import app', 'app', ''),
+    ('sign up', 'app', "app.insert_user(app.User(-1, 'new{}'.format(os.getpid()), 'x', 'ENFP', 30, 'Female', "
+                       "'Toronto', ['Music']))"),
+    ('log in', 'app', "app.authenticate('user1', 'password1')"),
+    ('view profile', 'app', 'app.fetch_user(2)'),
+    ('first match', 'app', "app.compute_compatibility_scores(app.fetch_user(3), 'Both')"),
+    ('import service', 'service', ''),
+    ('import numpy, pandas', 'pandas', 'import numpy'),
+)
+
+PROBE = '''
+import json, os, resource, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+app = sys.modules.get('app')
+{call}
+called = time.perf_counter()
+print(json.dumps({{
+    'import': imported - start,
+    'call': called - imported,
+    'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'numpy': 'numpy' in sys.modules,
+    'pandas': 'pandas' in sys.modules,
+}}))
+'''
+
+
+def run_case(module, call, db_path):
+    environment = dict(os.environ, PAIRFECT_DB=db_path)
+    output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, call=call)], cwd=ROOT,
+                            env=environment, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'startup.db')
+        populate(db_path, args.users)
+        # The first login replaces the plaintext password by a hash; do it before timing
+        run_case('app', "app.authenticate('user1', 'password1')", db_path)
+
+        print('{:>22} {:>10} {:>10} {:>10} {:>7} {:>7}'.format(
+            'case', 'import ms', 'call ms', 'RSS MiB', 'numpy', 'pandas'))
+        for label, module, call in CASES:
+            runs = [run_case(module, call, db_path) for _ in range(args.repeat)]
+            print('{:>22} {:>10.1f} {:>10.1f} {:>10.1f} {:>7} {:>7}'.format(
+                label, np.median([run['import'] for run in runs]) * 1000,
+                np.median([run['call'] for run in runs]) * 1000,
+                np.median([run['rss'] for run in runs]) / 1024,
+                'yes' if runs[0]['numpy'] else 'no', 'yes' if runs[0]['pandas'] else 'no'))
+
+
+if __name__ == "__main__":
+    main()
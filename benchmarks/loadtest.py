@@ -0,0 +1,161 @@
+"""Load test of service.py: p50/p99 latency and throughput at a given concurrency.
+
+    python benchmarks/loadtest.py --users 10000 --concurrency 32 --duration 10
+    python benchmarks/loadtest.py --address 127.0.0.1:8080 ...   # against a running service
+
+Without --address a service is started on a synthetic database. Every client logs in as a
+different synthetic user, then repeatedly asks for recommendations and likes or dislikes
+the first one.
+"""
+###### packages and dependencies ######
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic import populate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+####################################################################################################
+###### Client ######
+class Client:
+    """Minimal keep-alive HTTP/1.1 JSON client."""
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+        self.token = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode() if body is not None else b''
+        headers = 'Content-Length: {}\r\n'.format(len(data))
+        if self.token:
+            headers += 'Authorization: Bearer {}\r\n'.format(self.token)
+        self.writer.write('{} {} HTTP/1.1\r\nHost: {}\r\n{}\r\n'
+                          .format(method, path, self.host, headers).encode() + data)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def run_client(i, host, port, deadline, latencies, errors):
+    client = Client(host, port)
+    rng = random.Random(i)
+    try:
+        status, result = await client.request('POST', '/login', {'name': 'user{}'.format(i),
+                                                                 'password': 'password{}'.format(i)})
+        if status != 200:
+            errors.append(result)
+            return
+        client.token = result['token']
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, result = await client.request('GET', '/recommendations?gender=Both')
+            latencies['recommendations'].append(time.perf_counter() - start)
+            if status != 200 or not result['matches']:
+                errors.append(result)
+                continue
+
+            start = time.perf_counter()
+            status, result = await client.request('POST', '/swipe', {
+                'user_id': result['matches'][0]['user_id'],
+                'kind': 'like' if rng.random() < 0.5 else 'dislike'})
+            latencies['swipe'].append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(result)
+    finally:
+        client.close()
+
+
+async def load(host, port, concurrency, duration):
+    latencies = {'recommendations': [], 'swipe': []}
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(i, host, port, start + duration, latencies, errors)
+                           for i in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+####################################################################################################
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else float('nan')
+
+
+def wait_for_port(host, port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            asyncio.run(asyncio.wait_for(asyncio.open_connection(host, port), 1))
+            return
+        except (OSError, asyncio.TimeoutError):
+            time.sleep(0.2)
+    raise RuntimeError('service did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--address', help='host:port of a running service')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    server = None
+    directory = tempfile.TemporaryDirectory()
+    try:
+        if args.address:
+            host, port = args.address.rsplit(':', 1)
+            port = int(port)
+        else:
+            host, port = '127.0.0.1', args.port
+            db_path = os.path.join(directory.name, 'users.db')
+            populate(db_path, max(args.users, args.concurrency))
+            server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'service.py'),
+                                       '--port', str(port), '--db', db_path],
+                                      stdout=subprocess.DEVNULL)
+            wait_for_port(host, port)
+
+        latencies, errors, elapsed = asyncio.run(load(host, port, args.concurrency, args.duration))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        directory.cleanup()
+
+    print('concurrency {}, {:.1f}s, {} errors'.format(args.concurrency, elapsed, len(errors)))
+    print('{:<16} {:>9} {:>10} {:>10} {:>10}'.format('endpoint', 'requests', 'req/s', 'p50', 'p99'))
+    everything = []
+    for endpoint, values in latencies.items():
+        everything.extend(values)
+        print('{:<16} {:>9} {:>10.0f} {:>8.1f}ms {:>8.1f}ms'.format(
+            endpoint, len(values), len(values) / elapsed,
+            percentile(values, 50) * 1000, percentile(values, 99) * 1000))
+    print('{:<16} {:>9} {:>10.0f} {:>8.1f}ms {:>8.1f}ms'.format(
+        'total', len(everything), len(everything) / elapsed,
+        percentile(everything, 50) * 1000, percentile(everything, 99) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Benchmark suite of the main code paths on a synthetic population, compared against a baseline.
+
+    python benchmarks/suite.py --scale 10000 [--output results.json] [--repeat 5 --warmup 1]
+                               [--baseline benchmarks/baseline.json --threshold 0.25] [--update-baseline]
+
+Builds a database of --scale users with power-law swipe histories (fixed seeds, so every run
+sees the same data), then runs every case --warmup rounds untimed and --repeat rounds timed,
+on different users each round. It writes to --output the median over the rounds of each
+round's median latency, the spread of those medians (half their range) and the p95 latency.
+Against a baseline recorded at the same scale, a case whose median is more than --threshold
+slower, and slower by more than --noise times the two spreads, fails the run (exit status 1).
+--update-baseline stores this run's medians and spreads as the new baseline for the scale;
+benchmarks/baseline.json has one for 10000, 100000 and 1000000 users.
+"""
+###### packages and dependencies ######
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+from synthetic import populate, populate_power_law_swipes
+
+import app
+import db
+
+####################################################################################################
+###### Cases ######
+def timed(operations):
+    """Run each zero-argument callable once; return the latencies in ms."""
+    timings = []
+    for operation in operations:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            operation()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def users_by_swipes(db_path):
+    """user_ids sorted by the number of swipes they made, most first."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return [user_id for (user_id,) in conn.execute(
+            'SELECT src FROM swipes GROUP BY src ORDER BY COUNT(*) DESC, src')]
+    finally:
+        conn.close()
+
+
+def case_compute_compatibility_scores(context):
+    # Distinct users, so every call is a cache miss and scores the store
+    users = [app.fetch_user(user_id) for user_id in context['sample'](50)]
+    preferences = [("Female", "Male", "Both")[i % 3] for i in range(len(users))]
+    return timed([lambda user=user, preference=preference: app.compute_compatibility_scores(user, preference)
+                  for user, preference in zip(users, preferences)])
+
+def case_compute_compatibility_scores_cached(context):
+    user = app.fetch_user(context['sample'](1)[0])
+    app.compute_compatibility_scores(user, "Both")
+    return timed([lambda: app.compute_compatibility_scores(user, "Both")] * 50)
+
+def case_fetch_valid_users(context):
+    users = [app.fetch_user(user_id) for user_id in context['sample'](10)]
+    return timed([lambda user=user: app.fetch_valid_users(user) for user in users])
+
+def case_fetch_valid_users_heavy_swiper(context):
+    user = app.fetch_user(context['heavy'][0])
+    return timed([lambda: app.fetch_valid_users(user)] * 20)
+
+def case_authenticate(context):
+    # Synthetic user i is stored as user_id i + 1
+    names = ['user{}'.format(user_id - 1) for user_id in context['sample'](5)]
+    # The first login replaces the plaintext synthetic password by a hash
+    for name in names:
+        app.authenticate(name, name.replace('user', 'password'))
+    return timed([lambda name=name: app.authenticate(name, name.replace('user', 'password')) for name in names])
+
+def case_authenticate_failed(context):
+    # Names never tried before, so no login is answered by the cache of failed logins
+    names = ['nobody{}-{}'.format(context['round'], i) for i in range(20)]
+    return timed([lambda name=name: app.authenticate(name, 'wrong') for name in names])
+
+def case_record_swipe(context):
+    pairs = zip(context['sample'](200), context['sample'](200, seed=1))
+    return timed([lambda src=src, dst=dst: app.record_swipe(src, dst, 'like')
+                  for src, dst in pairs if src != dst])
+
+def case_swipe_session_flush(context):
+    user = app.fetch_user(context['sample'](1)[0])
+    timings = []
+    for batch in range(20):
+        session = app.SwipeSession(user, max_pending=10 ** 9, max_delay_ms=10 ** 9)
+        for user_id in context['sample'](20, seed=batch + 2):
+            if user_id != user.user_id:
+                session.dislike(app.User(user_id, None, None, None, None, None, None, []))
+        timings += timed([session.close])
+    return timings
+
+def case_delete_user(context):
+    # Last: it removes users. Heavy swipers and ordinary users are deleted in equal numbers,
+    # different ones every round
+    heavy = context['heavy'][1 + 10 * context['round']:11 + 10 * context['round']]
+    ordinary = [user_id for user_id in context['sample'](30, seed=3) if user_id not in context['heavy']][:10]
+    victims = heavy + ordinary
+    context['deleted'].update(victims)
+    return timed([lambda user_id=user_id: app.delete_user(user_id) for user_id in victims])
+
+CASES = [
+    ('compute_compatibility_scores', case_compute_compatibility_scores),
+    ('compute_compatibility_scores_cached', case_compute_compatibility_scores_cached),
+    ('fetch_valid_users', case_fetch_valid_users),
+    ('fetch_valid_users_heavy_swiper', case_fetch_valid_users_heavy_swiper),
+    ('authenticate', case_authenticate),
+    ('authenticate_failed', case_authenticate_failed),
+    ('record_swipe', case_record_swipe),
+    ('swipe_session_flush_20', case_swipe_session_flush),
+    ('delete_user', case_delete_user),
+]
+####################################################################################################
+
+
+####################################################################################################
+###### Runner ######
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def sampler(scale, context):
+    """sample(count, seed) of users not deleted yet, different in every round."""
+    def sample(count, seed=0):
+        rng = random.Random(seed + 100 * context['round'])
+        users = rng.sample(range(1, scale + 1), min(scale, count + len(context['deleted'])))
+        return [user_id for user_id in users if user_id not in context['deleted']][:count]
+    return sample
+
+
+def summarize(rounds):
+    """Median over the rounds of the median of each round, with their spread (half the range)."""
+    medians = [float(np.median(timings)) for timings in rounds]
+    timings = np.concatenate(rounds)
+    return {
+        'ops': len(rounds[0]),
+        'rounds': len(rounds),
+        'median_ms': round(float(np.median(medians)), 4),
+        'spread_ms': round((max(medians) - min(medians)) / 2, 4),
+        'p95_ms': round(float(np.percentile(timings, 95)), 4),
+    }
+
+
+def run(scale, mean_swipes, selected, repeat, warmup):
+    """Run every case warmup + repeat times; the warmup rounds are not counted."""
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'suite.db')
+        db.close_all()
+        populate(db_path, scale)
+        swipes = populate_power_law_swipes(db_path, mean_swipes)
+        db.configure(db_path)
+        context = {'round': 0, 'deleted': set(), 'heavy': users_by_swipes(db_path)[:11 + 10 * (warmup + repeat)]}
+        context['sample'] = sampler(scale, context)
+        timings = {}
+        for round_ in range(warmup + repeat):
+            context['round'] = round_
+            for name, case in CASES:
+                if selected and name not in selected:
+                    continue
+                result = case(context)
+                if round_ >= warmup:
+                    timings.setdefault(name, []).append(result)
+        results = {}
+        for name, rounds in timings.items():
+            results[name] = summarize(rounds)
+            print('{:>38} {:>10.3f} ms {:>10.3f} ms {:>10.3f} ms  ({} ops x {})'.format(
+                name, results[name]['median_ms'], results[name]['spread_ms'], results[name]['p95_ms'],
+                results[name]['ops'], results[name]['rounds']))
+        db.close_all()
+    return {'scale': scale, 'swipes': swipes, 'environment': environment(), 'results': results}
+
+
+def compare(report, baseline, threshold, min_delta_ms, noise):
+    """Names of the cases whose median regressed by more than threshold against the baseline.
+
+    A slowdown also has to exceed noise times the spreads of the run and of the baseline
+    together, and min_delta_ms, the timer noise of the microsecond cases.
+    """
+    reference = baseline.get(str(report['scale']), {})
+    regressions = []
+    for name, result in report['results'].items():
+        if name not in reference:
+            continue
+        expected = reference[name]['median_ms']
+        ratio = result['median_ms'] / expected
+        margin = max(min_delta_ms, noise * (result['spread_ms'] + reference[name]['spread_ms']))
+        slower = ratio > 1 + threshold and result['median_ms'] - expected > margin
+        status = 'REGRESSION' if slower else 'ok'
+        print('{:>38} {:>10.3f} ms vs {:>10.3f} ms  {:>6.2f}x  {}'.format(
+            name, result['median_ms'], expected, ratio, status))
+        if status != 'ok':
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=10000, help='number of users, e.g. 10000, 100000, 1000000')
+    parser.add_argument('--swipes', type=float, default=20, help='mean swipes per user')
+    parser.add_argument('--cases', nargs='+', help='run only these cases')
+    parser.add_argument('--repeat', type=int, default=5, help='rounds of every case that are timed')
+    parser.add_argument('--warmup', type=int, default=1, help='rounds of every case run first and not timed')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json'))
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown of a median, 0.25 = 25%%')
+    parser.add_argument('--noise', type=float, default=1.0,
+                        help='spreads of the run and the baseline, together, a slowdown has to exceed')
+    parser.add_argument('--min-delta-ms', type=float, default=0.05,
+                        help='smallest slowdown of a median, in ms, that can count as a regression')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    print('{:>38} {:>13} {:>13} {:>13}'.format('scale {}'.format(args.scale), 'median', 'spread', 'p95'))
+    report = run(args.scale, args.swipes, args.cases, args.repeat, args.warmup)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.update_baseline:
+        baseline.setdefault(str(args.scale), {}).update(
+            {name: {'median_ms': result['median_ms'], 'spread_ms': result['spread_ms']}
+             for name, result in report['results'].items()})
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Baseline for scale {} written to {}'.format(args.scale, args.baseline))
+        return
+
+    regressions = compare(report, baseline, args.threshold, args.min_delta_ms, args.noise)
+    if regressions:
+        print('{} case(s) regressed by more than {:.0%}: {}'.format(
+            len(regressions), args.threshold, ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
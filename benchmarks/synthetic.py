@@ -0,0 +1,121 @@
+###### packages and dependencies ######
+import os
+import random
+import sqlite3
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vocab import CITIES, GENDERS, INTERESTS, MBTI_TYPES
+from schema import ensure_schema
+
+####################################################################################################
+###### Synthetic users ######
+def city_weights(skew):
+    """Zipf-like weights over CITIES; 0 gives a uniform distribution."""
+    return [1 / (rank + 1) ** skew for rank in range(len(CITIES))]
+
+
+def random_profile(rng, i, weights=None):
+    """Return a users row (without user_id) with valid vocabularies."""
+    return (
+        'user{}'.format(i),
+        'password{}'.format(i),
+        rng.choice(MBTI_TYPES),
+        rng.randint(18, 60),
+        rng.choice(GENDERS),
+        rng.choices(CITIES, weights)[0] if weights else rng.choice(CITIES),
+        ','.join(rng.sample(INTERESTS, rng.randint(1, 5))),
+        '', '', '',
+    )
+
+
+def populate(db_path, n, seed=0, skew=0):
+    """Create db_path with n random users. An existing file is replaced.
+
+    skew > 0 draws cities from a Zipf-like distribution instead of a uniform one.
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    ensure_schema(db_path)
+    rng = random.Random(seed)
+    weights = city_weights(skew) if skew else None
+    conn = sqlite3.connect(db_path)
+    conn.executemany('''
+        INSERT INTO users (name, password, MBTI, age, gender, location, interests, liked_users, disliked_users, matches)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (random_profile(rng, i, weights) for i in range(n)))
+    conn.commit()
+    conn.close()
+####################################################################################################
+
+
+####################################################################################################
+###### Synthetic swipes ######
+def populate_swipes(db_path, per_user, seed=0):
+    """Give every user per_user random likes/dislikes; mutual likes become matches."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    n = conn.execute('SELECT MAX(user_id) FROM users').fetchone()[0] or 0
+    swipes = []
+    for src in range(1, n + 1):
+        for dst in rng.sample(range(1, n + 1), min(per_user, n)):
+            if dst != src:
+                swipes.append((src, dst, 'like' if rng.random() < 0.5 else 'dislike', 0))
+        if len(swipes) >= 100000 or src == n:
+            conn.executemany('INSERT OR IGNORE INTO swipes (src, dst, kind, ts) VALUES (?, ?, ?, ?)', swipes)
+            swipes = []
+    insert_matches(conn)
+    conn.commit()
+    conn.close()
+
+
+def insert_matches(conn):
+    """Turn every pair of mutual likes into a match, stored from both sides."""
+    conn.execute('''
+        INSERT OR IGNORE INTO matches (user_id, other_id, ts)
+        SELECT a.src, a.dst, MAX(a.ts, b.ts) FROM swipes a JOIN swipes b ON b.src = a.dst AND b.dst = a.src
+        WHERE a.kind = 'like' AND b.kind = 'like'
+    ''')
+
+
+def populate_power_law_swipes(db_path, mean_swipes=20, alpha=1.5, popularity=1.0, like_rate=0.5, seed=0):
+    """Give users power-law swipe histories; mutual likes become matches.
+
+    Swipes per user follow a Pareto tail of exponent alpha scaled to mean_swipes, so most
+    users swipe a little and a few swipe on a large part of the population. Targets are
+    drawn with Zipf-like popularity (weight 1 / rank ** popularity over a random ranking),
+    so a few users receive most of the swipes. Returns the number of swipes written.
+    """
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(db_path)
+    n = conn.execute('SELECT MAX(user_id) FROM users').fetchone()[0] or 0
+    if n < 2:
+        conn.close()
+        return 0
+    counts = rng.pareto(alpha, n) + 1
+    counts = np.minimum(np.round(counts * mean_swipes / counts.mean()), n - 1).astype(np.int64)
+
+    weights = 1 / np.arange(1, n + 1) ** popularity
+    weights = weights[rng.permutation(n)]
+    weights /= weights.sum()
+
+    written = 0
+    sources = np.repeat(np.arange(1, n + 1), counts)
+    # In chunks, so 1M users with tens of swipes each fit in memory
+    for start in range(0, len(sources), 1000000):
+        src = sources[start:start + 1000000]
+        dst = rng.choice(n, len(src), p=weights) + 1
+        keep = src != dst
+        kinds = np.where(rng.random(len(src)) < like_rate, 'like', 'dislike')
+        ts = rng.random(len(src)) * 86400 * 365
+        rows = zip(src[keep].tolist(), dst[keep].tolist(), kinds[keep].tolist(), ts[keep].tolist())
+        written += conn.executemany('INSERT OR IGNORE INTO swipes (src, dst, kind, ts) VALUES (?, ?, ?, ?)',
+                                    rows).rowcount
+    insert_matches(conn)
+    conn.commit()
+    conn.close()
+    return written
+####################################################################################################
@@ -0,0 +1,257 @@
+"""Bulk import and export of user profiles, streamed in chunks.
+
+    python bulk.py import users.csv [--db users.db] [--chunk-size 50000] [--rejects rejects.csv]
+                                    [--allow-unknown-interests]
+    python bulk.py export users.parquet [--db users.db] [--chunk-size 50000]
+
+Files are CSV, or Parquet when the name ends in .parquet (needs pyarrow). Columns are those
+of db.USER_COLUMNS; user_id is optional on import, imported rows keep it when given so a
+backup restores with its ids. Passwords are stored as given: exports carry the stored
+hashes, and plaintext passwords are replaced by a hash at the user's first login.
+
+Interests outside vocab.INTERESTS are rejected unless --allow-unknown-interests is given.
+Older profiles hold such free-text interests, so restoring an export needs it to keep them.
+"""
+###### packages and dependencies ######
+import argparse
+import csv
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+import db
+from schema import USER_CHANGES
+from vocab import CITIES, GENDERS, INTERESTS, MAX_AGE, MBTI_TYPES
+
+####################################################################################################
+###### Settings ######
+FIELDS = tuple(db.USER_COLUMNS.split(', '))
+REQUIRED_FIELDS = FIELDS[1:]
+
+CHUNK_SIZE = 50000
+
+def _parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet files need pyarrow: pip install pyarrow')
+    return pyarrow
+
+def is_parquet(path):
+    return path.lower().endswith('.parquet')
+####################################################################################################
+
+
+####################################################################################################
+###### Validation ######
+def validate(frame, allow_unknown_interests=False):
+    """Split a chunk into (valid rows, rejected rows with an 'error' column), all checks vectorized.
+
+    Rejected rows keep the values as read. Interests outside the vocabulary are only checked
+    when allow_unknown_interests is false.
+    """
+    missing = [field for field in REQUIRED_FIELDS if field not in frame.columns]
+    if missing:
+        raise ValueError('Missing columns: {}'.format(', '.join(missing)))
+    raw = frame.reset_index(drop=True)
+    frame = raw.assign(**{field: raw[field].fillna('')
+                          for field in ('name', 'password', 'MBTI', 'gender', 'location', 'interests')
+                          if raw[field].hasnans})
+
+    age = pd.to_numeric(frame['age'], errors='coerce')
+    user_id = pd.to_numeric(frame['user_id'], errors='coerce') if 'user_id' in frame.columns else None
+
+    checks = [
+        (frame['name'] == '', 'empty name'),
+        (frame['name'].duplicated(), 'duplicate name in file'),
+        (~frame['MBTI'].isin(MBTI_TYPES), 'unknown MBTI'),
+        (~(age.between(1, MAX_AGE) & (age == np.floor(age))), 'age must be an integer from 1 to {}'.format(MAX_AGE)),
+        (~frame['gender'].isin(GENDERS), 'unknown gender'),
+        (~frame['location'].isin(CITIES), 'unknown city'),
+    ]
+    if not allow_unknown_interests:
+        # Every listed interest must be known; an empty list is allowed
+        interests = frame['interests'].str.split(',').explode()
+        unknown_interest = (~interests.isin(INTERESTS) & (interests != '')).groupby(level=0).any()
+        checks.append((unknown_interest.reindex(frame.index, fill_value=False), 'unknown interest'))
+    if user_id is not None:
+        present = frame['user_id'].notna() & (frame['user_id'].astype(str) != '')
+        checks.append(((present & ~(user_id > 0)) | user_id.duplicated() & present, 'bad or duplicate user_id'))
+
+    error = pd.Series(np.select([check.to_numpy() for check, _ in checks],
+                                [message for _, message in checks], default=''), index=frame.index)
+    rejected = raw[error != ''].assign(error=error[error != ''])
+    valid = frame[error == ''].assign(age=age[error == ''])
+    if user_id is not None:
+        valid['user_id'] = user_id[error == '']
+    return valid, rejected
+####################################################################################################
+
+
+####################################################################################################
+###### Import ######
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    if is_parquet(path):
+        pyarrow = _parquet()
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+
+
+def insert_chunk(conn, frame):
+    """Insert a validated chunk; rows whose name or user_id is already taken are returned instead."""
+    names = json.dumps(frame['name'].tolist())
+    taken = {name for (name,) in conn.execute(
+        'SELECT name FROM users WHERE name IN (SELECT value FROM json_each(?))', (names,))}
+    conflict = frame['name'].isin(taken)
+    with_ids = 'user_id' in frame.columns and frame['user_id'].notna().any()
+    if with_ids:
+        ids = json.dumps(frame['user_id'].dropna().astype(np.int64).tolist())
+        taken_ids = {user_id for (user_id,) in conn.execute(
+            'SELECT user_id FROM users WHERE user_id IN (SELECT value FROM json_each(?))', (ids,))}
+        conflict |= frame['user_id'].isin(taken_ids)
+    rejected = frame[conflict].assign(error='name or user_id already exists')
+
+    # In name order, so the UNIQUE index on name is filled sequentially instead of at random
+    frame = frame[~conflict].sort_values('name')
+    profiles = zip(frame['name'].tolist(), frame['password'].tolist(), frame['MBTI'].tolist(),
+                   frame['age'].astype(np.int64).tolist(), frame['gender'].tolist(),
+                   frame['location'].tolist(), frame['interests'].tolist())
+
+    # validate() already enforced everything the CHECK constraints of users test, which are
+    # most of the cost of an insert, so SQLite skips them for this chunk.
+    # The change-log trigger would add a row to user_changes per insert; it is dropped for the
+    # chunk and the changes are logged by one statement instead. DDL is transactional in SQLite,
+    # so other connections never see the trigger missing.
+    last_id = conn.execute('SELECT COALESCE(MAX(user_id), 0) FROM users').fetchone()[0]
+    conn.execute('DROP TRIGGER IF EXISTS users_after_insert')
+    conn.execute('PRAGMA ignore_check_constraints = ON')
+    try:
+        if with_ids:
+            user_ids = frame['user_id'].astype(object).where(frame['user_id'].notna(), None).tolist()
+            conn.executemany('''
+                INSERT INTO users (user_id, name, password, MBTI, age, gender, location, interests)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', ((None if user_id is None else int(user_id), *profile)
+                  for user_id, profile in zip(user_ids, profiles)))
+            explicit = json.dumps([int(user_id) for user_id in user_ids if user_id is not None and user_id <= last_id])
+        else:
+            conn.executemany('''
+                INSERT INTO users (name, password, MBTI, age, gender, location, interests)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', profiles)
+            explicit = '[]'
+    finally:
+        conn.execute('PRAGMA ignore_check_constraints = OFF')
+    # New ids are above the previous maximum, except explicit ones filling gaps below it
+    conn.execute('''
+        INSERT INTO user_changes (user_id)
+        SELECT user_id FROM users WHERE user_id > ?
+        UNION ALL SELECT value FROM json_each(?)
+    ''', (last_id, explicit))
+    conn.execute(USER_CHANGES[1])
+    return len(frame), rejected
+
+
+def import_users(path, db_path=None, chunk_size=CHUNK_SIZE, rejects=None, allow_unknown_interests=False):
+    """Load the profiles of path, one transaction per chunk. Returns counts and the elapsed time.
+
+    Invalid rows and rows clashing with existing users are skipped, and written as read with
+    the reason to the CSV file rejects when given.
+    """
+    start = time.perf_counter()
+    stats = {'read': 0, 'inserted': 0, 'rejected': 0}
+    writer = None
+    rejects_file = open(rejects, 'w', newline='') if rejects else None
+    try:
+        for chunk in read_chunks(path, chunk_size):
+            stats['read'] += len(chunk)
+            chunk = chunk.reset_index(drop=True)
+            valid, rejected = validate(chunk, allow_unknown_interests)
+            with db.transaction(db_path) as conn:
+                inserted, conflicts = insert_chunk(conn, valid)
+            if len(conflicts):
+                # valid keeps the index of the chunk; the conflicts are written as read too
+                rejected = pd.concat([rejected, chunk.loc[conflicts.index].assign(error=conflicts['error'])])
+            stats['inserted'] += inserted
+            stats['rejected'] += len(rejected)
+            if rejects_file is not None and len(rejected):
+                if writer is None:
+                    writer = csv.writer(rejects_file)
+                    writer.writerow(list(rejected.columns))
+                writer.writerows(rejected.itertuples(index=False))
+    finally:
+        if rejects_file is not None:
+            rejects_file.close()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+####################################################################################################
+
+
+####################################################################################################
+###### Export ######
+def iter_pages(db_path=None, chunk_size=CHUNK_SIZE):
+    """Pages of users rows in user_id order; one page in memory at a time."""
+    after_id = 0
+    while True:
+        with db.connection(db_path) as conn:
+            page = db.fetch_users_page(conn, after_id, chunk_size)
+        if page:
+            yield page
+        if len(page) < chunk_size:
+            return
+        after_id = page[-1][0]
+
+
+def export_users(path, db_path=None, chunk_size=CHUNK_SIZE):
+    """Write every profile to path. Returns the number of users and the elapsed time."""
+    start = time.perf_counter()
+    exported = 0
+    if is_parquet(path):
+        pyarrow = _parquet()
+        schema = pyarrow.schema([('user_id', pyarrow.int64()), ('name', pyarrow.string()),
+                                 ('password', pyarrow.string()), ('MBTI', pyarrow.string()),
+                                 ('age', pyarrow.int64()), ('gender', pyarrow.string()),
+                                 ('location', pyarrow.string()), ('interests', pyarrow.string())])
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for page in iter_pages(db_path, chunk_size):
+                columns = list(zip(*page))
+                writer.write_table(pyarrow.table(
+                    {field: list(values) for field, values in zip(FIELDS, columns)}, schema=schema))
+                exported += len(page)
+    else:
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for page in iter_pages(db_path, chunk_size):
+                writer.writerows(page)
+                exported += len(page)
+    return {'exported': exported, 'seconds': time.perf_counter() - start}
+####################################################################################################
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('path')
+    parser.add_argument('--db', default=db.DB_PATH)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--rejects', help='CSV file receiving the rows that were not imported')
+    parser.add_argument('--allow-unknown-interests', action='store_true',
+                        help='keep interests outside the vocabulary, as older profiles have')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        stats = import_users(args.path, args.db, args.chunk_size, args.rejects, args.allow_unknown_interests)
+        print('Imported {inserted} of {read} users ({rejected} rejected) in {seconds:.1f}s'.format(**stats))
+    else:
+        stats = export_users(args.path, args.db, args.chunk_size)
+        print('Exported {exported} users in {seconds:.1f}s'.format(**stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+###### packages and dependencies ######
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+####################################################################################################
+###### Recommendation Cache ######
+# Scores computed at once when checking the cached lists against changed candidates
+STALE_CHUNK = 1 << 20
+
+
+class Recommendation:
+    """Ranked candidates of one (user, gender preference), best first."""
+    def __init__(self, user, query, user_ids, scores, depth):
+        self.user = user
+        self.query = query
+        self.user_ids = user_ids
+        self.scores = scores
+        # A full list may be missing candidates ranked below it, a short one holds all candidates
+        self.full = len(user_ids) >= depth
+        self.threshold = scores['compatibility_score'][-1] if len(user_ids) else None
+        self.removed = set()
+        self.created = time.monotonic()
+
+    def remaining(self, user):
+        """Positions of the candidates user has not swiped on yet."""
+        return [i for i, user_id in enumerate(self.user_ids.tolist())
+                if user_id not in self.removed and user_id not in user.liked_users
+                and user_id not in user.disliked_users]
+
+
+class RecommendationCache:
+    """LRU + TTL cache of ranked recommendation lists, keyed by (user_id, gender_preference).
+
+    Each entry keeps the top `depth` candidates and is served `page_size` at a time; candidates
+    the user swiped on are dropped from the list, so the next page is what a full rescoring
+    would return. Entries are invalidated when their user's profile changes, and when a
+    candidate is inserted or updated with a score that could enter the list.
+    """
+    def __init__(self, max_entries=10000, ttl=300, depth=100, page_size=5):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.depth = depth
+        self.page_size = page_size
+        self.entries = OrderedDict()
+        self.keys_by_user = {}
+        self.keys_by_candidate = {}
+        self.lock = threading.RLock()
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries))
+
+    ###### Entries ######
+    @staticmethod
+    def unindex(index, value, key):
+        keys = index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[value]
+
+    def drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.unindex(self.keys_by_user, key[0], key)
+        for user_id in entry.user_ids.tolist():
+            self.unindex(self.keys_by_candidate, user_id, key)
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() - entry.created > self.ttl:
+            self.drop(key)
+            self.counters['expirations'] += 1
+            entry = None
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def store(self, key, entry):
+        self.drop(key)
+        self.entries[key] = entry
+        self.keys_by_user.setdefault(key[0], set()).add(key)
+        for user_id in entry.user_ids.tolist():
+            self.keys_by_candidate.setdefault(user_id, set()).add(key)
+        while len(self.entries) > self.max_entries:
+            oldest = next(iter(self.entries))
+            self.drop(oldest)
+            self.counters['evictions'] += 1
+
+    def page(self, store, current_user, gender_preference):
+        """Return (user_ids, scores) of the next page for the user, scoring the store on a miss."""
+        key = (current_user.user_id, gender_preference)
+        with self.lock:
+            entry = self.lookup(key)
+            if entry is not None:
+                positions = entry.remaining(current_user)
+                # A full list running short could be missing candidates ranked below it
+                if entry.full and len(positions) < self.page_size:
+                    entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                user_ids, scores = store.top_matches(current_user, gender_preference, k=self.depth)
+                entry = Recommendation(current_user, store.encode_query(current_user, gender_preference),
+                                       user_ids, scores, self.depth)
+                self.store(key, entry)
+                positions = entry.remaining(current_user)
+            else:
+                self.counters['hits'] += 1
+
+            positions = np.array(positions[:self.page_size], dtype=np.intp)
+            return entry.user_ids[positions], {name: values[positions] for name, values in entry.scores.items()}
+
+    ###### Invalidation ######
+    def on_swipe(self, user_id, other_id):
+        """Drop other_id from every list of user_id."""
+        with self.lock:
+            for key in self.keys_by_user.get(user_id, ()):
+                self.entries[key].removed.add(other_id)
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in list(self.keys_by_user.get(user_id, ())):
+                self.drop(key)
+                self.counters['invalidations'] += 1
+
+    def apply_changes(self, store, changes):
+        """Bring the entries in line with users changed in the store (see CandidateStore.refresh).
+
+        A deleted candidate is dropped from the lists holding it, which leaves the order of
+        the others intact. An inserted or updated candidate invalidates the lists holding it
+        and the lists it would now enter: every list shorter than depth, or a full list whose
+        last score it reaches. None, for a store read again from scratch, drops every entry.
+        """
+        if changes is None:
+            with self.lock:
+                self.counters['invalidations'] += len(self.entries)
+                for key in list(self.entries):
+                    self.drop(key)
+            return
+        if not changes:
+            return
+        with self.lock:
+            updated = []
+            for user_id, deleted in changes:
+                # The user's own profile changed: every score in their lists may have moved
+                self.invalidate_user(user_id)
+                slot = store.slot(user_id)
+                if deleted or slot is None:
+                    for key in self.keys_by_candidate.get(user_id, ()):
+                        self.entries[key].removed.add(user_id)
+                else:
+                    updated.append((user_id, slot))
+            for key in self.stale_keys(store, updated):
+                self.drop(key)
+                self.counters['invalidations'] += 1
+
+    def stale_keys(self, store, updated):
+        """Keys of the lists that an updated (user_id, slot) candidate is in, or could now enter.
+
+        The entries are scored against every updated candidate in one pass per pipeline and
+        gender preference; the per-entry checks only run for the few pairs it selects.
+        """
+        if not updated:
+            return set()
+        groups = {}
+        for key, entry in self.entries.items():
+            groups.setdefault((entry.query.pipeline, entry.query.gender), []).append(key)
+        user_ids = [user_id for user_id, _ in updated]
+        slots = np.array([slot for _, slot in updated], dtype=np.int64)
+        listed = [self.keys_by_candidate.get(user_id, ()) for user_id in user_ids]
+
+        stale = set()
+        for keys in groups.values():
+            entries = [self.entries[key] for key in keys]
+            full = np.array([entry.full for entry in entries])
+            thresholds = np.array([-np.inf if entry.threshold is None else entry.threshold for entry in entries])
+            row_of = {key: row for row, key in enumerate(keys)}
+            # A bounded number of scores in memory at a time
+            chunk = max(1, STALE_CHUNK // len(keys))
+            for start in range(0, len(slots), chunk):
+                scores = store.score_slots([entry.query for entry in entries], slots[start:start + chunk])
+                reachable = ~full[:, None] | (scores >= thresholds[:, None])
+                pairs = set(zip(*np.nonzero(reachable)))
+                for column, user_keys in enumerate(listed[start:start + chunk]):
+                    pairs.update((row_of[key], column) for key in user_keys if key in row_of)
+                for row, column in pairs:
+                    entry, user_id = entries[row], user_ids[start + column]
+                    if user_id not in entry.removed and user_id not in entry.user.liked_users \
+                            and user_id not in entry.user.disliked_users:
+                        stale.add(keys[row])
+        return stale
+
+####################################################################################################
@@ -0,0 +1,527 @@
+###### packages and dependencies ######
+import itertools
+import os
+import socket
+import time
+
+import numpy as np
+
+import db
+import scoring
+from schema import changes_trimmed, current_watermark, fetch_changes, trim_changes
+from scoring import Query
+from sketches import SketchIndex
+from vocab import CITIES, GENDERS, INTERESTS
+
+####################################################################################################
+###### Vocabularies ######
+# First letter of each MBTI dimension; a set bit means the type has that letter
+MBTI_POLES = ("E", "S", "T", "J")
+
+# Below this many rows a full scan is cheaper than walking the partitions
+PARTITION_MIN_ROWS = 50000
+
+# Candidates scored per request in approximate mode (see top_matches); 0 keeps results exact
+APPROXIMATE_BUDGET = int(os.environ.get('PAIRFECT_APPROXIMATE', '0') or 0)
+
+# Bit-width of the interests mask. The 15 known interests take the low bits,
+# older free-text interests found in the database are given the bits above them.
+INTEREST_BITS = 64
+
+# Seconds between two reports of a store's watermark, which also trim the change log
+TRIM_INTERVAL = 60
+
+_reader_ids = itertools.count()
+
+# Largest age the int16 age column can hold
+AGE_MAX = int(np.iinfo(np.int16).max)
+
+
+class Vocabulary:
+    """Map strings to small integer codes, seeded with the known values."""
+    def __init__(self, values, limit=None):
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+        self.limit = limit
+
+    def code(self, value):
+        """Return the code for value, assigning a new one if it was never seen."""
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            if self.limit is not None and code >= self.limit:
+                raise ValueError("Vocabulary is full, cannot encode {!r}".format(value))
+            self.values.append(value)
+            self.codes[value] = code
+        return code
+
+    def get(self, value, default=-1):
+        return self.codes.get(value, default)
+
+
+###### Encoding ######
+def encode_mbti(MBTI):
+    """Pack an MBTI string into 4 bits, one per dimension (E, S, T, J)."""
+    code = 0
+    for position, pole in enumerate(MBTI_POLES):
+        if len(MBTI) > position and MBTI[position] == pole:
+            code |= 1 << (3 - position)
+    return code
+
+
+def encode_age(age):
+    """Clip an age into the int16 column; rows written before ages were bounded may exceed it."""
+    return min(max(int(age), 0), AGE_MAX)
+
+
+def split_interests(interests):
+    """Accept both the comma-separated database format and a list of interests."""
+    if isinstance(interests, str):
+        return interests.split(',') if interests else []
+    return list(interests)
+
+
+def top_k(scores, k, tiebreak=None):
+    """Indices of the k highest scores, ties broken by tiebreak (default: position).
+
+    np.argpartition finds the k-th best score in linear time; everything tied with it is
+    kept so the result does not depend on how the partition happened to split the ties.
+    """
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if n > k:
+        kth = scores[np.argpartition(-scores, k - 1)[:k]].min()
+        chosen = np.flatnonzero(scores >= kth)
+    else:
+        chosen = np.arange(n)
+    order = np.lexsort((chosen if tiebreak is None else tiebreak[chosen], -scores[chosen]))
+    return chosen[order[:k]]
+####################################################################################################
+
+
+####################################################################################################
+###### Candidate Store ######
+# (name, dtype) of every encoded column, in the order produced by CandidateStore.encode_row
+COLUMNS = (
+    ('user_id', np.int64),
+    ('age', np.int16),
+    ('gender', np.int8),
+    ('location', np.int16),
+    ('mbti', np.uint8),
+    ('interest_mask', np.uint64),
+)
+
+
+class PartitionIndex:
+    """Slots of a CandidateStore grouped by (gender, location, MBTI) code.
+
+    order lists the indexed slots sorted by partition and groups holds one
+    (gender, location, mbti, start, end) range of order per partition. Slots changed after
+    the index was built are listed in dirty, since they may sit in the wrong partition.
+    """
+    def __init__(self, store):
+        rows = np.flatnonzero(store.alive)
+        gender, location, mbti = store.gender[rows], store.location[rows], store.mbti[rows]
+        self.order = rows[np.lexsort((mbti, location, gender))]
+        gender, location, mbti = store.gender[self.order], store.location[self.order], store.mbti[self.order]
+        changed = (gender[1:] != gender[:-1]) | (location[1:] != location[:-1]) | (mbti[1:] != mbti[:-1])
+        starts = np.flatnonzero(np.r_[True, changed]) if len(self.order) else np.empty(0, dtype=np.intp)
+        ends = np.r_[starts[1:], len(self.order)]
+        self.groups = [(int(gender[start]), int(location[start]), int(mbti[start]), int(start), int(end))
+                       for start, end in zip(starts, ends)]
+        self.columns = {'gender': gender[starts], 'location': location[starts], 'mbti': mbti[starts]}
+        self.ranked = {}
+        self.dirty = set()
+
+    def ranked_groups(self, query):
+        """[(bound, [(start, end), ...]), ...] by decreasing upper bound for one kind of query."""
+        key = (query.gender, query.location, query.mbti, query.pipeline)
+        ranked = self.ranked.get(key)
+        if ranked is None:
+            # Partitions sharing an upper bound are scored together
+            bounds = np.broadcast_to(query.pipeline.bound(query, self.columns), len(self.groups))
+            grouped = {}
+            for bound, (_, _, _, start, end) in zip(bounds.tolist(), self.groups):
+                grouped.setdefault(bound, []).append((start, end))
+            ranked = self.ranked[key] = sorted(grouped.items(), key=lambda item: -item[0])
+        return ranked
+
+
+class ColumnBatch:
+    """Read-only mapping of column name -> values at rows of a store, gathered once on first use."""
+    def __init__(self, store, rows):
+        self.store = store
+        self.rows = rows
+        self.columns = {}
+
+    def __getitem__(self, name):
+        values = self.columns.get(name)
+        if values is None:
+            values = self.columns[name] = self.store.column(name)[self.rows]
+        return values
+
+
+class CandidateStore:
+    """Columnar, in-memory copy of the fields used by the matching algorithm.
+
+    Every user is one row across a handful of NumPy arrays, so scoring a request
+    is a few vectorized passes instead of a pandas read plus per-row callbacks.
+    Rows are kept up to date from the user_changes log: changed users are
+    overwritten in place, new users are appended and deleted users are tombstoned.
+    """
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self.watermark = 0
+        # Name of the store among the readers of user_changes, and when it last reported
+        self.reader = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), next(_reader_ids))
+        self.reported = None
+
+        self.genders = Vocabulary(GENDERS)
+        self.locations = Vocabulary(CITIES)
+        self.interests = Vocabulary(INTERESTS, limit=INTEREST_BITS)
+
+        # Columns are over-allocated so appends are amortized O(1); only [:size] is in use
+        self.size = 0
+        self.buffers = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+        self.alive_buffer = np.empty(0, dtype=bool)
+        self.live = 0
+        # Direct-address table user_id -> slot (-1 if absent), to map id arrays to slots in bulk
+        self.slot_of_id = np.empty(0, dtype=np.int64)
+
+        # Built on demand; slots changed afterwards are listed in their dirty set until the next rebuild
+        self.partitions = None
+        self.sketches = None
+        self.last_rows_scored = 0
+
+    def __len__(self):
+        return self.live
+
+    def slot(self, user_id):
+        """Slot of user_id, or None if the user is not in the store."""
+        if 0 <= user_id < len(self.slot_of_id):
+            slot = int(self.slot_of_id[user_id])
+            if slot >= 0:
+                return slot
+        return None
+
+    def column(self, name):
+        return self.buffers[name][:self.size]
+
+    user_id = property(lambda self: self.column('user_id'))
+    age = property(lambda self: self.column('age'))
+    gender = property(lambda self: self.column('gender'))
+    location = property(lambda self: self.column('location'))
+    mbti = property(lambda self: self.column('mbti'))
+    interest_mask = property(lambda self: self.column('interest_mask'))
+    alive = property(lambda self: self.alive_buffer[:self.size])
+
+    ###### Encoding ######
+    def interest_mask_for(self, interests):
+        mask = 0
+        for interest in split_interests(interests):
+            mask |= 1 << self.interests.code(interest)
+        return mask
+
+    def encode_row(self, user_id, MBTI, age, gender, location, interests):
+        return (user_id, encode_age(age), self.genders.code(gender), self.locations.code(location),
+                encode_mbti(MBTI), self.interest_mask_for(interests))
+
+    def reserve(self, capacity):
+        if capacity <= len(self.alive_buffer):
+            return
+        capacity = max(capacity, 2 * len(self.alive_buffer), 1024)
+        for name, dtype in COLUMNS:
+            buffer = np.empty(capacity, dtype=dtype)
+            buffer[:self.size] = self.buffers[name][:self.size]
+            self.buffers[name] = buffer
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive_buffer[:self.size]
+        self.alive_buffer = alive
+
+    def load_rows(self, rows):
+        """Replace the store content with (user_id, MBTI, age, gender, location, interests) rows."""
+        encoded = [self.encode_row(*row) for row in rows]
+        columns = list(zip(*encoded)) if encoded else [()] * len(COLUMNS)
+        self.size = len(encoded)
+        for (name, dtype), values in zip(COLUMNS, columns):
+            self.buffers[name] = np.array(values, dtype=dtype)
+        self.alive_buffer = np.ones(self.size, dtype=bool)
+        self.index_slots()
+
+    def index_slots(self):
+        """Rebuild slot_of_id from the user_id column; every row must be alive."""
+        user_ids = self.buffers['user_id'][:self.size]
+        self.live = self.size
+        self.slot_of_id = np.full(int(user_ids.max()) + 1 if self.size else 0, -1, dtype=np.int64)
+        self.slot_of_id[user_ids] = np.arange(self.size)
+        self.partitions = None
+        self.sketches = None
+
+    ###### Row-level changes ######
+    def upsert_rows(self, rows):
+        """Insert or overwrite (user_id, MBTI, age, gender, location, interests) rows of distinct users.
+
+        Rows are encoded one by one, then written to the columns with one array assignment each.
+        """
+        encoded = [self.encode_row(*row) for row in rows]
+        if not encoded:
+            return
+        columns = [np.array(values, dtype=dtype) for (_, dtype), values in zip(COLUMNS, zip(*encoded))]
+        user_ids = columns[0]
+        slots = np.full(len(user_ids), -1, dtype=np.int64)
+        known = user_ids < len(self.slot_of_id)
+        slots[known] = self.slot_of_id[user_ids[known]]
+
+        new = np.flatnonzero(slots < 0)
+        if len(new):
+            self.reserve(self.size + len(new))
+            slots[new] = np.arange(self.size, self.size + len(new))
+            self.size += len(new)
+            self.live += len(new)
+            top = int(user_ids.max())
+            if top >= len(self.slot_of_id):
+                grown = np.full(max(top + 1, 2 * len(self.slot_of_id)), -1, dtype=np.int64)
+                grown[:len(self.slot_of_id)] = self.slot_of_id
+                self.slot_of_id = grown
+            self.slot_of_id[user_ids[new]] = slots[new]
+        for (name, _), values in zip(COLUMNS, columns):
+            self.buffers[name][slots] = values
+        self.alive_buffer[slots] = True
+        for index in (self.partitions, self.sketches):
+            if index is not None:
+                index.dirty.update(slots.tolist())
+
+    def remove(self, user_id):
+        slot = self.slot(user_id)
+        if slot is not None:
+            self.alive_buffer[slot] = False
+            self.slot_of_id[user_id] = -1
+            self.live -= 1
+
+    def compact(self):
+        """Drop tombstoned rows once they take up more than half of the store."""
+        if 2 * self.live >= self.size:
+            return
+        keep = np.flatnonzero(self.alive)
+        for name, _ in COLUMNS:
+            self.buffers[name] = self.buffers[name][keep]
+        self.size = len(keep)
+        self.alive_buffer = np.ones(self.size, dtype=bool)
+        self.index_slots()
+
+    def stale(self, index):
+        return index is None or len(index.dirty) > max(1024, self.size // 64)
+
+    def partition_index(self):
+        """Return the (gender, location, MBTI) partitions, rebuilt once too many slots changed."""
+        if self.stale(self.partitions):
+            self.partitions = PartitionIndex(self)
+        return self.partitions
+
+    def sketch_index(self):
+        """Return the buckets and LSH tables of approximate mode, rebuilt once too many slots changed."""
+        if self.stale(self.sketches):
+            self.sketches = SketchIndex(self)
+        return self.sketches
+
+    ###### Database ######
+    @classmethod
+    def from_db(cls, db_path=None):
+        store = cls(db_path)
+        with db.transaction(db_path, immediate=False) as conn:
+            store.reload(conn.cursor())
+        return store
+
+    def reload(self, cursor):
+        """Replace the content with the whole users table, read in the transaction of cursor."""
+        # Read the table and the watermark from the same snapshot
+        watermark = current_watermark(cursor)
+        cursor.execute(
+            'SELECT user_id, MBTI, age, gender, location, interests FROM users ORDER BY user_id')
+        self.load_rows(cursor)
+        self.watermark = watermark
+
+    def refresh(self):
+        """Apply the users changed since the last refresh. Returns their (user_id, deleted) pairs,
+        or None if the changes were trimmed from the log and the whole table was read again.
+        """
+        with db.transaction(self.db_path, immediate=False) as conn:
+            cursor = conn.cursor()
+            if changes_trimmed(cursor, self.watermark):
+                self.reload(cursor)
+                changes = None
+            else:
+                watermark, changes = fetch_changes(cursor, self.watermark)
+        if changes is None:
+            self.report_watermark()
+            return None
+
+        for user_id, *_, deleted in changes:
+            if deleted:
+                self.remove(user_id)
+        self.upsert_rows([row[:-1] for row in changes if not row[-1]])
+        # Only once the rows are in: if encoding fails, the next refresh reads them again
+        self.watermark = watermark
+        self.compact()
+        self.report_watermark()
+        return [(user_id, bool(deleted)) for user_id, *_, deleted in changes]
+
+    def report_watermark(self):
+        """Every TRIM_INTERVAL, record the watermark in change_readers and trim user_changes."""
+        now = time.monotonic()
+        if self.reported is not None and now - self.reported < TRIM_INTERVAL:
+            return
+        self.reported = now
+        try:
+            with db.transaction(self.db_path) as conn:
+                trim_changes(conn, self.reader, self.watermark)
+        except Exception as e:
+            # Trimming can wait for the next report; the store itself is up to date
+            print('Exception: {}'.format(e))
+
+    ###### Scoring ######
+    def exclusion_mask(self, *id_sets):
+        """Boolean mask of the rows whose user_id is in any of id_sets.
+
+        Ids are mapped to slots through slot_of_id, so the cost is linear in the number of
+        excluded ids, with no sort or search over the store.
+        """
+        mask = np.zeros(self.size, dtype=bool)
+        for ids in id_sets:
+            ids = np.fromiter(ids, dtype=np.int64, count=len(ids))
+            ids = ids[(ids >= 0) & (ids < len(self.slot_of_id))]
+            slots = self.slot_of_id[ids]
+            mask[slots[slots >= 0]] = True
+        return mask
+
+    def score(self, current_user, gender_preference, rows=None):
+        """Return the partial scores and the weighted compatibility score for rows."""
+        return self.score_query(self.encode_query(current_user, gender_preference), rows)
+
+    def encode_query(self, current_user, gender_preference):
+        """Encode the fields of current_user used by the scorers, with the user's pipeline."""
+        return Query(None if gender_preference == "Both" else self.genders.get(gender_preference),
+                     self.locations.get(current_user.location), current_user.age,
+                     encode_mbti(current_user.MBTI), self.interest_mask_for(current_user.interests),
+                     scoring.pipeline_for(current_user.user_id), self.interests.values)
+
+    def batch(self, rows):
+        """Columns of rows, gathered on first use by a scorer."""
+        return ColumnBatch(self, rows)
+
+    def score_query(self, query, rows=None):
+        return query.pipeline.score(self.batch(slice(None) if rows is None else rows), query)
+
+    def score_slot(self, query, slot):
+        """Compatibility score of the user in one slot, with the same arithmetic as score()."""
+        return float(query.pipeline.score(self.batch(np.array([slot])), query,
+                                          parts=False)['compatibility_score'][0])
+
+    def score_slots(self, queries, slots):
+        """(len(queries), len(slots)) compatibility scores, with the same arithmetic as score().
+
+        The queries must share their pipeline and gender; the other fields are stacked into
+        (queries, 1) columns and scored against all slots at once, as the batch precompute does.
+        """
+        first = queries[0]
+        query = Query(first.gender,
+                      np.array([query.location for query in queries], dtype=np.int64)[:, None],
+                      np.array([query.age for query in queries], dtype=np.int64)[:, None],
+                      np.array([query.mbti for query in queries], dtype=np.uint8)[:, None],
+                      np.array([query.mask for query in queries], dtype=np.uint64)[:, None],
+                      first.pipeline, first.words)
+        scores = query.pipeline.score(self.batch(np.asarray(slots)), query, parts=False)['compatibility_score']
+        return np.broadcast_to(scores, (len(queries), len(slots)))
+
+    def top_matches(self, current_user, gender_preference, k=5, partitioned=None, budget=None):
+        """Return (user_ids, scores) of the best k candidates the user has not swiped on.
+
+        When partitioned (by default for stores of PARTITION_MIN_ROWS or more), the
+        (gender, location, MBTI) partitions are scored in decreasing order of their upper
+        bound, stopping once the next bound is below the current k-th score. The result is
+        the same as scoring every row.
+
+        With a budget (APPROXIMATE_BUDGET by default), the result is approximate instead:
+        see approximate_top_matches.
+        """
+        excluded = self.exclusion_mask((current_user.user_id,), current_user.liked_users,
+                                       current_user.disliked_users)
+        query = self.encode_query(current_user, gender_preference)
+
+        if budget is None:
+            budget = APPROXIMATE_BUDGET
+        if budget:
+            best_rows, best_scores = self.approximate_top_matches(query, excluded, k, budget)
+            return self.buffers['user_id'][best_rows], best_scores
+
+        if partitioned is None:
+            partitioned = self.size >= PARTITION_MIN_ROWS
+        if not partitioned:
+            rows = np.flatnonzero(self.alive & ~excluded)
+            self.last_rows_scored = len(rows)
+            scores = self.score_query(query, rows)
+            best = top_k(scores['compatibility_score'], k, tiebreak=self.user_id[rows])
+            return self.user_id[rows[best]], {name: values[best] for name, values in scores.items()}
+
+        index = self.partition_index()
+        dirty = np.array(sorted(index.dirty), dtype=np.intp)
+        ranked = index.ranked_groups(query)
+
+        best = None
+        self.last_rows_scored = 0
+
+        # Changed slots may sit in the wrong partition of the index, they are scored up front
+        batches = [(None, [(0, len(dirty))])] + ranked
+        for bound, ranges in batches:
+            if bound is not None and best is not None and len(best[0]) >= k \
+                    and bound < best[1]['compatibility_score'][-1]:
+                break
+            source = dirty if bound is None else index.order
+            rows = np.concatenate([source[start:end] for start, end in ranges])
+            if bound is not None and len(dirty):
+                rows = rows[~np.isin(rows, dirty)]
+            rows = rows[self.alive_buffer[rows] & ~excluded[rows]]
+            if len(rows):
+                best = self.merge_top_k(query, rows, k, best)
+
+        best_rows, best_scores = best if best is not None else self.merge_top_k(query, rows[:0], k)
+        return self.buffers['user_id'][best_rows], best_scores
+
+    def merge_top_k(self, query, rows, k, best=None):
+        """Score rows and return the (rows, scores) of the k best of them and of best."""
+        self.last_rows_scored += len(rows)
+        scores = self.score_query(query, rows)
+        if best is not None:
+            rows = np.concatenate([best[0], rows])
+            scores = {name: np.concatenate([best[1][name], values]) for name, values in scores.items()}
+        chosen = top_k(scores['compatibility_score'], k, tiebreak=self.buffers['user_id'][rows])
+        return rows[chosen], {name: values[chosen] for name, values in scores.items()}
+
+    def approximate_top_matches(self, query, excluded, k, budget):
+        """(rows, scores) of k good candidates, scoring about budget of them plus similar users.
+
+        Buckets of (gender, location, MBTI, age band) are scored in decreasing order of their
+        upper bound until budget candidates are scored. Of the remaining buckets, those whose
+        bound is below the k-th score found cannot improve on it and are skipped; in the
+        others only the candidates whose interests share an LSH band with the user's are
+        scored. Those buckets are the source of the approximation: a candidate there with
+        dissimilar interests can be missed.
+        """
+        index = self.sketch_index()
+        bounds = index.bounds(query)
+        ranked = np.argsort(-bounds, kind='stable')
+        taken = int(np.searchsorted(np.cumsum(index.sizes[ranked]), budget)) + 1
+        self.last_rows_scored = 0
+
+        # Changed slots may sit in the wrong bucket of the index, they are always scored
+        dirty = np.array(sorted(index.dirty), dtype=np.intp)
+        rows = np.union1d(dirty, index.slots(ranked[:taken]))
+        best = self.merge_top_k(query, rows[self.alive_buffer[rows] & ~excluded[rows]], k)
+
+        remaining = ranked[taken:]
+        if len(best[0]) >= k:
+            remaining = remaining[bounds[remaining] >= best[1]['compatibility_score'][-1]]
+        rows = np.setdiff1d(index.similar(query.mask, remaining), dirty, assume_unique=True)
+        return self.merge_top_k(query, rows[self.alive_buffer[rows] & ~excluded[rows]], k, best)
+####################################################################################################
@@ -0,0 +1,140 @@
+###### packages and dependencies ######
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+####################################################################################################
+###### Password hashing ######
+# scrypt parameters of new hashes; stored hashes carry their own, older ones are upgraded at login
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+HASH_PREFIX = 'scrypt$'
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=2 * 128 * r * n)
+
+def hash_password(password):
+    """Return 'scrypt$n$r$p$salt$hash' for password, with a random salt."""
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return '{}{}${}${}${}${}'.format(HASH_PREFIX, SCRYPT_N, SCRYPT_R, SCRYPT_P, salt.hex(), digest.hex())
+
+def is_hashed(stored):
+    return stored is not None and stored.startswith(HASH_PREFIX)
+
+def needs_rehash(stored):
+    """True for plaintext passwords of accounts created before hashing, and for old parameters."""
+    if not is_hashed(stored):
+        return True
+    n, r, p = stored.split('$')[1:4]
+    return (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+def verify_password(password, stored):
+    """Check password against a stored hash, or a legacy plaintext password, in constant time."""
+    if stored is None:
+        return False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+    n, r, p, salt, digest = stored[len(HASH_PREFIX):].split('$')
+    return hmac.compare_digest(_scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p)),
+                               bytes.fromhex(digest))
+
+# Checked against when the name is unknown, so a missing account costs as much as a wrong password.
+# Made on first use: hashing takes tens of milliseconds, which every import would pay otherwise.
+_dummy_hash = None
+
+def dummy_hash():
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(16))
+    return _dummy_hash
+####################################################################################################
+
+
+####################################################################################################
+###### Negative cache ######
+class FailedLogins:
+    def __init__(self):
+        self.unknown = False
+        self.passwords = set()
+        self.created = time.monotonic()
+
+
+class NegativeCache:
+    """Bounded LRU + TTL cache of failed logins, so repeated bad attempts skip the KDF.
+
+    Remembers names without an account and, per name, keyed digests of wrong passwords (never
+    the passwords) bound to the stored hash they failed against. The caller always looks the
+    name up first: a name found in the database is not unknown anymore, and a password
+    change, made by any process, gives a new hash that none of the digests match.
+    """
+    def __init__(self, max_names=100000, passwords_per_name=16, ttl=600):
+        self.max_names = max_names
+        self.passwords_per_name = passwords_per_name
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.key = secrets.token_bytes(32)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, stored, password):
+        return hmac.new(self.key, '{}\0{}'.format(stored, password).encode(), hashlib.sha256).digest()
+
+    def lookup(self, name):
+        """The live entry of name, or None. Call with the lock held."""
+        entry = self.entries.get(name)
+        if entry is not None and time.monotonic() - entry.created > self.ttl:
+            del self.entries[name]
+            entry = None
+        return entry
+
+    def hit(self, name, found):
+        """Count a lookup and refresh the LRU position of a hit. Call with the lock held."""
+        if found:
+            self.entries.move_to_end(name)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+    def unknown(self, name):
+        """True if name had no account when last looked up; only ask when it still has none."""
+        with self.lock:
+            entry = self.lookup(name)
+            return self.hit(name, entry is not None and entry.unknown)
+
+    def rejects(self, name, password, stored):
+        """True if password is known not to match stored, the current hash of name."""
+        with self.lock:
+            entry = self.lookup(name)
+            return self.hit(name, entry is not None and self.digest(stored, password) in entry.passwords)
+
+    def add(self, name, password=None, stored=None):
+        """Record a failed attempt against stored; without a password, the name has no account."""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                entry = self.entries[name] = FailedLogins()
+            self.entries.move_to_end(name)
+            if password is None:
+                entry.unknown = True
+            elif len(entry.passwords) < self.passwords_per_name:
+                entry.unknown = False
+                entry.passwords.add(self.digest(stored, password))
+            while len(self.entries) > self.max_names:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+
+    def stats(self):
+        with self.lock:
+            return {'names': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+####################################################################################################
@@ -0,0 +1,369 @@
+###### packages and dependencies ######
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import tracing
+from schema import ensure_schema
+
+####################################################################################################
+###### Settings ######
+# Database used when no path is given; PAIRFECT_DB overrides it, configure() changes it at runtime
+DB_PATH = os.environ.get('PAIRFECT_DB', 'users.db')
+
+POOL_SIZE = 8
+
+# Applied to every new connection. WAL lets readers run next to the writer, and with
+# synchronous=NORMAL a commit only waits for the WAL append, not for a checkpoint.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -64 * 1024),      # in KiB when negative
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),          # in ms
+)
+
+# Rows per page when iterating over users; memory use is bounded by one page
+PAGE_SIZE = 1000
+
+# Compiled statements kept per connection; pooled connections live long, so each
+# query below is prepared once per connection and reused afterwards
+CACHED_STATEMENTS = 256
+####################################################################################################
+
+
+####################################################################################################
+###### Connection Pool ######
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections to one database file.
+
+    Connections run in autocommit mode; transactions are opened explicitly with
+    transaction(). A connection is only used by one thread at a time.
+    """
+    def __init__(self, db_path, size=POOL_SIZE, pragmas=None):
+        self.db_path = db_path
+        self.size = size
+        self.pragmas = PRAGMAS if pragmas is None else pragmas
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+        ensure_schema(db_path)
+
+    def new_connection(self):
+        tracing.count('db.connections_opened')
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS)
+        for name, value in self.pragmas:
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        return conn
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self.new_connection()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+        # Every connection is busy
+        with tracing.span('db.pool_wait'):
+            return self.idle.get()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        self.idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self, immediate=True):
+        """Run the block in one transaction, committed on success and rolled back on error.
+
+        immediate takes the write lock up front, so reads made in the block cannot be
+        invalidated by another writer before the commit.
+        """
+        with self.connection() as conn, tracing.span('db.transaction'):
+            conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.created -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def configure(db_path):
+    """Use db_path as the default database."""
+    global DB_PATH
+    DB_PATH = db_path
+
+def get_pool(db_path=None):
+    db_path = db_path or DB_PATH
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+    return pool
+
+def connection(db_path=None):
+    return get_pool(db_path).connection()
+
+def transaction(db_path=None, immediate=True):
+    return get_pool(db_path).transaction(immediate)
+
+def close_all():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+####################################################################################################
+
+
+####################################################################################################
+###### Users ######
+# Profile columns of the users table, in the order expected by User.db_to_object
+USER_COLUMNS = 'user_id, name, password, MBTI, age, gender, location, interests'
+
+@tracing.traced('db.insert_user')
+def insert_user(conn, row, user_id=None):
+    """Insert (name, password, MBTI, age, gender, location, interests) and return the user_id.
+
+    The id is auto-generated unless given (shards.py allocates ids for all shard files).
+    """
+    cursor = conn.execute('''
+        INSERT INTO users (user_id, name, password, MBTI, age, gender, location, interests)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, *row))
+    return cursor.lastrowid
+
+@tracing.traced('db.update_user')
+def update_user(conn, user_id, row):
+    conn.execute('''
+        UPDATE users
+        SET name = ?, password = ?, MBTI = ?, age = ?, gender = ?, location = ?, interests = ?
+        WHERE user_id = ?
+    ''', (*row, user_id))
+
+@tracing.traced('db.delete_user')
+def delete_user(conn, user_id):
+    """Delete the user and every swipe and match referencing them.
+
+    Only the rows that reference the user are touched, found through the primary keys and
+    the swipes_by_dst index, so the cost depends on the user's degree, not on the table size.
+    """
+    conn.execute('DELETE FROM swipes WHERE src = ?', (user_id,))
+    conn.execute('DELETE FROM swipes WHERE dst = ?', (user_id,))
+
+    # Matches are symmetric: the other side of each match is found from the user's own rows
+    conn.execute('''
+        DELETE FROM matches
+        WHERE user_id IN (SELECT other_id FROM matches WHERE user_id = ?) AND other_id = ?
+    ''', (user_id, user_id))
+    conn.execute('DELETE FROM matches WHERE user_id = ?', (user_id,))
+
+    conn.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+
+@tracing.traced('db.fetch_user')
+def fetch_user(conn, user_id):
+    return conn.execute('SELECT ' + USER_COLUMNS + ' FROM users WHERE user_id = ?', (user_id,)).fetchone()
+
+@tracing.traced('db.user_exists')
+def user_exists(conn, user_id):
+    return conn.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,)).fetchone() is not None
+
+@tracing.traced('db.fetch_user_by_name')
+def fetch_user_by_name(conn, name):
+    return conn.execute('SELECT ' + USER_COLUMNS + ' FROM users WHERE name = ?', (name,)).fetchone()
+
+@tracing.traced('db.fetch_credentials')
+def fetch_credentials(conn, name):
+    """Return (user_id, password hash) of name, or None. A seek on the UNIQUE index of name."""
+    return conn.execute('SELECT user_id, password FROM users WHERE name = ?', (name,)).fetchone()
+
+@tracing.traced('db.update_password')
+def update_password(conn, user_id, password):
+    conn.execute('UPDATE users SET password = ? WHERE user_id = ?', (password, user_id))
+
+@tracing.traced('db.fetch_users')
+def fetch_users(conn, user_ids):
+    """Return (column names, rows) of every column of the users among user_ids, in no set order."""
+    cursor = conn.execute('SELECT * FROM users WHERE user_id IN ({})'.format(', '.join('?' * len(user_ids))),
+                          user_ids)
+    return [column for column, *_ in cursor.description], cursor.fetchall()
+
+# Every user except user_id and the users they swiped on
+VALID_USERS_QUERY = '''
+    SELECT * FROM users u
+    WHERE u.user_id != ?
+    AND NOT EXISTS (SELECT 1 FROM swipes s WHERE s.src = ? AND s.dst = u.user_id)
+'''
+
+@tracing.traced('db.fetch_all_users')
+def fetch_all_users(conn):
+    return conn.execute('SELECT ' + USER_COLUMNS + ' FROM users').fetchall()
+
+@tracing.traced('db.fetch_users_page')
+def fetch_users_page(conn, after_id=0, limit=PAGE_SIZE):
+    """Up to limit users with user_id > after_id, in user_id order.
+
+    Keyset pagination: each page is a primary-key range scan starting at after_id, so
+    the cost of a page does not grow with the number of pages before it.
+    """
+    return conn.execute('SELECT ' + USER_COLUMNS + ' FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?',
+                        (after_id, limit)).fetchall()
+####################################################################################################
+
+
+####################################################################################################
+###### Swipes and matches ######
+@tracing.traced('db.fetch_relationships')
+def fetch_relationships(conn, user_id):
+    """Return the sets of users liked, disliked and matched by user_id."""
+    liked_users, disliked_users = set(), set()
+    for other_id, kind in conn.execute('SELECT dst, kind FROM swipes WHERE src = ?', (user_id,)):
+        if kind == 'like':
+            liked_users.add(other_id)
+        else:
+            disliked_users.add(other_id)
+    matches = {other_id for (other_id,) in
+               conn.execute('SELECT other_id FROM matches WHERE user_id = ?', (user_id,))}
+    return liked_users, disliked_users, matches
+
+# Profiles of the users in one of user_id's lists, joined on the relationship tables'
+# primary keys and paginated by the other user's id like fetch_users_page
+_PROFILE_COLUMNS = ', '.join('u.' + column for column in USER_COLUMNS.split(', '))
+RELATED_USERS_QUERIES = {
+    'likes': '''
+        SELECT ''' + _PROFILE_COLUMNS + ''' FROM swipes s JOIN users u ON u.user_id = s.dst
+        WHERE s.src = ? AND s.kind = 'like' AND s.dst > ? ORDER BY s.dst LIMIT ?
+    ''',
+    'dislikes': '''
+        SELECT ''' + _PROFILE_COLUMNS + ''' FROM swipes s JOIN users u ON u.user_id = s.dst
+        WHERE s.src = ? AND s.kind = 'dislike' AND s.dst > ? ORDER BY s.dst LIMIT ?
+    ''',
+    'matches': '''
+        SELECT ''' + _PROFILE_COLUMNS + ''' FROM matches m JOIN users u ON u.user_id = m.other_id
+        WHERE m.user_id = ? AND m.other_id > ? ORDER BY m.other_id LIMIT ?
+    ''',
+}
+
+@tracing.traced('db.fetch_related_users_page')
+def fetch_related_users_page(conn, user_id, relation, after_id=0, limit=PAGE_SIZE):
+    """Up to limit profiles of the users liked, disliked or matched by user_id (relation is
+    'likes', 'dislikes' or 'matches') with user_id > after_id, in user_id order."""
+    return conn.execute(RELATED_USERS_QUERIES[relation], (user_id, after_id, limit)).fetchall()
+
+@tracing.traced('db.record_swipe')
+def record_swipe(conn, src_id, dst_id, kind, ts):
+    """Store one like/dislike of src about dst. Returns True if the like created a new match.
+
+    Must run inside a transaction so the reverse-like lookup and the match insert see the
+    same state as the swipe insert. The lookup is a point query on the primary key of swipes,
+    so its cost does not depend on how many likes either user gave or received. A new match
+    also appends an event to match_events (trigger), in the same transaction.
+    """
+    conn.execute('INSERT OR REPLACE INTO swipes (src, dst, kind, ts) VALUES (?, ?, ?, ?)',
+                 (src_id, dst_id, kind, ts))
+    if kind != 'like':
+        return False
+
+    # Primary-key lookup of the reverse like
+    if conn.execute("SELECT 1 FROM swipes WHERE src = ? AND dst = ? AND kind = 'like'",
+                    (dst_id, src_id)).fetchone() is None:
+        return False
+    # A like repeated after the match inserts nothing
+    cursor = conn.executemany('INSERT OR IGNORE INTO matches (user_id, other_id, ts) VALUES (?, ?, ?)',
+                              [(src_id, dst_id, ts), (dst_id, src_id, ts)])
+    return cursor.rowcount > 0
+
+@tracing.traced('db.record_swipe_across')
+def record_swipe_across(src_conn, dst_conn, src_id, dst_id, kind, ts):
+    """record_swipe for users stored in two database files (see shards.py).
+
+    The swipe is stored with src; a match is stored on each side, in both transactions.
+    Both must be open with the write lock, so the reverse-like lookup in dst cannot miss
+    a like being recorded concurrently from the other side.
+    """
+    src_conn.execute('INSERT OR REPLACE INTO swipes (src, dst, kind, ts) VALUES (?, ?, ?, ?)',
+                     (src_id, dst_id, kind, ts))
+    if kind != 'like':
+        return False
+    if dst_conn.execute("SELECT 1 FROM swipes WHERE src = ? AND dst = ? AND kind = 'like'",
+                        (dst_id, src_id)).fetchone() is None:
+        return False
+    inserted = src_conn.execute('INSERT OR IGNORE INTO matches (user_id, other_id, ts) VALUES (?, ?, ?)',
+                                (src_id, dst_id, ts)).rowcount
+    inserted += dst_conn.execute('INSERT OR IGNORE INTO matches (user_id, other_id, ts) VALUES (?, ?, ?)',
+                                 (dst_id, src_id, ts)).rowcount
+    return inserted > 0
+
+@tracing.traced('db.delete_references')
+def delete_references(conn, user_id, other_ids):
+    """Delete the swipes about user_id and the matches of other_ids with user_id, where the
+    user themselves is stored in another database file (see shards.py)."""
+    conn.execute('DELETE FROM swipes WHERE dst = ?', (user_id,))
+    conn.executemany('DELETE FROM matches WHERE user_id = ? AND other_id = ?',
+                     [(other_id, user_id) for other_id in other_ids])
+
+@tracing.traced('db.fetch_match_events')
+def fetch_match_events(conn, after_seq=0, limit=PAGE_SIZE):
+    """Up to limit (seq, user_id, other_id, ts) match events with seq > after_seq, oldest first."""
+    return conn.execute('SELECT seq, user_id, other_id, ts FROM match_events WHERE seq > ? ORDER BY seq LIMIT ?',
+                        (after_seq, limit)).fetchall()
+
+@tracing.traced('db.last_match_event')
+def last_match_event(conn):
+    """seq of the latest match event, 0 if there is none; a consumer starting at it only sees new matches."""
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM match_events').fetchone()[0]
+####################################################################################################
+
+
+####################################################################################################
+###### Swipe logs ######
+@tracing.traced('db.fetch_log_position')
+def fetch_log_position(conn, log):
+    """seq of the last record of the swipe log applied to this database, 0 if none was."""
+    row = conn.execute('SELECT applied_seq FROM swipe_log_state WHERE log = ?', (log,)).fetchone()
+    return row[0] if row else 0
+
+@tracing.traced('db.store_log_position')
+def store_log_position(conn, log, seq):
+    conn.execute('''
+        INSERT INTO swipe_log_state (log, applied_seq) VALUES (?, ?)
+        ON CONFLICT (log) DO UPDATE SET applied_seq = excluded.applied_seq
+    ''', (log, seq))
+####################################################################################################
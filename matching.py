@@ -0,0 +1,89 @@
+"""Recommendations: candidate scoring over the shared candidate store, and the rows read back.
+
+Imports NumPy and pandas, so app.py only loads it on the first matching call (see app.matching).
+"""
+###### packages and dependencies ######
+import threading
+
+import pandas as pd
+
+import db
+import snapshot
+import tracing
+from cache import RecommendationCache
+
+####################################################################################################
+###### Matching Algorithm ######
+# Load all users except for the current user and the ones he/she (dis)liked
+@tracing.traced('fetch_valid_users')
+def fetch_valid_users(user):
+    # Swipes already in the database are excluded by an anti-join on the swipes primary key,
+    # so the query has two parameters however many users were swiped
+    with db.connection() as conn:
+        df = pd.read_sql_query(db.VALID_USERS_QUERY, conn, params=(user.user_id, user.user_id))
+
+    # Decisions not written yet (e.g. buffered by a SwipeSession) are only in the user's sets
+    df = df[~df['user_id'].isin(user.liked_users) & ~df['user_id'].isin(user.disliked_users)]
+
+    # Convert each comma-separated string in the 'interests' column to a list of interests
+    df['interests_list'] = df['interests'].apply(
+    lambda x: x.split(',') if x else [])
+    return df
+
+# Shared candidate store, built once per process (mapped from the snapshot at PAIRFECT_SNAPSHOT
+# when there is one) and caught up with the user_changes log (filled by triggers on users)
+# before every use. Hold _candidate_store_lock while using it,
+# a refresh must not run while another thread is scoring.
+_candidate_store = None
+_candidate_store_lock = threading.RLock()
+
+def get_candidate_store():
+    global _candidate_store
+    if _candidate_store is None:
+        _candidate_store = snapshot.load_store(db_path=db.DB_PATH)
+    else:
+        recommendation_cache.apply_changes(_candidate_store, _candidate_store.refresh())
+    return _candidate_store
+
+# Ranked lists of the top 100 candidates per (user, gender preference), served 5 at a time
+recommendation_cache = RecommendationCache()
+
+# Load full rows for the given user ids, in the order of user_ids, with their scores as columns.
+# A plain fetch and one DataFrame constructor: pandas.read_sql and per-column assignment
+# cost more than the rest of a cached recommendation call.
+def fetch_users_frame(user_ids, scores=None):
+    user_ids = [int(user_id) for user_id in user_ids]
+    with db.connection() as conn:
+        columns, rows = db.fetch_users(conn, user_ids)
+
+    # A user deleted since user_ids were found is dropped together with their scores
+    by_id = {row[0]: row for row in rows}
+    found = [i for i, user_id in enumerate(user_ids) if user_id in by_id]
+    values = list(zip(*[by_id[user_ids[i]] for i in found])) or [()] * len(columns)
+    data = dict(zip(columns, values))
+    data['interests_list'] = [interests.split(',') if interests else [] for interests in data['interests']]
+    for column, scored in (scores or {}).items():
+        data[column] = scored[found]
+    return pd.DataFrame(data)
+
+#Compute Compatibility Scores and return top 5
+def compute_compatibility_scores(current_user, gender_preference):
+    # Scorers and weights come from the user's experiment in scoring.py (gender 0.4, MBTI 0.15,
+    # age difference 0.1, location 0.2, shared interests 0.15 by default).
+    # All candidates are scored with NumPy over the candidate store, only the top 5 rows are read back.
+    # Repeated calls are served from recommendation_cache until something relevant changes.
+    with tracing.request('compute_compatibility_scores'):
+        with _candidate_store_lock:
+            with tracing.span('scores.refresh_store'):
+                store = get_candidate_store()
+            with tracing.span('scores.rank'):
+                user_ids, scores = recommendation_cache.page(store, current_user, gender_preference)
+        if len(user_ids) == 0:
+            print("Sorry! Currently we do not have more potential matches for you.")
+            return pd.DataFrame(columns=['user_id', 'name', 'password', 'MBTI', 'age', 'gender', 'location',
+                                         'interests', 'liked_users', 'disliked_users', 'matches',
+                                         'interests_list', *scores])
+
+        with tracing.span('scores.fetch_rows'):
+            return fetch_users_frame(user_ids, scores)
+####################################################################################################
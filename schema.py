@@ -0,0 +1,231 @@
+###### packages and dependencies ######
+import sqlite3
+import time
+
+####################################################################################################
+###### Schema ######
+USERS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, name TEXT UNIQUE NOT NULL, password TEXT, MBTI TEXT CHECK (length(MBTI) <= 4), age INTEGER CHECK (age BETWEEN 1 AND 150), gender TEXT CHECK (gender IN ("Female", "Male")), location TEXT CHECK (location IN ("Toronto", "Ottawa", "Mississauga", "Brampton", "Hamilton", "London", "Markham", "Vaughan", "Kitchener", "Windsor", "Richmond Hill", "Burlington", "Oshawa", "Greater Sudbury", "Barrie", "Guelph", "Cambridge", "St. Catharines", "Waterloo", "Thunder Bay", "Brantford", "Pickering", "Niagara Falls", "Peterborough", "Sault Ste. Marie", "Sarnia", "Norfolk County", "Welland", "Belleville", "North Bay")), interests TEXT, liked_users TEXT, disliked_users TEXT, matches TEXT)
+'''
+
+# Every insert, delete or profile update of a user appends the user_id to user_changes.
+# seq is a watermark: a reader that has applied everything up to seq only needs the
+# rows with a larger seq to catch up, no matter which process made the change.
+USER_CHANGES = [
+    '''
+    CREATE TABLE IF NOT EXISTS user_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS users_after_insert AFTER INSERT ON users
+    BEGIN
+        INSERT INTO user_changes (user_id) VALUES (NEW.user_id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS users_after_update
+    AFTER UPDATE OF user_id, MBTI, age, gender, location, interests ON users
+    BEGIN
+        INSERT INTO user_changes (user_id) VALUES (OLD.user_id);
+        INSERT INTO user_changes (user_id) SELECT NEW.user_id WHERE NEW.user_id != OLD.user_id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS users_after_delete AFTER DELETE ON users
+    BEGIN
+        INSERT INTO user_changes (user_id) VALUES (OLD.user_id);
+    END
+    ''',
+]
+
+# Last change applied by each reader of user_changes (a candidate store), and when it said so.
+# Records every reader seen recently has applied are trimmed (see trim_changes).
+CHANGE_READERS = [
+    '''
+    CREATE TABLE IF NOT EXISTS change_readers (
+        reader TEXT PRIMARY KEY,
+        watermark INTEGER NOT NULL,
+        seen REAL NOT NULL
+    ) WITHOUT ROWID
+    ''',
+]
+
+# One row per decision of src about dst, so recording a swipe is a single primary-key insert.
+# swipes_by_dst is the reverse index of who swiped on a user.
+# A match is stored once from each side so a user's matches are a primary-key range scan
+# in both directions and need no extra index.
+RELATIONSHIP_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS swipes (
+        src INTEGER NOT NULL,
+        dst INTEGER NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('like', 'dislike')),
+        ts REAL NOT NULL,
+        PRIMARY KEY (src, dst)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS swipes_by_dst ON swipes (dst, src)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS matches (
+        user_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        ts REAL NOT NULL,
+        PRIMARY KEY (user_id, other_id)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Every new match appends one row to match_events, from the side with the smaller user_id.
+# As in user_changes, seq is a watermark: a consumer that has handled everything up to seq
+# reads the rows with a larger seq to get the matches made since, from any process.
+MATCH_EVENTS = [
+    '''
+    CREATE TABLE IF NOT EXISTS match_events (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        ts REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS matches_after_insert AFTER INSERT ON matches
+    WHEN NEW.user_id < NEW.other_id
+    BEGIN
+        INSERT INTO match_events (user_id, other_id, ts) VALUES (NEW.user_id, NEW.other_id, NEW.ts);
+    END
+    ''',
+]
+
+# Last record of each write-behind swipe log (swipelog.py) applied to this database. It is
+# updated in the transaction that applies the records, so replaying a log skips exactly them.
+SWIPE_LOG_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS swipe_log_state (
+        log TEXT PRIMARY KEY,
+        applied_seq INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Top-k candidates per user and gender preference, written by the nightly batch (batch.py)
+BATCH_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS recommendations (
+        user_id INTEGER NOT NULL,
+        gender_preference TEXT NOT NULL,
+        rank INTEGER NOT NULL,
+        candidate_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY (user_id, gender_preference, rank)
+    ) WITHOUT ROWID
+    ''',
+]
+
+
+# Stored in PRAGMA user_version once the rows of a database are migrated, so the migrations,
+# which scan the users table, only run once per file instead of on every connection pool
+SCHEMA_VERSION = 1
+
+def ensure_schema(db_path='users.db'):
+    """Create any missing table, index or trigger and migrate old rows. Safe to call repeatedly."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(USERS_TABLE)
+        for statement in USER_CHANGES + CHANGE_READERS + RELATIONSHIP_TABLES + MATCH_EVENTS + SWIPE_LOG_TABLES + BATCH_TABLES:
+            conn.execute(statement)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            migrate_relationship_columns(conn)
+        if version < SCHEMA_VERSION:
+            conn.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def parse_id_list(text):
+    return list(map(int, text.split(','))) if text else []
+
+
+def migrate_relationship_columns(conn):
+    """Move the comma-separated liked_users/disliked_users/matches columns into swipes and matches.
+
+    Migrated rows get ts = 0 since the original swipe time is unknown. The old columns are
+    set to NULL afterwards, so rows are only migrated once.
+    """
+    rows = conn.execute('''
+        SELECT user_id, liked_users, disliked_users, matches FROM users
+        WHERE liked_users != '' OR disliked_users != '' OR matches != ''
+    ''').fetchall()
+    for user_id, liked_users, disliked_users, matches in rows:
+        conn.executemany("INSERT OR IGNORE INTO swipes (src, dst, kind, ts) VALUES (?, ?, 'like', 0)",
+                         [(user_id, other_id) for other_id in parse_id_list(liked_users)])
+        conn.executemany("INSERT OR IGNORE INTO swipes (src, dst, kind, ts) VALUES (?, ?, 'dislike', 0)",
+                         [(user_id, other_id) for other_id in parse_id_list(disliked_users)])
+        conn.executemany('INSERT OR IGNORE INTO matches (user_id, other_id, ts) VALUES (?, ?, 0)',
+                         [pair for other_id in parse_id_list(matches)
+                          for pair in ((user_id, other_id), (other_id, user_id))])
+        conn.execute('''
+            UPDATE users SET liked_users = NULL, disliked_users = NULL, matches = NULL WHERE user_id = ?
+        ''', (user_id,))
+####################################################################################################
+
+
+####################################################################################################
+###### Change log ######
+def current_watermark(cursor):
+    """Return the seq of the latest recorded change, 0 if there is none."""
+    cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM user_changes')
+    return cursor.fetchone()[0]
+
+
+def fetch_changes(cursor, watermark):
+    """Return (new_watermark, rows) for users changed after watermark.
+
+    Each row is (user_id, MBTI, age, gender, location, interests, deleted); the profile
+    columns are NULL and deleted is 1 when the user no longer exists.
+    """
+    cursor.execute('''
+        SELECT c.user_id, u.MBTI, u.age, u.gender, u.location, u.interests, u.user_id IS NULL, MAX(c.seq)
+        FROM user_changes c LEFT JOIN users u ON u.user_id = c.user_id
+        WHERE c.seq > ?
+        GROUP BY c.user_id
+    ''', (watermark,))
+    rows = cursor.fetchall()
+    if rows:
+        watermark = max(row[-1] for row in rows)
+    return watermark, [row[:-1] for row in rows]
+
+
+def changes_trimmed(cursor, watermark):
+    """True if records after watermark were trimmed, so the changes since cannot be read."""
+    cursor.execute('SELECT MIN(seq) FROM user_changes')
+    oldest = cursor.fetchone()[0]
+    return oldest is not None and oldest > watermark + 1
+
+
+# Readers that have not reported their watermark for this long are not waited for anymore.
+# If one comes back, changes_trimmed tells it to reload instead of catching up.
+READER_TIMEOUT = 3600
+
+def trim_changes(conn, reader, watermark, reader_timeout=READER_TIMEOUT):
+    """Record the watermark of reader, then drop the records every current reader has applied.
+
+    The latest record is kept, so current_watermark and the seqs of new records carry on.
+    """
+    now = time.time()
+    conn.execute('''
+        INSERT INTO change_readers (reader, watermark, seen) VALUES (?, ?, ?)
+        ON CONFLICT (reader) DO UPDATE SET watermark = excluded.watermark, seen = excluded.seen
+    ''', (reader, watermark, now))
+    conn.execute('DELETE FROM change_readers WHERE seen < ?', (now - reader_timeout,))
+    conn.execute('''
+        DELETE FROM user_changes
+        WHERE seq <= (SELECT MIN(watermark) FROM change_readers)
+          AND seq < (SELECT MAX(seq) FROM user_changes)
+    ''')
+####################################################################################################
@@ -0,0 +1,287 @@
+"""Compatibility scoring: a registry of vectorized scorers combined by per-experiment weights.
+
+Each scorer maps a columnar batch of candidates and an encoded query to one float per
+candidate. A Pipeline sums weight * score over its scorers, in order, into a single array.
+Weights come from the experiments config: PAIRFECT_SCORING names a JSON file of the form
+
+    {"experiments": {"default": {"weights": {"gender": 0.4, "MBTI": 0.15, ...}},
+                     "more_interests": {"share": 0.1, "weights": {...}}}}
+
+Every user is assigned to one experiment from a hash of their user_id; the experiments
+with a share take that fraction of users and "default" takes the rest.
+"""
+###### packages and dependencies ######
+import json
+import os
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+import tracing
+
+####################################################################################################
+###### Kernels ######
+def _popcount_table():
+    table = np.zeros(256, dtype=np.uint8)
+    for i in range(256):
+        table[i] = bin(i).count("1")
+    return table
+
+_POPCOUNT_TABLE = _popcount_table()
+
+
+def popcount(values):
+    """Count set bits of every element of an unsigned integer array."""
+    values = np.asarray(values)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    as_bytes = values.reshape(-1, 1).view(np.uint8)
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=1, dtype=np.uint8).reshape(values.shape)
+
+
+def _mbti_table():
+    # Opposite E/I scores 2; for the rest, same personality scores 1 point
+    differences = np.arange(16, dtype=np.uint8)[:, None] ^ np.arange(16, dtype=np.uint8)[None, :]
+    return (2.0 * (differences >> 3) + 3.0 - popcount(differences & np.uint8(0b0111))) / 5.0
+
+# MBTI score of every pair of 4-bit type codes (see candidates.encode_mbti)
+MBTI_TABLE = _mbti_table()
+
+# Bits of an interests mask; intersection and union counts are at most this
+MASK_BITS = 64
+
+# Rows of the table are 2 ** UNION_BITS wide so (intersection << UNION_BITS) | union indexes it
+UNION_BITS = 7
+
+def _jaccard_table():
+    intersection = np.arange(MASK_BITS + 1, dtype=float)[:, None]
+    union = np.arange(2 ** UNION_BITS, dtype=float)[None, :]
+    union, intersection = np.broadcast_arrays(union, intersection)
+    return np.divide(intersection, union, out=np.zeros_like(union), where=union > 0)
+
+# Jaccard similarity indexed by (intersection size, union size); 0 for an empty union
+JACCARD_TABLE = _jaccard_table()
+_JACCARD_FLAT = JACCARD_TABLE.ravel()
+
+def jaccard(masks, mask):
+    """Jaccard similarity of interest bitmasks, looked up from the two bit counts.
+
+    The index fits in uint16, which keeps the gather cheaper than converting both counts
+    to float and dividing.
+    """
+    index = (popcount(masks & mask).astype(np.uint16) << UNION_BITS) | popcount(masks | mask)
+    return _JACCARD_FLAT[index]
+####################################################################################################
+
+
+####################################################################################################
+###### Scorers ######
+# Encoded fields of the user a batch is scored for. gender is None for "Both"; the other fields
+# are scalars, or (users, 1) arrays to score several users against a (1, candidates) batch.
+# words are the interests of the store's vocabulary, indexed by their bit in the masks.
+Query = namedtuple('Query', ['gender', 'location', 'age', 'mbti', 'mask', 'pipeline', 'words'])
+
+# Best value of a scorer for a partition of candidates; scores are in [0, 1]
+MAX_SCORE = lambda query, partition: 1.0
+
+class Scorer:
+    def __init__(self, name, function, bound=MAX_SCORE):
+        self.name = name
+        self.column = name + '_score'
+        self.function = function
+        self.bound = bound
+
+
+SCORERS = {}
+
+def register(name, bound=MAX_SCORE):
+    """Decorator adding function(batch, query) -> scores to the registry under name.
+
+    batch maps the CandidateStore column names to arrays. bound(query, partition) must be at
+    least the score of any candidate of a partition, so partitions can be skipped. partition
+    maps 'gender', 'location' and 'mbti' to the codes shared by its candidates, and may give
+    their age range as 'age_min' and 'age_max'; values are scalars, or arrays to bound many
+    partitions at once.
+    """
+    def decorate(function):
+        SCORERS[name] = Scorer(name, function, bound)
+        return function
+    return decorate
+
+
+@register('gender', bound=lambda query, partition:
+          1.0 if query.gender is None else np.equal(partition['gender'], query.gender).astype(float))
+def gender_score(batch, query):
+    if query.gender is None:
+        return np.ones(np.shape(batch['gender']))
+    return (batch['gender'] == query.gender).astype(float)
+
+@register('MBTI', bound=lambda query, partition: MBTI_TABLE[partition['mbti'], query.mbti])
+def MBTI_score(batch, query):
+    return MBTI_TABLE[np.asarray(query.mbti, dtype=np.intp), batch['mbti']]
+
+def age_diff_bound(query, partition):
+    if 'age_min' not in partition:
+        return 1.0
+    gap = np.maximum(0, np.maximum(np.asarray(partition['age_min'], dtype=np.int64) - query.age,
+                                   query.age - np.asarray(partition['age_max'], dtype=np.int64)))
+    return 1 / (1 + gap)
+
+@register('age_diff', bound=age_diff_bound)
+def age_diff_score(batch, query):
+    return 1 / (1 + np.abs(batch['age'].astype(np.int64) - query.age))
+
+@register('location', bound=lambda query, partition: np.equal(partition['location'], query.location).astype(float))
+def location_score(batch, query):
+    return (batch['location'] == query.location).astype(float)
+
+def bits(mask):
+    mask = int(mask)
+    return [bit for bit in range(MASK_BITS) if mask >> bit & 1]
+
+def characters_jaccard(user_mask, mask, words):
+    """Jaccard similarity of the user's interests with the characters of a candidate's interests.
+
+    This is what the original pandas callback computed: it was applied to the comma-separated
+    string of each candidate, so it compared interests with single characters.
+    """
+    interests = {words[bit] for bit in bits(user_mask)}
+    characters = set(','.join(words[bit] for bit in bits(mask)))
+    union = len(interests | characters)
+    return len(interests & characters) / union if union > 0 else 0
+
+@register('interests')
+def interests_score(batch, query):
+    """Scores of the original callback (see characters_jaccard), kept for identical results.
+
+    Only an interest of one character can be among the characters of a candidate, so the
+    score is 0 for users without one, which is every user entering interests from vocab.
+    The others are scored once per distinct pair of masks. The candidate's string is rebuilt
+    from its mask, so a list repeating one interest would miss its comma.
+    """
+    user_masks = np.asarray(query.mask, dtype=np.uint64)
+    scores = np.zeros(np.broadcast_shapes(np.shape(batch['interest_mask']), user_masks.shape))
+    single = np.uint64(sum(1 << bit for bit, word in enumerate(query.words) if len(word) == 1))
+    if not (user_masks & single).any():
+        return scores
+    masks, user_masks = np.broadcast_arrays(batch['interest_mask'], user_masks)
+    masks, user_masks = masks.ravel(), user_masks.ravel()
+    hits = np.flatnonzero(user_masks & single)
+    pairs, inverse = np.unique(np.stack([user_masks[hits], masks[hits]], axis=1), axis=0, return_inverse=True)
+    values = np.array([characters_jaccard(user_mask, mask, query.words) for user_mask, mask in pairs])
+    scores.reshape(-1)[hits] = values[inverse.reshape(-1)]
+    return scores
+####################################################################################################
+
+
+####################################################################################################
+###### Pipelines ######
+# Scores: gender 0.4, MBTI 0.15, age difference 0.1, location 0.2, shared interests 0.15
+DEFAULT_WEIGHTS = (('gender', 0.4), ('MBTI', 0.15), ('age_diff', 0.1), ('location', 0.2), ('interests', 0.15))
+
+class Pipeline:
+    """Weighted sum of registered scorers, accumulated in the order of weights."""
+    def __init__(self, name, weights, share=0.0):
+        for scorer, weight in weights:
+            if scorer not in SCORERS:
+                raise ValueError('Unknown scorer {!r} in experiment {!r}'.format(scorer, name))
+            if weight < 0:
+                raise ValueError('Negative weight for {!r} in experiment {!r}'.format(scorer, name))
+        self.name = name
+        self.weights = tuple(weights)
+        self.share = share
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.rows = 0
+        self.seconds = {scorer: 0.0 for scorer, _ in self.weights}
+
+    def score(self, batch, query, parts=True):
+        """Return {scorer column: scores} and 'compatibility_score', or only the latter.
+
+        Calls, rows and the time of each scorer are only counted while tracing is enabled.
+        """
+        timed = tracing.enabled
+        scores = {}
+        seconds = []
+        total = None
+        for name, weight in self.weights:
+            start = time.perf_counter() if timed else 0.0
+            values = SCORERS[name].function(batch, query)
+            term = weight * values
+            if total is None:
+                total = term
+            elif total.shape == term.shape:
+                total += term
+            else:
+                total = total + term
+            if timed:
+                seconds.append(time.perf_counter() - start)
+            if parts:
+                scores[SCORERS[name].column] = values
+        scores['compatibility_score'] = total
+        if not timed:
+            return scores
+        with self.lock:
+            self.calls += 1
+            self.rows += total.size
+            for (name, _), elapsed in zip(self.weights, seconds):
+                self.seconds[name] += elapsed
+        return scores
+
+    def bound(self, query, partition):
+        """Best score reachable in a partition (see register), summed like score()."""
+        total = None
+        for name, weight in self.weights:
+            term = weight * SCORERS[name].bound(query, partition)
+            total = term if total is None else total + term
+        return total
+
+    def stats(self):
+        with self.lock:
+            return {'calls': self.calls, 'rows': self.rows,
+                    'seconds': {name: round(elapsed, 6) for name, elapsed in self.seconds.items()}}
+
+
+pipelines = {'default': Pipeline('default', DEFAULT_WEIGHTS)}
+
+def configure(config):
+    """Replace the experiments by those of config, a dict or the path of a JSON file."""
+    global pipelines
+    if isinstance(config, str):
+        with open(config) as f:
+            config = json.load(f)
+    configured = {}
+    for name, experiment in config.get('experiments', {}).items():
+        weights = experiment['weights']
+        configured[name] = Pipeline(name, list(weights.items()), experiment.get('share', 0.0))
+    configured.setdefault('default', Pipeline('default', DEFAULT_WEIGHTS))
+    if sum(pipeline.share for pipeline in configured.values()) > 1:
+        raise ValueError('Experiment shares add up to more than 1')
+    pipelines = configured
+
+def config():
+    """The current experiments, in the format accepted by configure()."""
+    return {'experiments': {name: {'share': pipeline.share, 'weights': dict(pipeline.weights)}
+                            for name, pipeline in pipelines.items()}}
+
+def pipeline_for(user_id):
+    """The pipeline of the experiment user_id is assigned to."""
+    if len(pipelines) == 1:
+        return pipelines['default']
+    bucket = zlib.crc32(str(user_id).encode()) / 2 ** 32
+    for pipeline in pipelines.values():
+        if pipeline.name != 'default':
+            if bucket < pipeline.share:
+                return pipeline
+            bucket -= pipeline.share
+    return pipelines['default']
+
+def stats():
+    return {name: pipeline.stats() for name, pipeline in pipelines.items()}
+
+if os.environ.get('PAIRFECT_SCORING'):
+    configure(os.environ['PAIRFECT_SCORING'])
+####################################################################################################
@@ -0,0 +1,336 @@
+"""HTTP/JSON front-end for Pairfect, served by asyncio.
+
+    python service.py --port 8080 [--db users.db]
+
+Endpoints (JSON bodies, `Authorization: Bearer <token>` after login):
+    POST /login             {"name": ..., "password": ...}  -> {"token": ..., "user_id": ...}
+    GET  /profile[?user_id=] own profile, or another user's  -> {...}
+    GET  /recommendations?gender=Female|Male|Both            -> {"matches": [...]}
+    POST /swipe             {"user_id": ..., "kind": "like"|"dislike"} -> {"matched": ...}
+                            (null with --swipe-log: the match, if any, is made once the log is applied;
+                            404 if there is no such user)
+    GET  /stats             cache counters, and per-scorer timings of each experiment (PAIRFECT_TRACE=1)
+    GET  /metrics           spans and counters in Prometheus text format (PAIRFECT_TRACE=1)
+    GET  /profiles          cProfile reports of the slowest requests (PAIRFECT_TRACE_PROFILE=N)
+
+SQLite calls run in a thread pool bounded by the connection pool size and scoring runs
+in its own pool, so the event loop only parses requests and writes responses.
+"""
+###### packages and dependencies ######
+import argparse
+import asyncio
+import json
+import secrets
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import app
+import db
+import tracing
+from vocab import VALID_GENDER_PREFERENCES
+
+####################################################################################################
+###### Executors ######
+class BoundedExecutor:
+    """Thread pool that also caps the number of queued calls, so overload turns into backpressure."""
+    def __init__(self, workers, queue_size):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = asyncio.Semaphore(workers + queue_size)
+
+    async def run(self, function, *args):
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.call, function, *args)
+
+    @staticmethod
+    def call(function, *args):
+        # The work done in the worker thread is one traced (and possibly profiled) request
+        with tracing.request(function.__name__):
+            return function(*args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+           405: 'Method Not Allowed', 500: 'Internal Server Error'}
+####################################################################################################
+
+
+####################################################################################################
+###### Sessions ######
+class Sessions:
+    """token -> User of the logged-in users, at most max_sessions of them, each expiring once
+    unused for ttl seconds. Only used from the event loop, so there is no lock.
+    """
+    def __init__(self, max_sessions=10000, ttl=3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, token):
+        entry = self.entries.get(token)
+        if entry is None:
+            return None
+        user, last_used = entry
+        now = time.monotonic()
+        if now - last_used > self.ttl:
+            del self.entries[token]
+            return None
+        self.entries[token] = (user, now)
+        self.entries.move_to_end(token)
+        return user
+
+    def add(self, token, user):
+        now = time.monotonic()
+        self.entries[token] = (user, now)
+        # The least recently used sessions go first: expired ones, then any beyond max_sessions
+        while self.entries:
+            _, (_, last_used) = next(iter(self.entries.items()))
+            if now - last_used <= self.ttl and len(self.entries) <= self.max_sessions:
+                break
+            self.entries.popitem(last=False)
+####################################################################################################
+
+
+####################################################################################################
+###### Service ######
+def profile_to_json(user, private=False):
+    profile = {
+        'user_id': user.user_id,
+        'name': user.name,
+        'MBTI': user.MBTI,
+        'age': user.age,
+        'gender': user.gender,
+        'location': user.location,
+        'interests': user.interests,
+    }
+    if private:
+        profile['likes'] = sorted(user.liked_users)
+        profile['dislikes'] = sorted(user.disliked_users)
+        profile['matches'] = sorted(user.matches)
+    return profile
+
+
+class MatchingService:
+    def __init__(self, db_workers=db.POOL_SIZE, scoring_workers=2, queue_size=64):
+        self.db_executor = BoundedExecutor(db_workers, queue_size)
+        self.scoring_executor = BoundedExecutor(scoring_workers, queue_size)
+        # token -> User; the User keeps the likes/dislikes used to exclude candidates
+        self.sessions = Sessions()
+        self.routes = {
+            ('POST', '/login'): self.login,
+            ('GET', '/profile'): self.profile,
+            ('GET', '/recommendations'): self.recommendations,
+            ('POST', '/swipe'): self.swipe,
+            ('GET', '/stats'): self.stats,
+            ('GET', '/metrics'): self.metrics,
+            ('GET', '/profiles'): self.profiles,
+        }
+
+    def current_user(self, headers):
+        token = headers.get('authorization', '').replace('Bearer ', '', 1)
+        user = self.sessions.get(token)
+        if user is None:
+            raise HTTPError(401, 'login required')
+        return user
+
+    ###### Endpoints ######
+    async def login(self, headers, query, body):
+        try:
+            user = await self.db_executor.run(app.authenticate, body['name'], body['password'])
+        except KeyError:
+            raise HTTPError(400, 'name and password are required')
+        except Exception:
+            user = None
+        if user is None:
+            raise HTTPError(401, 'invalid credentials')
+        # Read on the database pool now, the session's sets are then used on the event loop
+        await self.db_executor.run(user.load_relationships)
+        token = secrets.token_hex(16)
+        self.sessions.add(token, user)
+        return {'token': token, 'user_id': user.user_id}
+
+    async def profile(self, headers, query, body):
+        user = self.current_user(headers)
+        if 'user_id' not in query:
+            return profile_to_json(user, private=True)
+        try:
+            user_id = int(query['user_id'][0])
+        except ValueError:
+            raise HTTPError(400, 'user_id must be an integer')
+        other = await self.db_executor.run(app.fetch_user, user_id)
+        if other is None:
+            raise HTTPError(404, 'no such user')
+        return profile_to_json(other)
+
+    async def recommendations(self, headers, query, body):
+        user = self.current_user(headers)
+        gender_preference = query.get('gender', ['Both'])[0]
+        if gender_preference not in VALID_GENDER_PREFERENCES:
+            raise HTTPError(400, 'gender must be Female, Male or Both')
+        # Swipes change the user's sets on the event loop while scoring runs in its pool
+        potential_matches = await self.scoring_executor.run(
+            app.compute_compatibility_scores, user.snapshot(), gender_preference)
+        columns = ['user_id', 'name', 'MBTI', 'age', 'gender', 'location', 'interests_list',
+                   'compatibility_score']
+        matches = []
+        for row in potential_matches[columns].itertuples(index=False):
+            match = dict(zip(columns, row))
+            match['user_id'] = int(match['user_id'])
+            match['age'] = int(match['age'])
+            match['interests'] = match.pop('interests_list')
+            match['compatibility_score'] = float(match['compatibility_score'])
+            matches.append(match)
+        return {'matches': matches}
+
+    async def swipe(self, headers, query, body):
+        user = self.current_user(headers)
+        try:
+            other_id = int(body['user_id'])
+            kind = body['kind']
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400, 'user_id and kind are required')
+        if kind not in ('like', 'dislike') or other_id == user.user_id:
+            raise HTTPError(400, 'kind must be like or dislike, about another user')
+        if not await self.db_executor.run(app.user_exists, other_id):
+            raise HTTPError(404, 'no such user')
+        matched = await self.db_executor.run(app.record_swipe, user.user_id, other_id, kind)
+        if kind == 'like':
+            user.liked_users.add(other_id)
+        else:
+            user.disliked_users.add(other_id)
+        if matched:
+            user.matches.add(other_id)
+        return {'matched': matched}
+
+    async def stats(self, headers, query, body):
+        # Reading the recommendation cache loads the matching module, and with it scoring
+        import scoring
+        return {'recommendation_cache': app.recommendation_cache.stats(),
+                'failed_logins': app.failed_logins.stats(),
+                'scoring': scoring.stats()}
+
+    async def metrics(self, headers, query, body):
+        return tracing.prometheus()
+
+    async def profiles(self, headers, query, body):
+        return {'profiles': [{'seconds': elapsed, 'request': name, 'report': report}
+                             for elapsed, name, report in tracing.slowest_profiles()]}
+
+    ###### HTTP ######
+    async def handle(self, method, target, headers, body):
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for _, path in self.routes):
+                raise HTTPError(405, 'method not allowed')
+            raise HTTPError(404, 'not found')
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            raise HTTPError(400, 'body must be JSON')
+        with tracing.span('http ' + method + ' ' + url.path):
+            return await handler(headers, parse_qs(url.query), payload)
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+
+                if length < 0:
+                    # Where the body ends is unknown, so the connection is closed after the reply
+                    status, result = 400, {'error': 'Content-Length must be a non-negative integer'}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length)
+                    try:
+                        status, result = 200, await self.handle(method, target, headers, body)
+                    except HTTPError as e:
+                        status, result = e.status, {'error': e.message}
+                    except Exception as e:
+                        status, result = 500, {'error': str(e)}
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                # Handlers return JSON-serializable objects, or text (the Prometheus metrics)
+                if isinstance(result, str):
+                    content_type, data = 'text/plain; version=0.0.4', result.encode()
+                else:
+                    content_type, data = 'application/json', json.dumps(result).encode()
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: {}\r\n'
+                             'Content-Length: {}\r\nConnection: {}\r\n\r\n'
+                             .format(status, REASONS[status], content_type, len(data),
+                                     'keep-alive' if keep_alive else 'close').encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.serve_connection, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.db_executor.shutdown()
+            self.scoring_executor.shutdown()
+####################################################################################################
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--db', default=db.DB_PATH)
+    parser.add_argument('--trace-jsonl', help='write the recorded spans to this file on exit')
+    parser.add_argument('--swipe-log', help='acknowledge swipes once group-committed to this log (swipelog.py)')
+    args = parser.parse_args()
+
+    db.configure(args.db)
+    app.ensure_schema(args.db)
+    if args.swipe_log:
+        app.enable_swipe_log(args.swipe_log)
+    print('Serving Pairfect on http://{}:{}'.format(args.host, args.port))
+    try:
+        asyncio.run(MatchingService().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if app.swipe_log is not None:
+            app.swipe_log.close()
+        if args.trace_jsonl:
+            tracing.write_jsonl(args.trace_jsonl)
+
+
+if __name__ == "__main__":
+    main()
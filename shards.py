@@ -0,0 +1,328 @@
+"""Users sharded by location across several SQLite files, each with its own writer.
+
+    python shards.py [--db users.db] [--output users.shards] [--count 4]
+
+Sharding is opt-in: app, service and the other tools keep using the single database of
+db.DB_PATH. A deployment that shards splits its database with this script and goes through
+a Shards object for users, swipes and recommendations (see benchmarks/bench_shards.py).
+
+A new user is stored in the shard of their city, and keeps it: a later change of location
+does not move them; users without a known city are stored in FALLBACK_SHARD. Shard 0 also
+holds the directory, user_id -> shard and the unique names, so ids stay unique over all
+shards and a login finds the user's shard from the name.
+
+Every shard file has the usual schema. A swipe is stored in the shard of the user who
+swiped, and a match once in the shard of each side, so the relationships of a user are
+read from their own shard only. A like between shards takes the write lock of both files,
+in shard order, so two users liking each other at the same time still make one match.
+Commits of two files are not atomic together: a crash between them can leave a match
+on one side only, which repair_matches() restores.
+
+Recommendations are scattered to one CandidateStore per shard and the top-k of each are
+merged; the result is the same as scoring every user in one store.
+"""
+###### packages and dependencies ######
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
+
+import db
+from candidates import CandidateStore, top_k
+from schema import ensure_schema
+from vocab import CITIES
+
+####################################################################################################
+###### Settings ######
+SHARD_COUNT = 4
+
+# Shard of the users whose location is missing or not one of CITIES
+FALLBACK_SHARD = 0
+
+# In shard 0: the shard of every user, and the names, unique over all shards
+DIRECTORY_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS shard_files (
+        shard INTEGER PRIMARY KEY,
+        path TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_shards (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        shard INTEGER NOT NULL
+    )
+    ''',
+]
+
+def shard_file(root, shard):
+    return os.path.join(root, 'shard{}.db'.format(shard))
+####################################################################################################
+
+
+####################################################################################################
+###### Shards ######
+class Shards:
+    """The shard files under root, and routing of users and swipes to them."""
+    def __init__(self, root):
+        self.root = root
+        directory = sqlite3.connect(shard_file(root, 0))
+        try:
+            rows = directory.execute('SELECT shard, path FROM shard_files ORDER BY shard').fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        finally:
+            directory.close()
+        if not rows:
+            raise ValueError('{} holds no shards, create them with Shards.create'.format(root))
+        self.paths = [os.path.join(root, path) for _, path in rows]
+        self.count = len(self.paths)
+
+        # user_id -> shard, filled from the directory on first use (-1: not looked up yet)
+        self.shard_of_id = np.full(0, -1, dtype=np.int16)
+        self.lock = threading.Lock()
+
+        self.stores = [None] * self.count
+        self.store_locks = [threading.Lock() for _ in range(self.count)]
+        self.executor = None
+
+    @classmethod
+    def create(cls, root, count=SHARD_COUNT):
+        """Create count empty shard files under root."""
+        os.makedirs(root, exist_ok=True)
+        for shard in range(count):
+            ensure_schema(shard_file(root, shard))
+        conn = sqlite3.connect(shard_file(root, 0))
+        try:
+            for statement in DIRECTORY_TABLES:
+                conn.execute(statement)
+            if conn.execute('SELECT COUNT(*) FROM shard_files').fetchone()[0]:
+                raise ValueError('{} already holds shards'.format(root))
+            conn.executemany('INSERT INTO shard_files (shard, path) VALUES (?, ?)',
+                             [(shard, os.path.basename(shard_file(root, shard))) for shard in range(count)])
+            conn.commit()
+        finally:
+            conn.close()
+        return cls(root)
+
+    ###### Routing ######
+    def shard_for_location(self, location):
+        """Shard a new user of that city is stored in."""
+        return CITIES.index(location) % self.count if location in CITIES else FALLBACK_SHARD
+
+    def shard_of(self, user_id):
+        """Shard of an existing user, None if the user does not exist."""
+        if user_id < len(self.shard_of_id) and self.shard_of_id[user_id] >= 0:
+            return int(self.shard_of_id[user_id])
+        with db.connection(self.paths[0]) as conn:
+            row = conn.execute('SELECT shard FROM user_shards WHERE user_id = ?', (user_id,)).fetchone()
+        if row is None:
+            return None
+        self.remember(user_id, row[0])
+        return row[0]
+
+    def remember(self, user_id, shard):
+        with self.lock:
+            if user_id >= len(self.shard_of_id):
+                grown = np.full(max(user_id + 1, 2 * len(self.shard_of_id), 1024), -1, dtype=np.int16)
+                grown[:len(self.shard_of_id)] = self.shard_of_id
+                self.shard_of_id = grown
+            self.shard_of_id[user_id] = shard
+
+    @contextmanager
+    def transactions(self, shards):
+        """{shard: connection} of one write transaction per shard, opened in shard order.
+
+        Taking the locks in one global order means two transactions over the same shards
+        wait for each other instead of deadlocking. Commits happen in reverse order.
+        """
+        with ExitStack() as stack:
+            yield {shard: stack.enter_context(db.transaction(self.paths[shard])) for shard in sorted(shards)}
+
+    ###### Users ######
+    def insert_user(self, row):
+        """Insert (name, password, MBTI, age, gender, location, interests) and return the new user_id."""
+        shard = self.shard_for_location(row[5])
+        with self.transactions({0, shard}) as conns:
+            user_id = conns[0].execute('INSERT INTO user_shards (name, shard) VALUES (?, ?)',
+                                       (row[0], shard)).lastrowid
+            db.insert_user(conns[shard], row, user_id)
+        self.remember(user_id, shard)
+        return user_id
+
+    def fetch_user(self, user_id):
+        """Return (users record, (liked, disliked, matches)) or None, all read from the user's shard."""
+        shard = self.shard_of(user_id)
+        if shard is None:
+            return None
+        with db.transaction(self.paths[shard], immediate=False) as conn:
+            data = db.fetch_user(conn, user_id)
+            return (data, db.fetch_relationships(conn, user_id)) if data else None
+
+    def update_user(self, user_id, row):
+        """Update the profile in the user's shard; the user stays there whatever the new location."""
+        shard = self.shard_of(user_id)
+        if shard is None:
+            raise KeyError('No user {}'.format(user_id))
+        with self.transactions({0, shard}) as conns:
+            conns[0].execute('UPDATE user_shards SET name = ? WHERE user_id = ?', (row[0], user_id))
+            db.update_user(conns[shard], user_id, row)
+
+    def fetch_credentials(self, name):
+        """Return (user_id, password hash) of name, or None."""
+        with db.connection(self.paths[0]) as conn:
+            row = conn.execute('SELECT user_id, shard FROM user_shards WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        self.remember(*row)
+        with db.connection(self.paths[row[1]]) as conn:
+            return db.fetch_credentials(conn, name)
+
+    def delete_user(self, user_id):
+        """Delete the user and every swipe and match referencing them, in every shard."""
+        home = self.shard_of(user_id)
+        if home is None:
+            return
+        with self.transactions(range(self.count)) as conns:
+            other_ids = [other_id for (other_id,) in
+                         conns[home].execute('SELECT other_id FROM matches WHERE user_id = ?', (user_id,))]
+            by_shard = {}
+            for other_id in other_ids:
+                by_shard.setdefault(self.shard_of(other_id), []).append(other_id)
+            for shard, conn in conns.items():
+                if shard != home:
+                    db.delete_references(conn, user_id, by_shard.get(shard, []))
+            db.delete_user(conns[home], user_id)
+            conns[0].execute('DELETE FROM user_shards WHERE user_id = ?', (user_id,))
+
+    ###### Swipes ######
+    def record_swipe(self, src_id, dst_id, kind, ts=None):
+        """Store one like/dislike of src about dst. Returns True if the like created a new match."""
+        ts = time.time() if ts is None else ts
+        src, dst = self.shard_of(src_id), self.shard_of(dst_id)
+        if src is None or dst is None:
+            raise KeyError('No user {}'.format(dst_id if src is not None else src_id))
+        # A dislike never reads the other shard
+        if src == dst or kind != 'like':
+            with db.transaction(self.paths[src]) as conn:
+                return db.record_swipe(conn, src_id, dst_id, kind, ts)
+        with self.transactions({src, dst}) as conns:
+            return db.record_swipe_across(conns[src], conns[dst], src_id, dst_id, kind, ts)
+
+    def repair_matches(self):
+        """Add the side of cross-shard matches missing after a crash. Returns the rows added."""
+        added = 0
+        for shard, path in enumerate(self.paths):
+            conn = sqlite3.connect(path)
+            try:
+                for other, other_path in enumerate(self.paths):
+                    if other == shard:
+                        continue
+                    conn.execute('ATTACH DATABASE ? AS other', (other_path,))
+                    added += conn.execute('''
+                        INSERT OR IGNORE INTO matches (user_id, other_id, ts)
+                        SELECT m.other_id, m.user_id, m.ts FROM other.matches m
+                        JOIN users u ON u.user_id = m.other_id
+                    ''').rowcount
+                    conn.commit()
+                    conn.execute('DETACH DATABASE other')
+            finally:
+                conn.close()
+        return added
+
+    ###### Recommendations ######
+    def store(self, shard):
+        """Candidate store of one shard, caught up with its file. Hold store_locks[shard] while using it."""
+        if self.stores[shard] is None:
+            self.stores[shard] = CandidateStore.from_db(self.paths[shard])
+        else:
+            self.stores[shard].refresh()
+        return self.stores[shard]
+
+    def shard_top_matches(self, shard, current_user, gender_preference, k):
+        with self.store_locks[shard]:
+            return self.store(shard).top_matches(current_user, gender_preference, k=k)
+
+    def top_matches(self, current_user, gender_preference, k=5):
+        """(user_ids, scores) of the best k candidates over all shards, scored in parallel."""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.count)
+        results = list(self.executor.map(
+            lambda shard: self.shard_top_matches(shard, current_user, gender_preference, k), range(self.count)))
+        user_ids = np.concatenate([user_ids for user_ids, _ in results])
+        scores = {name: np.concatenate([shard_scores[name] for _, shard_scores in results])
+                  for name in results[0][1]}
+        best = top_k(scores['compatibility_score'], k, tiebreak=user_ids)
+        return user_ids[best], {name: values[best] for name, values in scores.items()}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+####################################################################################################
+
+
+####################################################################################################
+###### Splitting a database ######
+def split(db_path, root, count=SHARD_COUNT):
+    """Copy the users, swipes and matches of db_path into count new shards under root, ids kept."""
+    shards = Shards.create(root, count)
+    placement = [(city, shards.shard_for_location(city)) for city in CITIES]
+    for shard, path in enumerate(shards.paths):
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute('ATTACH DATABASE ? AS source', (db_path,))
+            conn.execute('CREATE TEMP TABLE placement (location TEXT PRIMARY KEY, shard INTEGER)')
+            conn.executemany('INSERT INTO temp.placement VALUES (?, ?)', placement)
+            # Users of no known city, NULL included, go where shard_for_location puts them
+            conn.execute('''
+                CREATE TEMP VIEW local_users AS SELECT u.* FROM source.users u
+                LEFT JOIN temp.placement p ON p.location = u.location WHERE COALESCE(p.shard, {}) = {}
+            '''.format(FALLBACK_SHARD, shard))
+            conn.execute('INSERT INTO users SELECT * FROM temp.local_users')
+            conn.execute('''
+                INSERT INTO swipes SELECT s.* FROM source.swipes s
+                WHERE s.src IN (SELECT user_id FROM temp.local_users)
+            ''')
+            conn.execute('''
+                INSERT INTO matches SELECT m.* FROM source.matches m
+                WHERE m.user_id IN (SELECT user_id FROM temp.local_users)
+            ''')
+            if shard == 0:
+                conn.execute('''
+                    INSERT INTO user_shards (user_id, name, shard)
+                    SELECT u.user_id, u.name, COALESCE(p.shard, ?) FROM source.users u
+                    LEFT JOIN temp.placement p ON p.location = u.location
+                ''', (FALLBACK_SHARD,))
+            conn.commit()
+        finally:
+            conn.close()
+    return shards
+####################################################################################################
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=db.DB_PATH)
+    parser.add_argument('--output', default='users.shards')
+    parser.add_argument('--count', type=int, default=SHARD_COUNT)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    shards = split(args.db, args.output, args.count)
+    sizes = []
+    for path in shards.paths:
+        with db.connection(path) as conn:
+            sizes.append(conn.execute('SELECT COUNT(*) FROM users').fetchone()[0])
+    print('Split {} into {} shards of {} users in {:.2f}s'.format(
+        args.db, shards.count, ', '.join(map(str, sizes)), time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
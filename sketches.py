@@ -0,0 +1,142 @@
+"""Candidate sketches for approximate top-k: coarse buckets plus MinHash/LSH on interests.
+
+Candidates are bucketed by (gender, location, MBTI, age band), and every bucket keeps the
+age range of its members, so a pipeline bounds the score of all buckets in one vectorized
+call. Interest bitmasks are summarised by MinHash signatures: NUM_HASHES random orders of
+the interest bits, each giving the first bit of the mask in that order. Two masks agree on
+one of them with probability equal to their Jaccard similarity. Signatures are cut into
+bands of ROWS_PER_BAND values, and a candidate whose band equals the query's in any band
+is similar to it (LSH). Band keys are sorted per bucket, so the similar candidates of any
+set of buckets are found by binary search.
+
+An approximate query (see CandidateStore.top_matches) scores the buckets with the best
+bounds until budget candidates are scored. From the other buckets whose bound still beats
+the k-th score, it only scores the candidates similar to the user.
+"""
+###### packages and dependencies ######
+import numpy as np
+
+####################################################################################################
+###### Settings ######
+# Years per coarse age band
+AGE_BAND = 5
+
+# MinHash signature length, split into NUM_HASHES // ROWS_PER_BAND LSH bands
+NUM_HASHES = 8
+ROWS_PER_BAND = 2
+
+# Interest masks are 64 bits wide (candidates.INTEREST_BITS); a minhash value, up to MASK_BITS
+# for an empty mask, takes BAND_BITS in a band key
+MASK_BITS = 64
+BAND_BITS = 7
+
+SEED = 0
+####################################################################################################
+
+
+####################################################################################################
+###### MinHash and LSH ######
+def permutations(num_hashes=NUM_HASHES, seed=SEED):
+    """(num_hashes, MASK_BITS) array: the rank of every interest bit in each random order."""
+    rng = np.random.default_rng(seed)
+    return np.array([rng.permutation(MASK_BITS) for _ in range(num_hashes)], dtype=np.uint8)
+
+
+def minhash(masks, ranks):
+    """(hashes, len(masks)) MinHash signatures of interest bitmasks; MASK_BITS for an empty mask.
+
+    Masks repeat a lot (a few interests each), so signatures are computed once per distinct mask.
+    """
+    unique, inverse = np.unique(np.asarray(masks, dtype=np.uint64), return_inverse=True)
+    bits = ((unique[:, None] >> np.arange(MASK_BITS, dtype=np.uint64)) & np.uint64(1)).astype(bool)
+    signatures = np.where(bits[None, :, :], ranks[:, None, :], MASK_BITS).min(axis=2)
+    return signatures[:, inverse.ravel()]
+
+
+def band_keys(signatures, rows_per_band=ROWS_PER_BAND):
+    """(bands, n) integer keys, one per band of rows_per_band signature values."""
+    keys = np.zeros((len(signatures) // rows_per_band, signatures.shape[1]), dtype=np.int64)
+    for band in range(len(keys)):
+        for row in range(rows_per_band):
+            keys[band] |= signatures[band * rows_per_band + row].astype(np.int64) << (row * BAND_BITS)
+    return keys
+
+
+def ranges(starts, ends):
+    """Concatenation of arange(start, end) over the pairs, without a Python loop."""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.intp)
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.arange(total) + offsets
+####################################################################################################
+
+
+####################################################################################################
+###### Index ######
+class SketchIndex:
+    """Buckets and LSH tables over the live slots of a CandidateStore.
+
+    order lists the slots sorted by bucket, and bucket b holds order[starts[b]:ends[b]].
+    For each band, lsh_keys[band] is sorted by (bucket, band key) and lsh_slots[band] are
+    the matching slots. Slots changed after the build are listed in dirty.
+    """
+    def __init__(self, store, age_band=AGE_BAND, num_hashes=NUM_HASHES, rows_per_band=ROWS_PER_BAND):
+        self.age_band = age_band
+        self.rows_per_band = rows_per_band
+        self.ranks = permutations(num_hashes)
+        self.dirty = set()
+
+        rows = np.flatnonzero(store.alive)
+        gender, location, mbti = store.gender[rows], store.location[rows], store.mbti[rows]
+        age = store.age[rows].astype(np.int64)
+        band = age // age_band
+        sort = np.lexsort((band, mbti, location, gender))
+        self.order = rows[sort]
+        gender, location, mbti, age, band = gender[sort], location[sort], mbti[sort], age[sort], band[sort]
+        changed = ((gender[1:] != gender[:-1]) | (location[1:] != location[:-1])
+                   | (mbti[1:] != mbti[:-1]) | (band[1:] != band[:-1]))
+        self.starts = np.flatnonzero(np.r_[True, changed]) if len(self.order) else np.empty(0, dtype=np.intp)
+        self.ends = np.r_[self.starts[1:], len(self.order)]
+        self.sizes = self.ends - self.starts
+        self.columns = {'gender': gender[self.starts], 'location': location[self.starts],
+                        'mbti': mbti[self.starts]}
+        if len(self.starts):
+            self.columns['age_min'] = np.minimum.reduceat(age, self.starts)
+            self.columns['age_max'] = np.maximum.reduceat(age, self.starts)
+
+        # Bucket number in the high bits, band key in the low ones: one sort per band
+        bucket = np.repeat(np.arange(len(self.starts), dtype=np.int64), self.sizes)
+        self.key_bits = BAND_BITS * rows_per_band
+        keys = band_keys(minhash(store.interest_mask[self.order], self.ranks), rows_per_band)
+        self.lsh_keys, self.lsh_slots = [], []
+        for band_key in keys:
+            combined = (bucket << self.key_bits) | band_key
+            by_key = np.argsort(combined, kind='stable')
+            self.lsh_keys.append(combined[by_key])
+            self.lsh_slots.append(self.order[by_key])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def bounds(self, query):
+        """Upper bound of the score of every bucket for query."""
+        return np.broadcast_to(query.pipeline.bound(query, self.columns), len(self.starts))
+
+    def slots(self, buckets):
+        """Slots of the given buckets, concatenated."""
+        return self.order[ranges(self.starts[buckets], self.ends[buckets])]
+
+    def similar(self, mask, buckets):
+        """Slots of the given buckets that share an LSH band with the interests mask."""
+        if mask == 0 or len(buckets) == 0:
+            return np.empty(0, dtype=np.intp)
+        query_keys = band_keys(minhash(np.array([mask], dtype=np.uint64), self.ranks), self.rows_per_band)[:, 0]
+        buckets = np.asarray(buckets, dtype=np.int64) << self.key_bits
+        found = []
+        for keys, slots, query_key in zip(self.lsh_keys, self.lsh_slots, query_keys):
+            targets = buckets | int(query_key)
+            found.append(slots[ranges(np.searchsorted(keys, targets, 'left'), np.searchsorted(keys, targets, 'right'))])
+        return np.unique(np.concatenate(found))
+####################################################################################################
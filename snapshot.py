@@ -0,0 +1,174 @@
+"""Memory-mapped snapshots of the candidate store, for workers that start in milliseconds.
+
+    python snapshot.py [--db users.db] [--output candidates.snapshot]
+
+A snapshot is the encoded columns of a CandidateStore written as aligned binary arrays after
+a JSON header, together with the user_changes watermark they are current to. A worker maps
+the file copy-on-write instead of reading the users table: every process mapping the same
+file shares its pages, and only the users changed since the watermark (the delta) are read
+from the database and applied on top. Changed rows make private copies of their own pages;
+new users go to zeroed headroom at the end of every column, so appending does not copy the
+columns either until the headroom is used up.
+
+File layout, little endian:
+
+    MAGIC | header length (uint64) | header (JSON) | padding | arrays, each ALIGNMENT-aligned
+"""
+###### packages and dependencies ######
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import db
+from candidates import COLUMNS, INTEREST_BITS, CandidateStore, Vocabulary
+from schema import current_watermark
+
+####################################################################################################
+###### Settings ######
+MAGIC = b'PAIRSNAP'
+VERSION = 1
+
+# Arrays start on cache-line boundaries
+ALIGNMENT = 64
+
+# Empty rows written after the users, as a fraction of them (at least HEADROOM_MIN_ROWS)
+HEADROOM = 0.125
+HEADROOM_MIN_ROWS = 4096
+
+SNAPSHOT_PATH = os.environ.get('PAIRFECT_SNAPSHOT', '')
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+####################################################################################################
+
+
+####################################################################################################
+###### Writing ######
+def write(store, path):
+    """Write the live rows of store to path. Returns the number of rows.
+
+    The file is written next to path and renamed over it, so a worker never maps a partial
+    snapshot and workers that mapped the previous one keep reading it.
+    """
+    rows = np.flatnonzero(store.alive)
+    size = len(rows)
+    capacity = size + max(HEADROOM_MIN_ROWS, int(size * HEADROOM))
+    user_ids = store.user_id[rows]
+    id_capacity = (int(user_ids.max()) + 1 if size else 0) + capacity - size
+    slot_of_id = np.full(id_capacity, -1, dtype=np.int64)
+    slot_of_id[user_ids] = np.arange(size)
+
+    arrays = [(name, np.dtype(dtype).newbyteorder('<'), store.column(name)[rows], capacity)
+              for name, dtype in COLUMNS]
+    arrays.append(('slot_of_id', np.dtype('<i8'), slot_of_id, id_capacity))
+    layout = {}
+    offset = 0
+    for name, dtype, _, length in arrays:
+        layout[name] = {'dtype': dtype.str, 'offset': offset, 'length': length}
+        offset = align(offset + length * dtype.itemsize)
+    header = json.dumps({
+        'version': VERSION,
+        'watermark': store.watermark,
+        'size': size,
+        'created': time.time(),
+        'vocabularies': {'genders': store.genders.values, 'locations': store.locations.values,
+                         'interests': store.interests.values},
+        'arrays': layout,
+    }).encode()
+    data = align(len(MAGIC) + 8 + len(header))
+
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for name, dtype, values, _ in arrays:
+            f.seek(data + layout[name]['offset'])
+            f.write(values.astype(dtype, copy=False).tobytes())
+        # The headroom past the last written byte stays a hole in the file, read back as zeros
+        f.truncate(data + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return size
+####################################################################################################
+
+
+####################################################################################################
+###### Loading ######
+def read_header(path):
+    """Return (header, offset of the first array)."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a candidate snapshot'.format(path))
+        length = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(length))
+    if header['version'] != VERSION:
+        raise ValueError('Snapshot version {} of {} is not supported'.format(header['version'], path))
+    return header, align(len(MAGIC) + 8 + length)
+
+
+def map_array(path, data, spec):
+    if spec['length'] == 0:
+        return np.empty(0, dtype=spec['dtype'])
+    # Copy-on-write: writes stay private to this process and never reach the file
+    return np.memmap(path, dtype=spec['dtype'], mode='c', offset=data + spec['offset'], shape=(spec['length'],))
+
+
+def load(path, db_path=None):
+    """Map the snapshot at path as a CandidateStore, caught up with the database.
+
+    Raises ValueError if the snapshot is newer than the database, i.e. was taken of another one.
+    """
+    header, data = read_header(path)
+    with db.connection(db_path) as conn:
+        if header['watermark'] > current_watermark(conn.cursor()):
+            raise ValueError('Snapshot {} is ahead of the database'.format(path))
+
+    store = CandidateStore(db_path)
+    store.watermark = header['watermark']
+    vocabularies = header['vocabularies']
+    store.genders = Vocabulary(vocabularies['genders'])
+    store.locations = Vocabulary(vocabularies['locations'])
+    store.interests = Vocabulary(vocabularies['interests'], limit=INTEREST_BITS)
+
+    arrays = header['arrays']
+    store.buffers = {name: map_array(path, data, arrays[name]) for name, _ in COLUMNS}
+    store.size = store.live = header['size']
+    store.alive_buffer = np.zeros(arrays['user_id']['length'], dtype=bool)
+    store.alive_buffer[:store.size] = True
+    store.slot_of_id = map_array(path, data, arrays['slot_of_id'])
+    store.refresh()
+    return store
+
+
+def load_store(path=None, db_path=None):
+    """The snapshot at path (SNAPSHOT_PATH by default) if usable, else a store read from the database."""
+    path = path or SNAPSHOT_PATH
+    if path and os.path.exists(path):
+        try:
+            return load(path, db_path)
+        except ValueError as e:
+            print('Ignoring snapshot: {}'.format(e))
+    return CandidateStore.from_db(db_path)
+####################################################################################################
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=db.DB_PATH)
+    parser.add_argument('--output', default=SNAPSHOT_PATH or 'candidates.snapshot')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = CandidateStore.from_db(args.db)
+    rows = write(store, args.output)
+    print('Wrote {} users at watermark {} to {} in {:.2f}s'.format(
+        rows, store.watermark, args.output, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
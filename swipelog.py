@@ -0,0 +1,297 @@
+"""Write-behind swipe log: likes and dislikes acknowledged after one group-committed fsync.
+
+A swipe is appended to a binary log and acknowledged once the log is on disk. A writer
+thread collects the swipes made during one window (WINDOW_MS) and writes them with a
+single fsync, so any number of concurrent swipes share its cost. An applier thread then
+records the logged swipes in the database, many per transaction, through db.record_swipe.
+
+The transaction that applies records also stores the seq of the last one (swipe_log_state),
+so after a crash the log is replayed from exactly there: a record is applied once, even if
+the process died between the fsync of the log and the commit of the database. New matches
+are found by the applier, after the swipe was acknowledged, and reach clients as
+match_events like any other match.
+
+The log is a series of segment files named <path>.<first seq>. Little endian:
+
+    MAGIC | first seq (uint64) | records
+
+A record is (seq, src, dst, ts, kind) and a CRC32 of those bytes. A torn record at the end
+of the last segment, from a crash during a write, was never acknowledged and is dropped.
+Segments whose records were all applied are deleted.
+"""
+###### packages and dependencies ######
+import glob
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+import db
+import tracing
+
+####################################################################################################
+###### Settings ######
+MAGIC = b'PAIRSWLG'
+HEADER = struct.Struct('<8sQ')
+# seq, src, dst, ts, kind (index in KINDS), 3 padding bytes, CRC32 of the bytes before it
+RECORD = struct.Struct('<QqqdB3xI')
+KINDS = ('like', 'dislike')
+
+# Time a group commit waits for more swipes after the first one; 0 writes at once, still
+# grouping the swipes that arrived during the previous fsync
+WINDOW_MS = 2
+
+# Records per segment file before a new one is started
+SEGMENT_RECORDS = 1 << 20
+
+# Records applied per database transaction
+APPLY_BATCH = 5000
+
+def segment_path(path, first_seq):
+    return '{}.{:020d}'.format(path, first_seq)
+####################################################################################################
+
+
+####################################################################################################
+###### Segments ######
+def pack(seq, src_id, dst_id, kind, ts):
+    data = RECORD.pack(seq, src_id, dst_id, ts, KINDS.index(kind), 0)
+    return data[:-4] + struct.pack('<I', zlib.crc32(data[:-4]))
+
+
+def read_segment(path):
+    """Return (first seq, [(seq, src, dst, kind, ts), ...], bytes up to the end of the last valid record)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        return None, [], 0
+    magic, first_seq = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('{} is not a swipe log segment'.format(path))
+    records = []
+    end = HEADER.size
+    while end + RECORD.size <= len(data):
+        seq, src_id, dst_id, ts, kind, crc = RECORD.unpack_from(data, end)
+        if crc != zlib.crc32(data[end:end + RECORD.size - 4]) or seq != first_seq + len(records):
+            break
+        records.append((seq, src_id, dst_id, KINDS[kind], ts))
+        end += RECORD.size
+    return first_seq, records, end
+####################################################################################################
+
+
+####################################################################################################
+###### Log ######
+class SwipeLog:
+    """Durable, group-committed log of swipes, applied to db_path in the background.
+
+    append() blocks until its swipe is on disk. Records are applied in log order, by one
+    applier thread per log; a log must only be open in one process at a time.
+    """
+    def __init__(self, path, db_path=None, window_ms=WINDOW_MS, segment_records=SEGMENT_RECORDS,
+                 on_apply=None):
+        self.path = path
+        self.db_path = db_path
+        self.name = os.path.basename(path)
+        self.window = window_ms / 1000
+        self.segment_records = segment_records
+        # Called with the applied records and the (src, dst) pairs they matched
+        self.on_apply = on_apply
+
+        self.condition = threading.Condition()
+        self.pending = []
+        self.unapplied = deque()
+        self.closed = False
+        self.writing = True
+        self.error = None
+
+        with db.connection(db_path) as conn:
+            self.applied_seq = db.fetch_log_position(conn, self.name)
+        self.recover()
+        self.durable_seq = self.next_seq - 1
+
+        self.writer = threading.Thread(target=self.write_loop, name='swipelog-writer', daemon=True)
+        self.applier = threading.Thread(target=self.apply_loop, name='swipelog-applier', daemon=True)
+        self.writer.start()
+        self.applier.start()
+
+    def recover(self):
+        """Read the segments on disk: queue the records not applied yet, drop a torn tail."""
+        self.segments = []
+        last_seq = self.applied_seq
+        paths = sorted(glob.glob(glob.escape(self.path) + '.' + '[0-9]' * 20))
+        for i, path in enumerate(paths):
+            first_seq, records, end = read_segment(path)
+            if end < os.path.getsize(path) or not records:
+                if i < len(paths) - 1:
+                    raise ValueError('Swipe log segment {} is damaged'.format(path))
+                if not records:
+                    # Nothing acknowledged was written there, appending starts a new segment
+                    os.remove(path)
+                    continue
+                tracing.count('swipelog.torn_tail')
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+            self.segments.append((first_seq, path))
+            self.unapplied.extend(record for record in records if record[0] > self.applied_seq)
+            if records:
+                last_seq = max(last_seq, records[-1][0])
+        self.next_seq = last_seq + 1
+        self.file = None
+        self.segment_count = 0
+
+    ###### Appending ######
+    def append(self, src_id, dst_id, kind, ts=None):
+        """Log one like/dislike of src about dst and return its seq once it is durable."""
+        return self.extend([(src_id, dst_id, kind)], ts)
+
+    def extend(self, swipes, ts=None):
+        """Log (src_id, dst_id, kind) swipes in order; return the seq of the last once all are durable."""
+        ts = time.time() if ts is None else ts
+        with self.condition:
+            if self.closed:
+                raise ValueError('Swipe log {} is closed'.format(self.path))
+            for src_id, dst_id, kind in swipes:
+                self.pending.append((self.next_seq, src_id, dst_id, kind, ts))
+                self.next_seq += 1
+            seq = self.next_seq - 1
+            self.condition.notify_all()
+            while self.durable_seq < seq and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
+        return seq
+
+    def write_loop(self):
+        try:
+            self.write_groups()
+        finally:
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def write_groups(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+            if self.window:
+                # Let the swipes of the next few milliseconds share this fsync
+                time.sleep(self.window)
+            with self.condition:
+                batch, self.pending = self.pending, []
+            try:
+                with tracing.span('swipelog.group_commit'):
+                    self.write(batch)
+            except Exception as e:
+                print('Exception: {}'.format(e))
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+            tracing.count('swipelog.group_commits')
+            with self.condition:
+                self.durable_seq = batch[-1][0]
+                self.unapplied.extend(batch)
+                self.condition.notify_all()
+
+    def write(self, batch):
+        while batch:
+            if self.file is None or self.segment_count >= self.segment_records:
+                self.start_segment(batch[0][0])
+            room = self.segment_records - self.segment_count
+            chunk, batch = batch[:room], batch[room:]
+            self.file.write(b''.join(pack(*record) for record in chunk))
+            self.segment_count += len(chunk)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def start_segment(self, first_seq):
+        if self.file is not None:
+            self.file.close()
+        path = segment_path(self.path, first_seq)
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, first_seq))
+        self.segment_count = 0
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        # The new file name must be durable too, or a crash could lose the whole segment
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        with self.condition:
+            self.segments.append((first_seq, path))
+
+    ###### Applying ######
+    def apply_loop(self):
+        while True:
+            with self.condition:
+                while not self.unapplied and self.writing:
+                    self.condition.wait()
+                if not self.unapplied:
+                    return
+                batch = [self.unapplied.popleft() for _ in range(min(APPLY_BATCH, len(self.unapplied)))]
+            try:
+                self.apply(batch)
+            except Exception as e:
+                # Put the records back: the next round retries them, or the next replay once closed
+                print('Exception: {}'.format(e))
+                with self.condition:
+                    self.unapplied.extendleft(reversed(batch))
+                    if not self.writing:
+                        return
+                time.sleep(0.1)
+
+    def apply(self, batch):
+        """Record the swipes of batch in the database, skipping those applied already."""
+        matched = []
+        with tracing.span('swipelog.apply'), db.transaction(self.db_path) as conn:
+            applied_seq = db.fetch_log_position(conn, self.name)
+            for seq, src_id, dst_id, kind, ts in batch:
+                if seq > applied_seq and db.record_swipe(conn, src_id, dst_id, kind, ts):
+                    matched.append((src_id, dst_id))
+            db.store_log_position(conn, self.name, max(applied_seq, batch[-1][0]))
+        tracing.count('swipelog.applied', len(batch))
+        with self.condition:
+            self.applied_seq = max(self.applied_seq, batch[-1][0])
+            self.condition.notify_all()
+        self.remove_applied_segments()
+        if self.on_apply is not None:
+            self.on_apply(batch, matched)
+
+    def remove_applied_segments(self):
+        with self.condition:
+            # A segment is done once the next one starts after the applied seq
+            while len(self.segments) > 1 and self.segments[1][0] - 1 <= self.applied_seq:
+                _, path = self.segments.pop(0)
+                os.remove(path)
+
+    def wait_applied(self, seq=None, timeout=None):
+        """Wait until every record up to seq (all appended ones by default) is in the database."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            seq = self.next_seq - 1 if seq is None else seq
+            while self.applied_seq < seq:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self):
+        """Write the pending swipes, apply everything logged, and stop both threads."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.writer.join()
+        self.applier.join()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+####################################################################################################
@@ -0,0 +1,48 @@
+"""Fixtures shared by the tests: the repository root on sys.path and throwaway databases."""
+###### packages and dependencies ######
+import os
+import random
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from cache import RecommendationCache
+from schema import ensure_schema
+from vocab import CITIES, GENDERS, INTERESTS, MBTI_TYPES
+
+####################################################################################################
+###### Databases ######
+def add_users(db_path, n, seed=0):
+    """Insert n users with random valid profiles; their user_ids are 1..n in a new database."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.executemany('''
+        INSERT INTO users (name, password, MBTI, age, gender, location, interests)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [('user{}'.format(i), 'password{}'.format(i), rng.choice(MBTI_TYPES), rng.randint(18, 60),
+           rng.choice(GENDERS), rng.choice(CITIES), ','.join(rng.sample(INTERESTS, rng.randint(0, 5))))
+          for i in range(1, n + 1)])
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Path of an empty database with the schema, used as db.DB_PATH during the test."""
+    path = str(tmp_path / 'users.db')
+    ensure_schema(path)
+    default = db.DB_PATH
+    db.configure(path)
+    yield path
+    db.close_all()
+    db.configure(default)
+    # The candidate store and the recommendations are per process, built from this database
+    matching = sys.modules.get('matching')
+    if matching is not None:
+        matching._candidate_store = None
+        matching.recommendation_cache = RecommendationCache()
+####################################################################################################
@@ -0,0 +1,66 @@
+"""Bulk import of exported profiles, and the rows it rejects."""
+###### packages and dependencies ######
+import csv
+import os
+import shutil
+
+import pandas as pd
+
+import bulk
+import db
+
+####################################################################################################
+SHIPPED = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'users.db')
+
+
+def all_users(db_path):
+    with db.connection(db_path) as conn:
+        return db.fetch_users_page(conn, 0, 1000000)
+
+
+def read_rejects(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_export_import_is_lossless(database, tmp_path):
+    # The shipped profiles include free-text interests from before the vocabulary
+    source = str(tmp_path / 'source.db')
+    shutil.copy(SHIPPED, source)
+    exported = str(tmp_path / 'users.csv')
+    bulk.export_users(exported, source)
+
+    stats = bulk.import_users(exported, database, allow_unknown_interests=True)
+    assert stats['rejected'] == 0
+    assert all_users(database) == all_users(source)
+
+
+def test_unknown_interests_rejected_by_default(database, tmp_path):
+    frame = pd.DataFrame({'name': ['a', 'b'], 'password': ['x', 'x'], 'MBTI': ['INTJ', 'INTJ'], 'age': ['30', '30'],
+                          'gender': ['Male', 'Male'], 'location': ['Toronto', 'Toronto'],
+                          'interests': ['Music', 'music']})
+    valid, rejected = bulk.validate(frame)
+    assert valid['name'].tolist() == ['a'] and rejected['error'].tolist() == ['unknown interest']
+    valid, rejected = bulk.validate(frame, allow_unknown_interests=True)
+    assert len(valid) == 2 and len(rejected) == 0
+
+
+def test_rejects_keep_the_values_as_read(database, tmp_path):
+    source = str(tmp_path / 'users.csv')
+    with open(source, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(bulk.FIELDS)
+        writer.writerow(['', 'taken', 'x', 'INTJ', '30', 'Male', 'Toronto', ''])
+        writer.writerow(['', 'old', 'x', 'INTJ', '151', 'Male', 'Toronto', ''])
+        writer.writerow(['', 'taken', 'x', 'INTJ', '30', 'Male', 'Toronto', ''])
+    rejects = str(tmp_path / 'rejects.csv')
+    bulk.import_users(source, database)
+
+    stats = bulk.import_users(source, database, rejects=rejects)
+    assert stats['inserted'] == 0
+    rows = {row['error']: row for row in read_rejects(rejects)}
+    assert rows['age must be an integer from 1 to 150']['age'] == '151'
+    # Clashing with the user imported before, with user_id and age as in the file
+    conflict = rows['name or user_id already exists']
+    assert (conflict['user_id'], conflict['age']) == ('', '30')
+####################################################################################################
@@ -0,0 +1,52 @@
+"""Cached recommendation lists dropped after candidates change, as one check per list would drop them."""
+###### packages and dependencies ######
+import random
+import sqlite3
+
+from conftest import add_users
+
+import app
+import matching
+from cache import RecommendationCache
+
+####################################################################################################
+def expected_stale(cache, store, updated):
+    """Every (list, updated candidate) pair checked on its own, with score_slot."""
+    stale = set()
+    for user_id, slot in updated:
+        listed = cache.keys_by_candidate.get(user_id, set())
+        for key, entry in cache.entries.items():
+            if user_id in entry.removed or user_id in entry.user.liked_users \
+                    or user_id in entry.user.disliked_users:
+                continue
+            if key in listed or not entry.full or store.score_slot(entry.query, slot) >= entry.threshold:
+                stale.add(key)
+    return stale
+
+
+def test_stale_lists(database):
+    add_users(database, 600)
+    rng = random.Random(0)
+    store = matching.get_candidate_store()
+    cache = RecommendationCache(depth=20)
+    for i, user_id in enumerate(rng.sample(range(1, 601), 150)):
+        user = app.fetch_user(user_id)
+        user.liked_users.update(rng.sample(range(1, 601), 5))
+        cache.page(store, user, ('Female', 'Male', 'Both')[i % 3])
+
+    conn = sqlite3.connect(database)
+    conn.execute('UPDATE users SET age = 18, MBTI = ? WHERE user_id % 37 = 0', ('ENFP',))
+    conn.execute("UPDATE users SET location = 'Toronto' WHERE user_id % 53 = 0")
+    conn.commit()
+    conn.close()
+    changes = store.refresh()
+    updated = [(user_id, store.slot(user_id)) for user_id, deleted in changes]
+    expected = expected_stale(cache, store, updated)
+    assert cache.stale_keys(store, updated) == expected
+    assert 0 < len(expected) < len(cache.entries)
+
+    for key, entry in cache.entries.items():
+        slots = [slot for _, slot in updated]
+        assert store.score_slots([entry.query], slots)[0].tolist() == \
+            [store.score_slot(entry.query, slot) for slot in slots]
+####################################################################################################
@@ -0,0 +1,59 @@
+"""Candidates excluded for a user, however many users they swiped on.
+
+SQLite builds before 3.32 allow 999 bound parameters per statement and later ones 250000.
+The connections are limited to 999 here, so a query binding one parameter per excluded
+user fails with far fewer users than a heavy swiper would exclude.
+"""
+###### packages and dependencies ######
+import sqlite3
+import time
+
+import pytest
+from conftest import add_users
+
+import app
+import db
+
+####################################################################################################
+LIMIT = 999
+USERS = 3000
+
+
+def limit_variables(limit):
+    # Pooled connections are reused, so limiting the idle ones limits every later query
+    with db.connection() as conn:
+        conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, limit)
+
+
+@pytest.fixture
+def heavy_swiper(database):
+    """User 1, with swipes on users 2..1601 stored and likes of 1602..2401 not written yet."""
+    add_users(database, USERS)
+    with db.transaction() as conn:
+        for other_id in range(2, 1602):
+            db.record_swipe(conn, 1, other_id, 'like' if other_id % 3 else 'dislike', time.time())
+    limit_variables(LIMIT)
+    user = app.fetch_user(1)
+    user.liked_users.update(range(1602, 2402))
+    return user
+
+
+def test_limit_is_enforced(heavy_swiper):
+    excluded = sorted(heavy_swiper.liked_users | heavy_swiper.disliked_users)
+    assert len(excluded) > LIMIT
+    with db.connection() as conn, pytest.raises(sqlite3.OperationalError, match='too many SQL variables'):
+        conn.execute('SELECT * FROM users WHERE user_id NOT IN ({})'.format(', '.join('?' * len(excluded))),
+                     excluded)
+
+
+def test_fetch_valid_users_beyond_variable_limit(heavy_swiper):
+    valid = app.fetch_valid_users(heavy_swiper)
+    assert set(valid['user_id']) == set(range(2402, USERS + 1))
+    assert len(valid) == USERS - 2401
+
+
+def test_recommendations_beyond_variable_limit(heavy_swiper):
+    potential_matches = app.compute_compatibility_scores(heavy_swiper, 'Both')
+    assert len(potential_matches) == 5
+    assert all(user_id > 2401 for user_id in potential_matches['user_id'])
+####################################################################################################
@@ -0,0 +1,168 @@
+"""The table-driven kernels and the scorers give exactly the scores of the original pandas code."""
+###### packages and dependencies ######
+import random
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import add_users
+
+import app
+import scoring
+from candidates import CandidateStore, encode_mbti
+from scoring import MBTI_TABLE, Query, jaccard, popcount
+from vocab import INTERESTS, MBTI_TYPES
+
+####################################################################################################
+###### Original code (compute_compatibility_scores before the candidate store) ######
+def original_compute_compatibility_scores(current_user, gender_preference, potential_matches):
+    """The original function, on the frame its fetch_valid_users returned (all rows, no interests_list)."""
+    if gender_preference == "Both":
+        potential_matches['gender_score'] = 1.0
+    else:
+        potential_matches['gender_score'] = (potential_matches['gender'] == gender_preference).astype(float)
+
+    potential_matches['location_score'] = (potential_matches['location'] == current_user.location).astype(float)
+
+    potential_matches['age_diff_score'] = 1 / (1 + np.abs(potential_matches['age'] - current_user.age))
+
+    mbti1 = current_user.MBTI
+    def calculate_mbti_scores(mbti2):
+        mbti_score = 0.0
+        if mbti1[0] != mbti2[0]:
+            mbti_score += 2.0
+        if mbti1[1] == mbti2[1]:
+            mbti_score += 1.0
+        if mbti1[2] == mbti2[2]:
+            mbti_score += 1.0
+        if mbti1[3] == mbti2[3]:
+            mbti_score += 1.0
+
+        return mbti_score / 5.0
+
+    potential_matches['MBTI_score'] = potential_matches['MBTI'].apply(calculate_mbti_scores)
+
+    current_interests_set = set(current_user.interests)
+
+    def calculate_jaccard_similarity_vectorized(interests):
+        interests_set = set(interests)
+        intersection_size = len(current_interests_set & interests_set)
+        union_size = len(current_interests_set | interests_set)
+        return intersection_size / union_size if union_size > 0 else 0
+
+    # Applied to the comma-separated strings, as it was
+    potential_matches['interests_score'] = potential_matches['interests'].apply(calculate_jaccard_similarity_vectorized)
+
+    potential_matches['compatibility_score'] = (
+        0.4 * potential_matches['gender_score'] +
+        0.15 * potential_matches['MBTI_score'] +
+        0.1 * potential_matches['age_diff_score'] +
+        0.2 * potential_matches['location_score'] +
+        0.15 * potential_matches['interests_score']
+    )
+    return potential_matches
+
+
+def word_jaccard(interests1, interests2):
+    interests1, interests2 = set(interests1), set(interests2)
+    union_size = len(interests1 | interests2)
+    return len(interests1 & interests2) / union_size if union_size > 0 else 0
+####################################################################################################
+
+
+####################################################################################################
+# Free-text interests of older rows, encoded on the bits above the 15 known ones. Those of
+# one character are the only ones the original interests score ever found in a string.
+LEGACY_INTERESTS = tuple('legacy{}'.format(i) for i in range(30)) + ('a', 'e', 'M', 'x', ',x')
+
+
+def random_interests(rng, vocabulary):
+    return rng.sample(vocabulary, rng.randint(0, min(6, len(vocabulary))))
+
+
+def interest_lists(seed, count):
+    rng = random.Random(seed)
+    lists = [[], ['Music'], list(INTERESTS), ['a'], ['a', 'e', 'M']]
+    lists += [random_interests(rng, INTERESTS) for _ in range(count)]
+    lists += [random_interests(rng, INTERESTS + LEGACY_INTERESTS) for _ in range(count)]
+    return lists
+
+
+@pytest.mark.parametrize('mbti1', MBTI_TYPES)
+def test_mbti_table(mbti1):
+    user = app.User(1, 'u', None, mbti1, 30, 'Male', 'Toronto', [])
+    frame = pd.DataFrame({'MBTI': list(MBTI_TYPES), 'gender': 'Male', 'location': 'Toronto', 'age': 30,
+                          'interests': ''})
+    expected = original_compute_compatibility_scores(user, 'Both', frame)['MBTI_score'].tolist()
+    codes = np.array([encode_mbti(mbti2) for mbti2 in MBTI_TYPES], dtype=np.uint8)
+    assert MBTI_TABLE[encode_mbti(mbti1), codes].tolist() == expected
+    query = Query(None, 0, 30, encode_mbti(mbti1), 0, None, list(INTERESTS))
+    assert scoring.MBTI_score({'mbti': codes}, query).tolist() == expected
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_interests_score(seed):
+    store = CandidateStore()
+    lists = interest_lists(seed, 300)
+    # Interests are stored comma-separated; ',x' does not survive that, as in the database
+    strings = [','.join(interests) for interests in lists]
+    masks = np.array([store.interest_mask_for(string) for string in strings], dtype=np.uint64)
+    frame = pd.DataFrame({'MBTI': 'INTJ', 'gender': 'Male', 'location': 'Toronto', 'age': 30, 'interests': strings})
+    for user_string in strings[:40] + strings[-40:]:
+        user = app.User(1, 'u', None, 'INTJ', 30, 'Male', 'Toronto', user_string.split(',') if user_string else [])
+        expected = original_compute_compatibility_scores(user, 'Both', frame.copy())['interests_score'].tolist()
+        query = Query(None, 0, 30, 0, store.interest_mask_for(user.interests), None, store.interests.values)
+        assert scoring.interests_score({'interest_mask': masks}, query).tolist() == expected, user_string
+
+    # Several users at once, as the batch precompute scores them
+    user_masks = masks[-40:, None]
+    query = Query(None, 0, 30, 0, user_masks, None, store.interests.values)
+    scores = scoring.interests_score({'interest_mask': masks[None, :]}, query)
+    for row, user_mask in enumerate(user_masks[:, 0]):
+        single = Query(None, 0, 30, 0, user_mask, None, store.interests.values)
+        assert scores[row].tolist() == scoring.interests_score({'interest_mask': masks}, single).tolist()
+
+
+def test_top_matches_as_original(database):
+    add_users(database, 400)
+    conn = sqlite3.connect(database)
+    # Some older rows with free-text interests, of one character among them
+    conn.execute("UPDATE users SET interests = 'a,reading' WHERE user_id % 7 = 0")
+    conn.execute("UPDATE users SET interests = 'e,M' WHERE user_id % 11 = 0")
+    conn.commit()
+    frame = pd.read_sql_query('SELECT * FROM users', conn)
+    conn.close()
+    for user_id in list(range(1, 30)) + [7, 11, 77]:
+        user = app.fetch_user(user_id)
+        for preference in ('Female', 'Male', 'Both'):
+            original = original_compute_compatibility_scores(user, preference, frame[frame['user_id'] != user_id].copy())
+            expected = dict(zip(original['user_id'], original['compatibility_score']))
+            top = app.compute_compatibility_scores(user, preference)
+            # Ties may be ordered differently; the scores of the top 5 must be the same
+            assert top['compatibility_score'].tolist() == original['compatibility_score'].nlargest(5).tolist()
+            assert all(expected[other_id] == score
+                       for other_id, score in zip(top['user_id'], top['compatibility_score']))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_jaccard(seed):
+    # The word-level Jaccard kernel, on interest lists
+    store = CandidateStore()
+    lists = interest_lists(seed, 2000)
+    pairs = list(zip(lists, reversed(lists)))
+    masks = np.array([store.interest_mask_for(first) for first, _ in pairs], dtype=np.uint64)
+    for i, (first, second) in enumerate(pairs):
+        mask = np.uint64(store.interest_mask_for(second))
+        assert jaccard(masks[i:i + 1], mask)[0] == word_jaccard(first, second), (first, second)
+
+
+def test_popcount_without_bitwise_count(monkeypatch):
+    values = np.random.default_rng(0).integers(0, np.iinfo(np.uint64).max, 10000, dtype=np.uint64, endpoint=True)
+    values[:2] = (0, np.iinfo(np.uint64).max)
+    expected = [bin(int(value)).count('1') for value in values]
+    assert popcount(values).tolist() == expected
+    # NumPy before 2.0 has no bitwise_count; the byte table is used instead
+    monkeypatch.delattr(np, 'bitwise_count', raising=False)
+    assert popcount(values).tolist() == expected
+####################################################################################################
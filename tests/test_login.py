@@ -0,0 +1,40 @@
+"""Failed logins cached by one process must not outlive changes made by another."""
+###### packages and dependencies ######
+import sqlite3
+
+from conftest import add_users
+
+import app
+from credentials import hash_password
+
+####################################################################################################
+def set_password(db_path, name, password):
+    # Through a connection of its own, as another process would
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE users SET password = ? WHERE name = ?', (hash_password(password), name))
+    conn.commit()
+    conn.close()
+
+
+def test_account_created_elsewhere(database):
+    assert app.authenticate('user1', 'secret') is None
+    assert app.failed_logins.unknown('user1')
+
+    add_users(database, 1)
+    set_password(database, 'user1', 'secret')
+    user = app.authenticate('user1', 'secret')
+    assert user is not None and user.name == 'user1'
+
+
+def test_password_changed_elsewhere(database):
+    add_users(database, 1)
+    set_password(database, 'user1', 'old')
+    hits = app.failed_logins.hits
+    assert app.authenticate('user1', 'new') is None
+    assert app.authenticate('user1', 'new') is None
+    assert app.failed_logins.hits == hits + 1
+
+    set_password(database, 'user1', 'new')
+    assert app.authenticate('user1', 'new') is not None
+    assert app.authenticate('user1', 'old') is None
+####################################################################################################
@@ -0,0 +1,24 @@
+"""The partitioned scan returns what scoring every row returns."""
+###### packages and dependencies ######
+from conftest import add_users
+
+import app
+from candidates import CandidateStore
+
+####################################################################################################
+def test_no_live_rows(database):
+    user = app.User(0, 'u', None, 'INTJ', 30, 'Male', 'Toronto', ['Music'])
+    store = CandidateStore.from_db(database)
+    for partitioned in (False, True):
+        user_ids, scores = store.top_matches(user, 'Both', partitioned=partitioned, budget=0)
+        assert len(user_ids) == 0 and len(scores['compatibility_score']) == 0
+
+    # Every user deleted once the store was loaded
+    add_users(database, 20)
+    store = CandidateStore.from_db(database)
+    for user_id in range(1, 21):
+        store.remove(user_id)
+    for partitioned in (False, True):
+        user_ids, scores = store.top_matches(user, 'Both', partitioned=partitioned, budget=0)
+        assert len(user_ids) == 0 and len(scores['compatibility_score']) == 0
+####################################################################################################
@@ -0,0 +1,75 @@
+"""Requests the service must reject without writing anything or dropping the connection."""
+###### packages and dependencies ######
+import asyncio
+import json
+
+from conftest import add_users
+
+import db
+import service
+
+####################################################################################################
+async def exchange(port, request):
+    """Send raw request bytes; return (status, JSON body) of the reply."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    body = json.loads(await reader.readexactly(length))
+    writer.close()
+    return status, body
+
+
+def post(path, payload, token=None):
+    data = json.dumps(payload).encode()
+    authorization = 'Authorization: Bearer {}\r\n'.format(token) if token else ''
+    return ('POST {} HTTP/1.1\r\n{}Content-Length: {}\r\nConnection: close\r\n\r\n'
+            .format(path, authorization, len(data)).encode() + data)
+
+
+def run_service(scenario):
+    async def main():
+        matching = service.MatchingService()
+        server = await asyncio.start_server(matching.serve_connection, '127.0.0.1', 0)
+        try:
+            return await scenario(server.sockets[0].getsockname()[1])
+        finally:
+            server.close()
+            await server.wait_closed()
+            matching.db_executor.shutdown()
+            matching.scoring_executor.shutdown()
+    return asyncio.run(main())
+
+
+def test_swipe_on_missing_user(database):
+    add_users(database, 2)
+
+    async def scenario(port):
+        _, login = await exchange(port, post('/login', {'name': 'user1', 'password': 'password1'}))
+        missing = await exchange(port, post('/swipe', {'user_id': 999999, 'kind': 'like'}, login['token']))
+        existing = await exchange(port, post('/swipe', {'user_id': 2, 'kind': 'like'}, login['token']))
+        return missing, existing
+
+    missing, existing = run_service(scenario)
+    assert missing[0] == 404
+    assert existing == (200, {'matched': False})
+    with db.connection() as conn:
+        assert conn.execute('SELECT src, dst FROM swipes').fetchall() == [(1, 2)]
+
+
+def test_bad_content_length(database):
+    async def scenario(port):
+        return [await exchange(port, 'POST /login HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(length).encode())
+                for length in ('abc', '-5')]
+
+    for status, body in run_service(scenario):
+        assert status == 400 and 'Content-Length' in body['error']
+####################################################################################################
@@ -0,0 +1,25 @@
+"""Splitting a database places every user where the shards route them."""
+###### packages and dependencies ######
+import sqlite3
+
+from conftest import add_users
+
+import shards
+
+####################################################################################################
+def test_split_keeps_users_without_city(database, tmp_path):
+    add_users(database, 40)
+    conn = sqlite3.connect(database)
+    conn.execute('UPDATE users SET location = NULL WHERE user_id IN (1, 2)')
+    conn.commit()
+    locations = dict(conn.execute('SELECT user_id, location FROM users'))
+    conn.close()
+
+    sharded = shards.split(database, str(tmp_path / 'shards'), count=4)
+    for user_id, location in locations.items():
+        shard = sharded.shard_of(user_id)
+        assert shard == sharded.shard_for_location(location)
+        assert sharded.fetch_user(user_id) is not None
+    assert sharded.shard_of(1) == shards.FALLBACK_SHARD
+    sharded.close()
+####################################################################################################
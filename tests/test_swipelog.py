@@ -0,0 +1,27 @@
+"""Swipes buffered by a session go through the swipe log when it is on."""
+###### packages and dependencies ######
+from conftest import add_users
+
+import app
+import db
+
+####################################################################################################
+def test_session_flush_appends_to_log(database, tmp_path):
+    add_users(database, 4)
+    log = app.enable_swipe_log(str(tmp_path / 'swipes.log'))
+    try:
+        user = app.fetch_user(1)
+        session = app.SwipeSession(user, max_pending=10, max_delay_ms=10 ** 6)
+        session.like(app.fetch_user(2))
+        session.dislike(app.fetch_user(3))
+        assert session.close() == []
+        # Both decisions were logged, then applied to the database
+        assert log.next_seq - 1 == 2 and log.wait_applied(timeout=10)
+    finally:
+        log.close()
+        app.swipe_log = None
+
+    with db.connection() as conn:
+        liked, disliked, _ = db.fetch_relationships(conn, 1)
+    assert (set(liked), set(disliked)) == ({2}, {3})
+####################################################################################################
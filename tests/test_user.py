@@ -0,0 +1,30 @@
+"""Users fetched by id read their relationships from the database on first use only."""
+###### packages and dependencies ######
+from conftest import add_users
+
+import app
+import db
+
+####################################################################################################
+def test_relationships_loaded_on_first_use(database, monkeypatch):
+    add_users(database, 4)
+    app.record_swipe(1, 2, 'like')
+    app.record_swipe(2, 1, 'like')
+    app.record_swipe(1, 3, 'dislike')
+
+    calls = []
+    fetch_relationships = db.fetch_relationships
+    monkeypatch.setattr(db, 'fetch_relationships', lambda conn, user_id: calls.append(user_id)
+                        or fetch_relationships(conn, user_id))
+    user = app.fetch_user(1)
+    assert calls == []
+    assert (user.liked_users, user.disliked_users, user.matches) == ({2}, {3}, {2})
+    assert calls == [1]
+
+    # A set assigned before the first read is kept, the others still come from the database
+    user = app.fetch_user(1)
+    user.matches = {4}
+    user.liked_users.add(4)
+    assert (user.liked_users, user.disliked_users, user.matches) == ({2, 4}, {3}, {4})
+    assert calls == [1, 1]
+####################################################################################################
@@ -0,0 +1,229 @@
+"""Lightweight timing spans and counters.
+
+    PAIRFECT_TRACE=1             record spans and counters (off by default)
+    PAIRFECT_TRACE_PROFILE=10    also run cProfile per request and keep the 10 slowest
+
+While disabled, span() hands back one shared no-op context manager and traced functions
+call straight through, so instrumentation costs a flag check. Aggregates are exported in
+Prometheus text format (prometheus()); finished spans are kept in a bounded buffer that
+write_jsonl() dumps as JSON lines. Spans opened inside request() carry its name and id.
+"""
+###### packages and dependencies ######
+import functools
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+####################################################################################################
+###### Settings ######
+enabled = os.environ.get('PAIRFECT_TRACE', '') not in ('', '0')
+
+# Requests profiled with cProfile are kept when among the PROFILE_SLOWEST slowest; 0 disables it
+PROFILE_SLOWEST = int(os.environ.get('PAIRFECT_TRACE_PROFILE', '0') or 0)
+
+# Finished spans kept for write_jsonl()
+MAX_EVENTS = 100000
+
+def configure(enable=True, profile_slowest=None):
+    global enabled, PROFILE_SLOWEST
+    enabled = enable
+    if profile_slowest is not None:
+        PROFILE_SLOWEST = profile_slowest
+####################################################################################################
+
+
+####################################################################################################
+###### Recorder ######
+class SpanStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max = 0.0
+
+
+class Recorder:
+    """Aggregates per span name and counter, plus the most recent finished spans."""
+    def __init__(self, max_events=MAX_EVENTS):
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        self.events = deque(maxlen=max_events)
+        self.profiles = []
+        self.sequence = itertools.count()
+
+    def add_span(self, name, start, elapsed, request):
+        with self.lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.count += 1
+            stats.seconds += elapsed
+            stats.max = max(stats.max, elapsed)
+            event = {'span': name, 'start': start, 'seconds': elapsed}
+            if request is not None:
+                event['request'], event['request_id'] = request
+            self.events.append(event)
+
+    def add(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_profile(self, elapsed, name, profile):
+        """Keep the profile if the request is among the PROFILE_SLOWEST slowest so far."""
+        with self.lock:
+            if len(self.profiles) >= PROFILE_SLOWEST and elapsed <= self.profiles[0][0]:
+                return
+        # Only needed when profiling, and slow to import
+        import io
+        import pstats
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(30)
+        with self.lock:
+            heapq.heappush(self.profiles, (elapsed, next(self.sequence), name, text.getvalue()))
+            while len(self.profiles) > PROFILE_SLOWEST:
+                heapq.heappop(self.profiles)
+
+    def reset(self):
+        with self.lock:
+            self.spans.clear()
+            self.counters.clear()
+            self.events.clear()
+            self.profiles = []
+
+
+recorder = Recorder()
+_local = threading.local()
+_request_ids = itertools.count(1)
+####################################################################################################
+
+
+####################################################################################################
+###### Instrumentation ######
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+
+class Span:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        recorder.add_span(self.name, self.wall, time.perf_counter() - self.start,
+                          getattr(_local, 'request', None))
+        return False
+
+
+class Request(Span):
+    """Top-level span; spans opened in the same thread until it ends belong to it.
+
+    Opened inside another request, it is an ordinary span of that request.
+    """
+    def __enter__(self):
+        self.outer = getattr(_local, 'request', None) is None
+        self.profile = None
+        if self.outer:
+            _local.request = (self.name, next(_request_ids))
+            if PROFILE_SLOWEST > 0:
+                import cProfile
+                self.profile = cProfile.Profile()
+                try:
+                    self.profile.enable()
+                except ValueError:
+                    # Another profiler is active in this thread
+                    self.profile = None
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.profile is not None:
+            self.profile.disable()
+            recorder.add_profile(elapsed, self.name, self.profile)
+        super().__exit__(*exc)
+        if self.outer:
+            _local.request = None
+        return False
+
+
+def span(name):
+    """Time the with-block under name."""
+    return Span(name) if enabled else _NO_SPAN
+
+def request(name):
+    """Time a whole request (and profile it when PROFILE_SLOWEST is set)."""
+    return Request(name) if enabled else _NO_SPAN
+
+def count(name, value=1):
+    if enabled:
+        recorder.add(name, value)
+
+def traced(name):
+    """Decorator timing every call of the function as a span."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+####################################################################################################
+
+
+####################################################################################################
+###### Export ######
+def snapshot():
+    """{'spans': {name: {count, seconds, max}}, 'counters': {name: value}}."""
+    with recorder.lock:
+        return {
+            'spans': {name: {'count': stats.count, 'seconds': stats.seconds, 'max': stats.max}
+                      for name, stats in recorder.spans.items()},
+            'counters': dict(recorder.counters),
+        }
+
+def prometheus(prefix='pairfect'):
+    """Spans as a summary (count, sum) plus max, and counters, in Prometheus text format."""
+    data = snapshot()
+    lines = ['# TYPE {}_span_seconds summary'.format(prefix)]
+    for name, stats in sorted(data['spans'].items()):
+        lines.append('{}_span_seconds_count{{span="{}"}} {}'.format(prefix, name, stats['count']))
+        lines.append('{}_span_seconds_sum{{span="{}"}} {:.9f}'.format(prefix, name, stats['seconds']))
+    lines.append('# TYPE {}_span_seconds_max gauge'.format(prefix))
+    for name, stats in sorted(data['spans'].items()):
+        lines.append('{}_span_seconds_max{{span="{}"}} {:.9f}'.format(prefix, name, stats['max']))
+    for name, value in sorted(data['counters'].items()):
+        metric = '{}_{}_total'.format(prefix, name.replace('.', '_'))
+        lines.append('# TYPE {} counter'.format(metric))
+        lines.append('{} {}'.format(metric, value))
+    return '\n'.join(lines) + '\n'
+
+def write_jsonl(path):
+    """Write the buffered spans, one JSON object per line. Returns the number written."""
+    with recorder.lock:
+        events = list(recorder.events)
+    with open(path, 'w') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+    return len(events)
+
+def slowest_profiles():
+    """[(seconds, request name, cProfile report)] of the slowest profiled requests, slowest first."""
+    with recorder.lock:
+        profiles = sorted(recorder.profiles, reverse=True)
+    return [(elapsed, name, report) for elapsed, _, name, report in profiles]
+####################################################################################################
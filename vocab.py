@@ -0,0 +1,29 @@
+"""Known values of the profile fields, shared by input validation and the candidate encoding.
+
+The tuples fix the order of the codes given by candidates.Vocabulary and must only be
+appended to. The frozensets, and the range of ages, are for membership tests when validating input.
+"""
+####################################################################################################
+###### Vocabularies ######
+MBTI_TYPES = ("ISTJ", "ISFJ", "INFJ", "INTJ", "ISTP", "ISFP", "INFP", "INTP",
+              "ESTP", "ESFP", "ENFP", "ENTP", "ESTJ", "ESFJ", "ENFJ", "ENTJ")
+GENDERS = ("Female", "Male")
+CITIES = ("Barrie", "Belleville", "Brampton", "Brantford", "Burlington", "Cambridge",
+          "Greater Sudbury", "Guelph", "Hamilton", "Kitchener", "London", "Markham",
+          "Mississauga", "Niagara Falls", "Norfolk County", "North Bay", "Oshawa",
+          "Ottawa", "Peterborough", "Pickering", "Richmond Hill", "Sarnia",
+          "Sault Ste. Marie", "St. Catharines", "Thunder Bay", "Toronto", "Vaughan",
+          "Waterloo", "Welland", "Windsor")
+INTERESTS = ("Collecting", "Clothing", "Cooking", "Gardening", "Models", "Outdoors",
+             "Travelling", "Fitness", "Games", "Sports", "Dancing", "Music", "Theater",
+             "Visual", "Literary")
+GENDER_PREFERENCES = ("Female", "Male", "Both")
+MAX_AGE = 150
+
+VALID_MBTI = frozenset(MBTI_TYPES)
+VALID_GENDERS = frozenset(GENDERS)
+VALID_CITIES = frozenset(CITIES)
+VALID_INTERESTS = frozenset(INTERESTS)
+VALID_GENDER_PREFERENCES = frozenset(GENDER_PREFERENCES)
+VALID_AGES = range(1, MAX_AGE + 1)
+####################################################################################################